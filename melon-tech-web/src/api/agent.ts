@@ -64,3 +64,109 @@ export async function getRunStatus(runId: number): Promise<AgentRunStatus> {
     const res = await api.get(`/runs/${runId}`)
     return res.data
 }
+
+export interface AgentRunMessage extends AgentMessage {
+    // false once the message is final; chunkId = last stream chunk folded into content
+    streaming: boolean
+    chunkId: number
+}
+
+export interface AgentRunDelta {
+    messageId: number
+    kind: 'visible' | 'thinking' | 'tool_calls'
+    text: string
+}
+
+export interface AgentRunEventHandlers {
+    onMessage?: (msg: AgentRunMessage) => void
+    onDelta?: (delta: AgentRunDelta, eventId: number) => void
+    onStatus?: (status: AgentRunStatus) => void
+    onDone?: (status: string | null) => void
+    // The stream cannot be used (unsupported or closed by the server); fall back to polling
+    onError?: () => void
+}
+
+// Server-sent events for a run; EventSource reconnects with Last-Event-ID by itself.
+// Returns a function that closes the stream.
+export function subscribeRunEvents(runId: number, handlers: AgentRunEventHandlers): () => void {
+    if (typeof EventSource === 'undefined') {
+        handlers.onError?.()
+        return () => {}
+    }
+    const es = new EventSource(`/api/agent/runs/${runId}/events`, { withCredentials: true })
+    let finished = false
+    const parse = (e: MessageEvent) => {
+        try {
+            return JSON.parse(e.data)
+        } catch {
+            return null
+        }
+    }
+    es.addEventListener('message', (e) => {
+        const data = parse(e as MessageEvent)
+        if (data) handlers.onMessage?.(data)
+    })
+    es.addEventListener('delta', (e) => {
+        const data = parse(e as MessageEvent)
+        const id = Number((e as MessageEvent).lastEventId)
+        if (data) handlers.onDelta?.(data, id)
+    })
+    es.addEventListener('status', (e) => {
+        const data = parse(e as MessageEvent)
+        if (data) handlers.onStatus?.(data)
+    })
+    es.addEventListener('done', (e) => {
+        finished = true
+        es.close()
+        const data = parse(e as MessageEvent)
+        handlers.onDone?.(data ? data.status : null)
+    })
+    es.onerror = () => {
+        // Network errors are retried by the browser; CLOSED means it gave up (e.g. 401/404)
+        if (!finished && es.readyState === EventSource.CLOSED) {
+            handlers.onError?.()
+        }
+    }
+    return () => {
+        finished = true
+        es.close()
+    }
+}
+
+// Apply a streamed delta to a message, mirroring the server's tool-call merging.
+export function applyRunDelta(msg: AgentMessage, delta: AgentRunDelta): void {
+    const payload: any = msg.payload && typeof msg.payload === 'object' ? msg.payload : { visible: msg.content || '' }
+    if (delta.kind === 'visible') {
+        payload.visible = (payload.visible || '') + delta.text
+        msg.content = payload.visible
+    } else if (delta.kind === 'thinking') {
+        payload.thinking = (payload.thinking || '') + delta.text
+    } else if (delta.kind === 'tool_calls') {
+        let parts: any[] = []
+        try {
+            parts = JSON.parse(delta.text)
+        } catch {
+            parts = []
+        }
+        const acc: any[] = Array.isArray(payload.tool_calls) ? payload.tool_calls : (payload.tool_calls = [])
+        for (const tc of Array.isArray(parts) ? parts : []) {
+            if (!tc || typeof tc !== 'object') continue
+            const idx = Number.isInteger(tc.index) && tc.index >= 0 ? tc.index : 0
+            while (acc.length <= idx) acc.push({ id: null, type: null, function: { name: null, arguments: '' } })
+            const item = acc[idx]
+            if (typeof tc.id === 'string' && tc.id) item.id = tc.id
+            if (typeof tc.type === 'string' && tc.type) item.type = tc.type
+            const fn = tc.function
+            if (fn && typeof fn === 'object' && typeof fn.name === 'string' && fn.name) {
+                item.function = item.function || { name: null, arguments: '' }
+                item.function.name = fn.name
+                if (typeof fn.arguments === 'string') {
+                    item.function.arguments = (item.function.arguments || '') + fn.arguments
+                } else if (fn.arguments != null) {
+                    item.function.arguments = (item.function.arguments || '') + JSON.stringify(fn.arguments)
+                }
+            }
+        }
+    }
+    msg.payload = payload
+}
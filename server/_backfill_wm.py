@@ -0,0 +1,174 @@
+"""Backfill stored canonical sequences for watermarked uploads.
+
+Files uploaded before file_sequences existed only have file_watermarks rows;
+near-duplicate checks then have to download and re-parse them. This walks
+those files (oldest first), extracts their canonical sequence in a process
+pool and stores it (plus the MinHash/LSH rows when missing).
+
+Usage:
+  python -m server._backfill_wm --jobs 4
+  python -m server._backfill_wm --jobs 4 --checkpoint wm_backfill.json --retry-failed
+
+The checkpoint records the highest file id whose batch was committed and the
+files that failed, so an interrupted run resumes where it stopped. Files that
+already have a file_sequences row are always skipped.
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from .db import get_connection, run_migrations
+from .files import TEMP_DIR, UPLOAD_DIR
+from .label import minhash
+from .label.watermark_indexer import canonicalize, extract_sequence_from_melsave
+from .utils import nanoid
+from .wm_sequences import store_minhash, store_sequence
+from . import storage as r2
+
+
+def load_checkpoint(path: str) -> dict:
+    if not path or not os.path.exists(path):
+        return {"last_file_id": 0, "failed": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_checkpoint(path: str, obj: dict) -> None:
+    if not path:
+        return
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def walk_pending(cur, after_id: int, retry: List[int]) -> List[Tuple[int, str]]:
+    """(file_id, stored_name) of watermarked files still missing a stored sequence."""
+    rows = cur.execute(
+        """
+        SELECT fw.file_id, rf.stored_name
+        FROM file_watermarks fw
+        JOIN resource_files rf ON rf.id = fw.file_id
+        LEFT JOIN file_sequences fs ON fs.file_id = fw.file_id
+        WHERE fs.file_id IS NULL
+        ORDER BY fw.file_id
+        """
+    ).fetchall()
+    retry_ids = set(retry)
+    return [
+        (int(r["file_id"]), r["stored_name"])
+        for r in rows
+        if int(r["file_id"]) > after_id or int(r["file_id"]) in retry_ids
+    ]
+
+
+def index_one(item: Tuple[int, str]) -> Dict:
+    """Worker: fetch one stored save and return its canonical sequence + signature."""
+    file_id, stored_name = item
+    tmp_path = None
+    try:
+        if "/" not in stored_name:
+            path = UPLOAD_DIR / stored_name
+        else:
+            TEMP_DIR.mkdir(parents=True, exist_ok=True)
+            tmp_path = TEMP_DIR / f"backfill-{nanoid()}{Path(stored_name).suffix}"
+            tmp_path.write_bytes(r2.download_bytes(stored_name))
+            path = tmp_path
+        raw_seq, _embedded = extract_sequence_from_melsave(str(path))
+        seq = canonicalize([str(x) for x in raw_seq])
+        return {
+            "file_id": file_id,
+            "sequence": seq,
+            "signature": minhash.signature(seq),
+            "bytes": path.stat().st_size,
+        }
+    except Exception as ex:
+        return {"file_id": file_id, "error": f"{type(ex).__name__}: {ex}"}
+    finally:
+        if tmp_path is not None:
+            tmp_path.unlink(missing_ok=True)
+
+
+def _commit_batch(conn, results: List[Dict], failed: Dict[str, str]) -> int:
+    cur = conn.cursor()
+    have_minhash = set()
+    ok_ids = [r["file_id"] for r in results if "error" not in r]
+    if ok_ids:
+        ph = ",".join(["?"] * len(ok_ids))
+        have_minhash = {
+            int(r["file_id"])
+            for r in cur.execute(
+                f"SELECT file_id FROM file_minhash WHERE file_id IN ({ph})", tuple(ok_ids)
+            ).fetchall()
+        }
+    stored = 0
+    cur.execute("BEGIN")
+    try:
+        for res in results:
+            fid = res["file_id"]
+            if "error" in res:
+                failed[str(fid)] = res["error"]
+                print(f"[ERR] fileId={fid}: {res['error']}")
+                continue
+            store_sequence(cur, fid, res["sequence"])
+            if fid not in have_minhash:
+                store_minhash(cur, fid, res["signature"], len(res["sequence"]))
+            failed.pop(str(fid), None)
+            stored += 1
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return stored
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--jobs", type=int, default=os.cpu_count() or 2)
+    ap.add_argument("--batch", type=int, default=50)
+    ap.add_argument("--checkpoint", default="wm_backfill.json")
+    ap.add_argument("--retry-failed", action="store_true")
+    args = ap.parse_args()
+
+    run_migrations()
+    conn = get_connection()
+    ckpt = load_checkpoint(args.checkpoint)
+    failed: Dict[str, str] = ckpt.get("failed", {})
+    retry = [int(k) for k in failed] if args.retry_failed else []
+    pending = walk_pending(conn.cursor(), int(ckpt.get("last_file_id", 0)), retry)
+    if not pending:
+        print("没有需要回填的文件")
+        return
+    print(f"待回填 {len(pending)} 个文件，jobs={args.jobs} batch={args.batch}")
+
+    pool = ProcessPoolExecutor(max_workers=args.jobs) if args.jobs > 1 else None
+    started = time.monotonic()
+    done = 0
+    nbytes = 0
+    try:
+        for i in range(0, len(pending), args.batch):
+            batch = pending[i:i + args.batch]
+            results = list(pool.map(index_one, batch) if pool else map(index_one, batch))
+            done += _commit_batch(conn, results, failed)
+            nbytes += sum(r.get("bytes", 0) for r in results)
+            ckpt["last_file_id"] = max(ckpt.get("last_file_id", 0), batch[-1][0])
+            ckpt["failed"] = failed
+            save_checkpoint(args.checkpoint, ckpt)
+            elapsed = max(time.monotonic() - started, 1e-9)
+            print(
+                f"[{min(i + args.batch, len(pending))}/{len(pending)}] stored={done} failed={len(failed)} "
+                f"{done / elapsed:.1f} files/s {nbytes / elapsed / 1e6:.1f} MB/s"
+            )
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        conn.close()
+    print(f"完成：stored={done} failed={len(failed)} checkpoint={os.path.abspath(args.checkpoint)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import os, sys, threading, time
+sys.path.insert(0, os.getcwd())
+os.environ["AGENT_RUN_HEARTBEAT"] = "1"
+os.environ["AGENT_POLL_INTERVAL"] = "0.2"
+os.environ["AGENT_RUN_STALE_SECONDS"] = "3"
+from server import agent_scheduler
+from server.agent_scheduler import AgentRunScheduler
+from server.db import get_connection, run_migrations
+
+run_migrations()
+
+
+def queue_run():
+    conn = get_connection()
+    try:
+        user_id = conn.execute(
+            "INSERT INTO users (username, password_hash) VALUES (?, 'x')", (f"hb{time.time_ns()}",)
+        ).lastrowid
+        session_id = conn.execute("INSERT INTO agent_sessions (user_id) VALUES (?)", (user_id,)).lastrowid
+        return conn.execute(
+            "INSERT INTO agent_runs (session_id, user_id, status) VALUES (?, ?, 'pending')",
+            (session_id, user_id),
+        ).lastrowid
+    finally:
+        conn.close()
+
+
+def status(run_id):
+    conn = get_connection()
+    try:
+        return conn.execute("SELECT status FROM agent_runs WHERE id = ?", (run_id,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def long_run(heartbeat):
+    """Run a 6s handler and let another process look for stale runs after 4.5s."""
+    agent_scheduler.AGENT_RUN_HEARTBEAT = heartbeat
+    run_id = queue_run()
+    calls = []
+    release = threading.Event()
+
+    def handler(rid):
+        calls.append(rid)
+        release.wait(10)
+
+    sched = AgentRunScheduler(handler, workers=1)
+    sched.start()
+    try:
+        time.sleep(4.5)
+        # A second process starting up against the same database
+        recovered = AgentRunScheduler(lambda rid: None).recover_stale()
+    finally:
+        release.set()
+        sched.stop()
+    st = status(run_id)
+    # stop() leaves an unfinished run as `running`; finish it so the next case starts clean
+    conn = get_connection()
+    try:
+        conn.execute("UPDATE agent_runs SET status = 'succeeded' WHERE id = ?", (run_id,))
+    finally:
+        conn.close()
+    return recovered, st, calls
+
+
+recovered, st, calls = long_run(1)
+print("heartbeat", recovered, st, calls)
+assert recovered == 0 and st == "running" and len(calls) == 1
+
+# Without heartbeats the same healthy run looks orphaned and would run twice
+recovered, st, calls = long_run(1000)
+print("no heartbeat", recovered, st)
+assert recovered == 1 and st == "pending"
+print("ok")
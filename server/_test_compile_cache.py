@@ -0,0 +1,48 @@
+import ast, os, sys, tempfile
+from pathlib import Path
+
+# Run from the repo root: python server/_test_compile_cache.py
+GEN_DIR = Path(__file__).resolve().parent / "全自动生成v2.3.11"
+sys.path.insert(0, str(GEN_DIR))
+os.environ["DSL_CACHE_DIR"] = tempfile.mkdtemp(prefix="dsl_cache_test_")
+
+from bench_pipeline import SHAPES, synth_program
+from src.converter import compile_cache
+from src.converter.dedup_converter import DedupConverter
+
+
+def full_conversion(src):
+    cvt = DedupConverter()
+    cvt.visit(ast.parse(src))
+    cvt.resolve_unresolved()
+    cvt.finalize_outputs()
+    return cvt.g.to_dict()
+
+
+def cached(src):
+    return compile_cache.compile_graph(ast.parse(src), DedupConverter)
+
+
+cache_dir = Path(os.environ["DSL_CACHE_DIR"])
+for shape in SHAPES:
+    src = synth_program(shape, 60)
+    expected = full_conversion(src)
+
+    graph, stats = cached(src)
+    print(shape, "cold", stats.hit, stats.reused, stats.converted)
+    assert stats.hit == "miss" and graph == expected
+
+    graph, stats = cached(src)
+    print(shape, "full", stats.hit, stats.reused, stats.converted)
+    assert stats.hit == "full" and graph == expected
+
+    # Append a statement: everything before it comes from a snapshot
+    edited = src.rstrip("\n") + '\nextra = OUTPUT(INPUT=TIME()["DELTA TIME"], attrs={"name": "#extra", "data_type": 2})\n'
+    graph, stats = cached(edited)
+    print(shape, "prefix", stats.hit, stats.reused, stats.converted)
+    assert stats.hit == "prefix" and stats.reused > 0
+    assert graph == full_conversion(edited)
+
+# Snapshots are only read from a directory private to this user
+assert (cache_dir.stat().st_mode & 0o777) == 0o700
+print("ok")
@@ -0,0 +1,53 @@
+import os, random, sys
+sys.path.insert(0, os.getcwd())
+from server.label import fnv
+
+
+def old_fnv1a64(seq):
+    # The per-token, per-byte loop watermark_indexer used before label/fnv.py
+    FNV_OFFSET = 14695981039346656037
+    FNV_PRIME = 1099511628211
+    h = FNV_OFFSET
+    for idx, tok in enumerate(seq):
+        piece = f"{idx}#{tok}".encode("utf-8", errors="ignore")
+        for b in piece:
+            h ^= b
+            h = (h * FNV_PRIME) & 0xFFFFFFFFFFFFFFFF
+    return h
+
+
+def check(seq, want=None):
+    got = fnv.fnv1a64(seq)
+    got_py = fnv.fnv1a64_bytes_py(fnv.sequence_bytes(seq))
+    old = old_fnv1a64(seq)
+    assert got == got_py == old, (seq[:5], got, got_py, old)
+    if want is not None:
+        assert got == want, (seq[:5], hex(got), hex(want))
+
+
+print("native", fnv.HAS_NATIVE)
+
+# Published FNV-1a 64 test vectors
+for data, want in ((b"", 0xCBF29CE484222325), (b"a", 0xAF63DC4C8601EC8C), (b"foobar", 0x85944171F73967E8)):
+    assert fnv.fnv1a64_bytes(data) == want, data
+    assert fnv.fnv1a64_bytes_py(data) == want, data
+
+# Watermarks of token sequences; these values are stored in the database
+check([], 0xCBF29CE484222325)
+check(["a"], 0x4E3E11181D2994FF)
+check(["12", "7", "12", "300"], 0xFBF9DD32FB4C3E3B)
+check(["芯片", "水印", "melon"], 0xD736166195773FCA)
+check([str(i) for i in range(1000)], 0xFF661C4897ED2CD7)
+
+# Lone surrogates are dropped by errors="ignore"; joining the tokens first must
+# not pair up halves that were encoded separately before
+check(["bad\ud800surrogate", "ok"], 0x784C99B31A5716E9)
+check(["\ud83d", "\ude00"], 0x1E1BC7F98E8EEEA4)
+check(["😀"])
+
+rnd = random.Random(7)
+for n in (2, 3, 17, 500):
+    check([str(rnd.randrange(1, 400)) for _ in range(n)])
+    check(["".join(rnd.choice("ab芯\ud800") for _ in range(rnd.randrange(0, 6))) for _ in range(n)])
+
+print("ok")
@@ -0,0 +1,43 @@
+import os, sys, time
+sys.path.insert(0, os.getcwd())
+from pathlib import Path
+from fastapi.testclient import TestClient
+from server.app import app
+from server.db import run_migrations
+from server.watermark_service import service as wm_service
+
+run_migrations()
+
+client = TestClient(app)
+sample = sorted((Path("server") / "全自动生成v2.3.11").glob("*.melsave"))[0]
+
+
+def check():
+    with sample.open("rb") as f:
+        return client.post("/api/watermark/check", files={"file": (sample.name, f)})
+
+
+r = check()
+print("check", r.status_code, r.json().get("watermark"))
+assert r.status_code == 200
+watermark = r.json()["watermark"]
+
+# A worker dying (e.g. OOM on a large save) breaks the whole executor
+pool = wm_service._pool
+for proc in list(pool._processes.values()):
+    proc.kill()
+time.sleep(0.5)
+
+r = check()
+print("after kill", r.status_code, r.json())
+assert r.status_code == 503
+
+# The broken pool was dropped; the next job gets a fresh one
+r = check()
+print("recovered", r.status_code, r.json().get("watermark"))
+assert r.status_code == 200 and r.json()["watermark"] == watermark
+assert wm_service._pool is not pool
+assert wm_service.stats()["pending"] == 0
+
+wm_service.shutdown()
+print("ok")
@@ -12,16 +12,14 @@ from langchain_openai import ChatOpenAI
 
 from ..melsave import generate_melsave_bytes
 from ..utils import nanoid
+from .prompts import registry as prompt_registry
+from .tools import executor as tool_executor
 
 
 logger = logging.getLogger("msut.agent.langchain")
 
 
 SERVER_DIR = Path(__file__).resolve().parent.parent
-PROMPT_FILES = [
-    SERVER_DIR / "agent" / "全自动生成.txt",
-    SERVER_DIR / "agent" / "芯片教程.txt",
-]
 UPLOADS_DIR = SERVER_DIR / "uploads"
 
 AGENT_API_BASE = (os.getenv("AGENT_API_BASE") or os.getenv("RAG_API_BASE") or "").strip().rstrip("/")
@@ -37,17 +35,7 @@ MAX_TOOL_LOOPS = 3
 
 
 def _load_prompt() -> str:
-    parts: List[str] = []
-    for p in PROMPT_FILES:
-        try:
-            text = p.read_text(encoding="utf-8")
-            if text.strip():
-                parts.append(text.strip())
-        except Exception:
-            continue
-    if parts:
-        return "\n\n".join(parts)
-    return "你是 MSUT 的自动化芯片生成代理，请用中文回答，并在需要生成 .melsave 时调用生成工具。"
+    return prompt_registry.get().text
 
 
 def _flatten_content(value) -> str:
@@ -292,7 +280,6 @@ def run_agent_with_langchain(
     @tool("generate_melsave")
     def generate_melsave_tool(dsl: str) -> dict:
         """生成 melsave 文件并保存到服务器。参数为 DSL 字符串。返回包含文件信息的字典。"""
-        nonlocal result_url, result_name
         dsl_str = dsl if isinstance(dsl, str) else str(dsl)
         if not dsl_str.strip():
             fallback = _guess_dsl_from_messages(assistant_messages)
@@ -306,14 +293,15 @@ def run_agent_with_langchain(
                     pass
                 dsl_str = fallback
         try:
-            res = _store_tool_file(dsl_str)
-            file_info = res.get("file") or {}
-            result_url = file_info.get("url") or result_url
-            result_name = file_info.get("filename") or result_name
-            return res
+            return _store_tool_file(dsl_str)
         except Exception as e:
             return {"ok": False, "error": f"生成失败: {e}"}
 
+    def _invoke_tool(name: str, args: dict) -> dict:
+        if name == "generate_melsave":
+            return generate_melsave_tool.invoke({"dsl": args.get("dsl", "")})
+        return {"ok": False, "error": f"未知工具: {name}"}
+
     llm_with_tools = llm.bind_tools([generate_melsave_tool])
 
     loop = 0
@@ -328,6 +316,9 @@ def run_agent_with_langchain(
         if not tool_calls:
             break
 
+        # Parse every call first, run them concurrently on the shared tool
+        # pool, then record the results in call order.
+        prepared: List[tuple] = []
         for call in tool_calls:
             if not isinstance(call, dict):
                 # langchain-openai 当前返回 dict 风格的 tool_calls，这里做一层防御
@@ -348,10 +339,17 @@ def run_agent_with_langchain(
             except Exception:
                 args_json = "{}"
 
-            if name == "generate_melsave":
-                tool_result = generate_melsave_tool.invoke({"dsl": args.get("dsl", "")})
-            else:
-                tool_result = {"ok": False, "error": f"未知工具: {name}"}
+            prepared.append((name, args, call_id, args_json))
+
+        tool_results = tool_executor.run_all(
+            [lambda name=name, args=args: _invoke_tool(name, args) for name, args, _, _ in prepared]
+        )
+
+        for (name, _, call_id, args_json), tool_result in zip(prepared, tool_results):
+            if isinstance(tool_result, dict) and tool_result.get("ok"):
+                file_info = tool_result.get("file") or {}
+                result_url = file_info.get("url") or result_url
+                result_name = file_info.get("filename") or result_name
 
             tool_messages.append(
                 ToolCallRecord(
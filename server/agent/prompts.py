@@ -0,0 +1,147 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+
+logger = logging.getLogger("msut.agent.prompts")
+
+SERVER_DIR = Path(__file__).resolve().parent.parent
+PROMPT_FILES = [
+    SERVER_DIR / "agent" / "全自动生成.txt",
+    SERVER_DIR / "agent" / "芯片教程.txt",
+]
+FALLBACK_PROMPT = "你是 MSUT 的自动化芯片生成代理，请用中文回答，并在需要生成 .melsave 时调用生成工具。"
+
+# Minimum seconds between mtime checks of the prompt files; 0 = check on every get()
+AGENT_PROMPT_CHECK_INTERVAL = max(0.0, float(os.getenv("AGENT_PROMPT_CHECK_INTERVAL", "2")))
+
+# CJK ideographs, kana, hangul and fullwidth punctuation: about one token each
+_WIDE_RE = re.compile(r"[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]")
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for budget decisions.
+
+    No tokenizer ships with the server; this over-estimates slightly for
+    typical BPE vocabularies (one token per CJK character, one per four other
+    characters), which is the safe side for trimming.
+    """
+    if not text:
+        return 0
+    wide = len(_WIDE_RE.findall(text))
+    return wide + (len(text) - wide + 3) // 4
+
+
+def normalize_prompt(text: str) -> str:
+    """Canonical form of a prompt file: LF newlines, no trailing spaces, at most one blank line in a row."""
+    text = text.replace("\r\n", "\n").replace("\r", "\n").lstrip("\ufeff")
+    text = "\n".join(line.rstrip() for line in text.split("\n"))
+    return _BLANK_LINES_RE.sub("\n\n", text).strip()
+
+
+@dataclass(frozen=True)
+class SystemPrompt:
+    text: str
+    tokens: int
+    # Short content hash; stable across restarts while the files are unchanged
+    digest: str
+    loaded_at: float
+
+
+class PromptRegistry:
+    """The agent system prompt, loaded once and reloaded when its files change.
+
+    The text is byte-identical between requests as long as the files are, so
+    it forms a stable request prefix for providers with prompt caching.
+    """
+
+    def __init__(
+        self,
+        files: Sequence[Path] = PROMPT_FILES,
+        fallback: str = FALLBACK_PROMPT,
+        check_interval: float = AGENT_PROMPT_CHECK_INTERVAL,
+    ):
+        self.files = list(files)
+        self.fallback = fallback
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._prompt: Optional[SystemPrompt] = None
+        self._signature: Optional[Tuple] = None
+        self._checked_at = 0.0
+        self._loads = 0
+
+    def _file_signature(self) -> Tuple:
+        sig: List[Tuple] = []
+        for p in self.files:
+            try:
+                st = p.stat()
+                sig.append((str(p), st.st_mtime_ns, st.st_size))
+            except OSError:
+                sig.append((str(p), None, None))
+        return tuple(sig)
+
+    def _build(self) -> SystemPrompt:
+        parts: List[str] = []
+        for p in self.files:
+            try:
+                text = normalize_prompt(p.read_text(encoding="utf-8"))
+            except Exception as ex:
+                logger.warning("agent prompt: cannot read %s: %s", p, ex)
+                continue
+            if text:
+                parts.append(text)
+        text = "\n\n".join(parts) if parts else self.fallback
+        return SystemPrompt(
+            text=text,
+            tokens=estimate_tokens(text),
+            digest=hashlib.sha256(text.encode("utf-8")).hexdigest()[:16],
+            loaded_at=time.time(),
+        )
+
+    def load(self) -> SystemPrompt:
+        """(Re)read the prompt files now."""
+        with self._lock:
+            return self._load_locked(self._file_signature())
+
+    def _load_locked(self, sig: Tuple) -> SystemPrompt:
+        prompt = self._build()
+        if self._prompt is not None and prompt.digest != self._prompt.digest:
+            logger.info("agent prompt reloaded: tokens=%s digest=%s", prompt.tokens, prompt.digest)
+        self._prompt = prompt
+        self._signature = sig
+        self._checked_at = time.monotonic()
+        self._loads += 1
+        return prompt
+
+    def get(self) -> SystemPrompt:
+        prompt = self._prompt
+        if prompt is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return prompt
+        with self._lock:
+            sig = self._file_signature()
+            if self._prompt is not None and sig == self._signature:
+                self._checked_at = time.monotonic()
+                return self._prompt
+            return self._load_locked(sig)
+
+    def stats(self) -> Dict:
+        prompt = self.get()
+        return {
+            "files": [p.name for p in self.files],
+            "chars": len(prompt.text),
+            "tokens": prompt.tokens,
+            "digest": prompt.digest,
+            "loadedAt": int(prompt.loaded_at),
+            "loads": self._loads,
+            "checkIntervalSeconds": self.check_interval,
+        }
+
+
+registry = PromptRegistry()
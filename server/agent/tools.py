@@ -0,0 +1,121 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Deque, Dict, List, Optional, Sequence, TypeVar
+
+
+logger = logging.getLogger("msut.agent.tools")
+
+T = TypeVar("T")
+
+# Tool calls executing at once across all runs. A generate_melsave call is a
+# generator subprocess plus an R2 upload, so threads are enough here.
+AGENT_TOOL_WORKERS = max(1, int(os.getenv("AGENT_TOOL_WORKERS", "4")))
+# Tool calls of one LLM turn executing at once; 1 = one after another
+AGENT_TOOL_PARALLEL = max(1, int(os.getenv("AGENT_TOOL_PARALLEL", "3")))
+_RECENT_BATCHES = 200
+
+
+class ToolExecutor:
+    """Runs the tool calls of one agent turn concurrently, results in call order.
+
+    The pool is shared by all agent runs (AGENT_TOOL_WORKERS); each batch
+    keeps at most AGENT_TOOL_PARALLEL of its calls in flight, so one run with
+    many tool calls cannot take every worker.
+    """
+
+    def __init__(self, workers: int = AGENT_TOOL_WORKERS, per_run: int = AGENT_TOOL_PARALLEL):
+        self.workers = workers
+        self.per_run = per_run
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._calls = 0
+        self._failed = 0
+        self._max_batch = 0
+        # (batch wall ms, sum of per-call ms): their ratio is the speed-up
+        self._recent: Deque[tuple] = deque(maxlen=_RECENT_BATCHES)
+
+    def _get_pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="agent-tool")
+            return self._pool
+
+    def _timed(self, fn: Callable[[], T]) -> tuple:
+        started = time.monotonic()
+        try:
+            return fn(), None, (time.monotonic() - started) * 1000.0
+        except Exception as ex:
+            return None, ex, (time.monotonic() - started) * 1000.0
+
+    def run_all(self, calls: Sequence[Callable[[], T]]) -> List[T]:
+        """Run calls and return their results in the same order.
+
+        If any call raised, the first such exception (in call order) is
+        re-raised after all calls have finished.
+        """
+        if not calls:
+            return []
+        started = time.monotonic()
+        outcomes: List[Optional[tuple]] = [None] * len(calls)
+        if len(calls) == 1 or self.per_run <= 1:
+            for i, fn in enumerate(calls):
+                outcomes[i] = self._timed(fn)
+        else:
+            pool = self._get_pool()
+            pending: Dict[Future, int] = {}
+            next_idx = 0
+            while next_idx < len(calls) or pending:
+                while next_idx < len(calls) and len(pending) < self.per_run:
+                    pending[pool.submit(self._timed, calls[next_idx])] = next_idx
+                    next_idx += 1
+                done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                for fut in done:
+                    outcomes[pending.pop(fut)] = fut.result()
+        wall_ms = (time.monotonic() - started) * 1000.0
+        errors = [o[1] for o in outcomes if o is not None and o[1] is not None]
+        with self._lock:
+            self._batches += 1
+            self._calls += len(calls)
+            self._failed += len(errors)
+            self._max_batch = max(self._max_batch, len(calls))
+            self._recent.append((wall_ms, sum(o[2] for o in outcomes if o is not None)))
+        if len(calls) > 1:
+            logger.info(
+                "agent tools: calls=%s wall_ms=%.0f sum_ms=%.0f",
+                len(calls),
+                wall_ms,
+                self._recent[-1][1],
+            )
+        if errors:
+            raise errors[0]
+        return [o[0] for o in outcomes if o is not None]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            recent = list(self._recent)
+            wall = sum(r[0] for r in recent)
+            total = sum(r[1] for r in recent)
+            return {
+                "workers": self.workers,
+                "perRun": self.per_run,
+                "batches": self._batches,
+                "calls": self._calls,
+                "failed": self._failed,
+                "maxBatch": self._max_batch,
+                # Sum of call durations / batch wall time over recent batches
+                "speedup": round(total / wall, 2) if wall > 0 else 1.0,
+            }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+executor = ToolExecutor()
@@ -1,15 +1,21 @@
+import asyncio
 import json
 import logging
 import os
+import time
 import requests
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, Iterable, List, Optional, Tuple
 
-from fastapi import APIRouter, BackgroundTasks, Body, Query, Request
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Body, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 
-from .agent.langchain_agent import AgentRunResult, run_agent_with_langchain, _load_prompt
-from .auth import get_current_user
+from .agent.langchain_agent import AgentRunResult, run_agent_with_langchain
+from .agent.prompts import estimate_tokens, registry as prompt_registry
+from .agent.tools import executor as tool_executor
+from .agent_events import TERMINAL_STATUSES, RunEvent, bus as run_events
+from .agent_scheduler import AgentQueueFull, AgentRunScheduler
+from .auth import get_current_user, ops_access_denied
 from .db import get_connection
 from .melsave import generate_melsave_bytes
 from .utils import nanoid
@@ -51,6 +57,23 @@ router = APIRouter()
 logger = logging.getLogger("msut.agent")
 
 HISTORY_LIMIT = 30
+# SiliconFlow /chat/completions 要求 messages 长度在 1-10 之间（含 system）
+LLM_MAX_MESSAGES = 10
+# Estimated tokens of conversation history sent per request, on top of the
+# system prompt; older messages are dropped first. 0 = no token budget
+AGENT_HISTORY_TOKENS = max(0, int(os.getenv("AGENT_HISTORY_TOKENS", "6000")))
+# How to mark the system prompt as a cacheable prefix for the provider:
+#   ""              nothing extra (automatic prefix caching still applies)
+#   "key"           OpenAI-style `prompt_cache_key` derived from the prompt digest
+#   "cache_control" Anthropic-style cache_control block on the system message
+AGENT_PROMPT_CACHE = (os.getenv("AGENT_PROMPT_CACHE") or "").strip().lower()
+
+# Streamed assistant output is persisted at most every AGENT_STREAM_FLUSH_MS
+# milliseconds, or sooner once AGENT_STREAM_FLUSH_CHARS characters are pending
+AGENT_STREAM_FLUSH_MS = max(0, int(os.getenv("AGENT_STREAM_FLUSH_MS", "250")))
+AGENT_STREAM_FLUSH_CHARS = max(1, int(os.getenv("AGENT_STREAM_FLUSH_CHARS", "512")))
+# Idle seconds between SSE keepalives (each also re-checks the run status)
+AGENT_SSE_KEEPALIVE = float(os.getenv("AGENT_SSE_KEEPALIVE", "15"))
 
 
 def _require_user_id(request: Request) -> Optional[int]:
@@ -82,19 +105,174 @@ def _insert_message(
     tool_args: Optional[str] = None,
     tool_call_id: Optional[str] = None,
     run_id: Optional[int] = None,
+    visible: Optional[str] = None,
+    streaming: bool = False,
 ):
+    """Insert a message; `visible` is the user-facing text of an assistant
+    message whose content is a JSON payload (read back by _history_messages)."""
     cur = conn.cursor()
     cur.execute(
         """
-        INSERT INTO agent_messages (session_id, run_id, role, content, tool_name, tool_args, tool_call_id)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
+        INSERT INTO agent_messages (session_id, run_id, role, content, visible, tool_name, tool_args, tool_call_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         """,
-        (session_id, run_id, role, content, tool_name, tool_args, tool_call_id),
+        (session_id, run_id, role, content, visible, tool_name, tool_args, tool_call_id),
     )
-    return int(cur.lastrowid)
+    msg_id = int(cur.lastrowid)
+    if run_id is not None:
+        _publish_message(
+            run_id,
+            {
+                "id": msg_id,
+                "run_id": run_id,
+                "role": role,
+                "content": content,
+                "tool_name": tool_name,
+                "tool_args": tool_args,
+                "tool_call_id": tool_call_id,
+                "created_at": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()),
+            },
+            streaming=streaming,
+        )
+    return msg_id
+
+
+def _message_event_data(row, chunks=None, *, chunk_id: int = 0, streaming: bool = False) -> dict:
+    """Payload of a `message` SSE event.
+
+    chunkId is the last agent_message_chunks id folded into the content;
+    clients should ignore a streaming message whose chunkId is below the last
+    delta id they applied to it, and always take a non-streaming (final) one.
+    """
+    item = _serialize_message_row(row, chunks)
+    item["streaming"] = streaming
+    item["chunkId"] = chunk_id
+    return item
 
 
-def _serialize_message_row(row) -> dict:
+def _publish_message(run_id: int, row, *, streaming: bool = False) -> None:
+    if run_events.has_subscribers(run_id):
+        run_events.publish(run_id, "message", _message_event_data(row, streaming=streaming))
+
+
+def _merge_tool_call_deltas(tool_calls_acc: List[dict], deltas: Iterable) -> None:
+    """Fold streamed function-calling fragments into tool_calls_acc (by index)."""
+    for tc in deltas:
+        if not isinstance(tc, dict):
+            continue
+        idx = tc.get("index", 0) or 0
+        if not isinstance(idx, int) or idx < 0:
+            idx = 0
+        while len(tool_calls_acc) <= idx:
+            tool_calls_acc.append(
+                {
+                    "id": None,
+                    "type": None,
+                    "function": {"name": None, "arguments": ""},
+                }
+            )
+        acc = tool_calls_acc[idx]
+        if not isinstance(acc, dict):
+            continue
+        tc_id = tc.get("id")
+        if isinstance(tc_id, str) and tc_id:
+            acc["id"] = tc_id
+        tc_type = tc.get("type")
+        if isinstance(tc_type, str) and tc_type:
+            acc["type"] = tc_type
+        fn_delta = tc.get("function") or {}
+        if isinstance(fn_delta, dict):
+            fn_name = fn_delta.get("name")
+            if isinstance(fn_name, str) and fn_name:
+                acc_fn = acc.get("function") or {}
+                if not isinstance(acc_fn, dict):
+                    acc_fn = {"name": None, "arguments": ""}
+                acc_fn["name"] = fn_name
+                args_part = fn_delta.get("arguments")
+                if isinstance(args_part, str):
+                    prev = acc_fn.get("arguments") or ""
+                    acc_fn["arguments"] = f"{prev}{args_part}"
+                elif args_part is not None:
+                    prev = acc_fn.get("arguments") or ""
+                    acc_fn["arguments"] = f"{prev}{json.dumps(args_part, ensure_ascii=False)}"
+                acc["function"] = acc_fn
+
+
+def _apply_stream_chunks(payload: dict, chunks: Iterable[Tuple[str, str]]) -> None:
+    """Replay agent_message_chunks rows (kind, text) onto an assistant payload."""
+    for kind, text in chunks:
+        if kind == "visible":
+            payload["visible"] = f"{payload.get('visible') or ''}{text}"
+        elif kind == "thinking":
+            payload["thinking"] = f"{payload.get('thinking') or ''}{text}"
+        elif kind == "tool_calls":
+            try:
+                deltas = json.loads(text)
+            except Exception:
+                continue
+            acc = payload.get("tool_calls")
+            if not isinstance(acc, list):
+                acc = payload["tool_calls"] = []
+            _merge_tool_call_deltas(acc, deltas if isinstance(deltas, list) else [])
+
+
+def _load_stream_chunks(conn, message_ids: List[int]) -> Dict[int, List[Tuple[str, str]]]:
+    """Pending chunks of still-streaming messages, keyed by message id."""
+    if not message_ids:
+        return {}
+    marks = ",".join("?" * len(message_ids))
+    rows = conn.execute(
+        f"SELECT message_id, kind, text FROM agent_message_chunks WHERE message_id IN ({marks}) ORDER BY id ASC",
+        message_ids,
+    ).fetchall()
+    out: Dict[int, List[Tuple[str, str]]] = {}
+    for r in rows or []:
+        out.setdefault(int(r["message_id"]), []).append((r["kind"], r["text"]))
+    return out
+
+
+def _fold_stream_chunks(conn, message_id: int) -> Optional[str]:
+    """Merge the pending chunks of a message into its content/visible and drop them.
+
+    Returns the new content, or None if there was nothing to fold. The caller
+    owns the transaction.
+    """
+    chunks = _load_stream_chunks(conn, [message_id]).get(message_id)
+    if not chunks:
+        return None
+    row = conn.execute("SELECT content FROM agent_messages WHERE id = ?", (message_id,)).fetchone()
+    content = None
+    try:
+        payload = json.loads(row["content"] or "") if row else None
+    except Exception:
+        payload = None
+    if isinstance(payload, dict):
+        _apply_stream_chunks(payload, chunks)
+        content = json.dumps(payload, ensure_ascii=False)
+        conn.execute(
+            "UPDATE agent_messages SET content = ?, visible = ? WHERE id = ?",
+            (content, str(payload.get("visible") or ""), message_id),
+        )
+    conn.execute("DELETE FROM agent_message_chunks WHERE message_id = ?", (message_id,))
+    return content
+
+
+def _fold_run_chunks(conn, run_id: int) -> int:
+    """_fold_stream_chunks for every message of a run that still has chunks."""
+    rows = conn.execute(
+        """
+        SELECT DISTINCT c.message_id FROM agent_message_chunks c
+        JOIN agent_messages m ON m.id = c.message_id
+        WHERE m.run_id = ?
+        """,
+        (run_id,),
+    ).fetchall() or []
+    for r in rows:
+        _fold_stream_chunks(conn, int(r["message_id"]))
+    return len(rows)
+
+
+def _serialize_message_row(row, chunks: Optional[List[Tuple[str, str]]] = None) -> dict:
     raw_content = row["content"] or ""
     content = raw_content
     payload = None
@@ -102,6 +280,8 @@ def _serialize_message_row(row) -> dict:
         payload = json.loads(raw_content)
     except Exception:
         payload = None
+    if chunks and isinstance(payload, dict):
+        _apply_stream_chunks(payload, chunks)
 
     # For assistant messages stored as JSON, map the visible text
     # back into the `content` field while keeping the full object
@@ -124,32 +304,33 @@ def _serialize_message_row(row) -> dict:
     }
 
 
-def _history_messages(conn, session_id: int) -> List[dict]:
+def _history_messages(conn, session_id: int, limit: int = HISTORY_LIMIT) -> List[dict]:
+    """The last `limit` messages of a session, oldest first, as LLM history."""
     cur = conn.cursor()
     rows = cur.execute(
         """
-        SELECT id, role, content, tool_name, tool_args, tool_call_id, run_id, created_at
+        SELECT role, content, visible, tool_call_id
         FROM agent_messages
         WHERE session_id = ?
-        ORDER BY id ASC
+        ORDER BY id DESC
+        LIMIT ?
         """,
-        (session_id,),
-    ).fetchall()
+        (session_id, limit),
+    ).fetchall() or []
     messages: List[dict] = []
-    for r in rows or []:
-        raw_content = r["content"] or ""
-        content = raw_content
-        # Decode assistant messages that were stored as JSON with a
-        # `visible` field so that the LLM history only sees the user-facing text.
-        if r["role"] == "assistant" and raw_content.lstrip().startswith("{"):
-            try:
-                obj = json.loads(raw_content)
-                if isinstance(obj, dict):
-                    visible = obj.get("visible")
-                    if isinstance(visible, str):
-                        content = visible
-            except Exception:
-                content = raw_content
+    for r in reversed(rows):
+        content = r["visible"]
+        if content is None:
+            content = r["content"] or ""
+            # Rows written before the `visible` column: assistant messages
+            # stored as JSON only expose their `visible` field to the LLM.
+            if r["role"] == "assistant" and content.lstrip().startswith("{"):
+                try:
+                    obj = json.loads(content)
+                    if isinstance(obj, dict) and isinstance(obj.get("visible"), str):
+                        content = obj["visible"]
+                except Exception:
+                    pass
         item = {
             "role": r["role"],
             "content": content,
@@ -157,11 +338,78 @@ def _history_messages(conn, session_id: int) -> List[dict]:
         if r["role"] == "tool" and r["tool_call_id"]:
             item["tool_call_id"] = r["tool_call_id"]
         messages.append(item)
-    if len(messages) > HISTORY_LIMIT:
-        return messages[-HISTORY_LIMIT:]
     return messages
 
 
+def _message_tokens(message: dict) -> int:
+    tokens = estimate_tokens(str(message.get("content") or ""))
+    for tc in message.get("tool_calls") or []:
+        fn = (tc or {}).get("function") or {}
+        tokens += estimate_tokens(str(fn.get("arguments") or ""))
+    # Role and separators
+    return tokens + 4
+
+
+def _trim_history(
+    history: List[dict],
+    max_messages: Optional[int] = None,
+    budget: int = AGENT_HISTORY_TOKENS,
+) -> List[dict]:
+    """Newest suffix of history within max_messages and the token budget.
+
+    The current turn (from the last user message on, including tool calls
+    and results of this run) is kept regardless of the budget. A tool result
+    is never left first without the assistant tool call it answers.
+    """
+    current = 1
+    for i in range(len(history) - 1, -1, -1):
+        if history[i].get("role") == "user":
+            current = len(history) - i
+            break
+    kept: List[dict] = []
+    used = 0
+    for m in reversed(history):
+        if max_messages is not None and len(kept) >= max_messages:
+            break
+        cost = _message_tokens(m)
+        if len(kept) >= current and budget > 0 and used + cost > budget:
+            break
+        kept.append(m)
+        used += cost
+    kept.reverse()
+    while len(kept) > 1 and kept[0].get("role") == "tool":
+        kept.pop(0)
+    return kept
+
+
+def _trim_messages(messages: List[dict]) -> List[dict]:
+    """Keep the system prompt and as much recent history as the request allows."""
+    if not messages:
+        return messages
+    if messages[0].get("role") != "system":
+        return _trim_history(messages, LLM_MAX_MESSAGES)
+    return [messages[0]] + _trim_history(messages[1:], LLM_MAX_MESSAGES - 1)
+
+
+def _apply_prompt_cache(body: Dict[str, object]) -> None:
+    """Mark the (stable) system prompt prefix for providers with explicit prompt caching."""
+    messages = body.get("messages")
+    if not AGENT_PROMPT_CACHE or not isinstance(messages, list) or not messages:
+        return
+    first = messages[0]
+    if AGENT_PROMPT_CACHE == "key":
+        body["prompt_cache_key"] = f"msut-agent-{prompt_registry.get().digest}"
+    elif AGENT_PROMPT_CACHE == "cache_control" and first.get("role") == "system" and isinstance(first.get("content"), str):
+        body["messages"] = [
+            {
+                "role": "system",
+                "content": [
+                    {"type": "text", "text": first["content"], "cache_control": {"type": "ephemeral"}}
+                ],
+            }
+        ] + messages[1:]
+
+
 def _agent_headers() -> Dict[str, str]:
     headers = {"Content-Type": "application/json"}
     if AGENT_API_KEY:
@@ -224,12 +472,8 @@ def _call_llm_v2(messages: List[dict]) -> dict:
     if not AGENT_API_BASE or not AGENT_MODEL:
         raise RuntimeError("agent LLM 未配置")
 
-    # SiliconFlow /chat/completions 要求 messages 长度在 1-10 之间
-    max_messages = 10
-    trimmed = messages
-    if len(trimmed) > max_messages:
-        # 保留第一个（通常是 system），只截取最后若干条历史，避免超限
-        trimmed = [trimmed[0]] + trimmed[-(max_messages - 1) :]
+    # 保留 system，按条数上限和 token 预算只截取最近的历史，避免超限
+    trimmed = _trim_messages(messages)
 
     body = {
         "model": AGENT_MODEL,
@@ -238,6 +482,7 @@ def _call_llm_v2(messages: List[dict]) -> dict:
         "tool_choice": "auto",
         "temperature": 0.35,
     }
+    _apply_prompt_cache(body)
 
     # deepseek-ai/DeepSeek-V3.1 系列在使用 function calling 时需要关闭 thinking
     model_lower = AGENT_MODEL.lower()
@@ -299,6 +544,195 @@ def _store_tool_file(dsl: str) -> dict:
     }
 
 
+def _run_tool(fn: str, dsl: Optional[str]) -> dict:
+    """Execute one tool call; failures become an error result for the LLM."""
+    if fn != "generate_melsave":
+        return {"ok": False, "error": f"未知工具: {fn}"}
+    try:
+        return _store_tool_file(dsl or "")
+    except Exception as e:
+        return {"ok": False, "error": f"生成失败: {e}"}
+
+
+class _AssistantStreamWriter:
+    """Debounced persistence of one streaming assistant message.
+
+    The first flush inserts the agent_messages row; later flushes append only
+    the new text to agent_message_chunks instead of rewriting the whole
+    accumulated JSON, so bytes written stay linear in the response length.
+    finish() stores the complete content and drops the chunks in one
+    transaction; abort() does the same with whatever was received when the
+    stream fails.
+    """
+
+    def __init__(
+        self,
+        conn,
+        session_id: int,
+        run_id: int,
+        *,
+        flush_ms: int = AGENT_STREAM_FLUSH_MS,
+        flush_chars: int = AGENT_STREAM_FLUSH_CHARS,
+    ):
+        self.conn = conn
+        self.session_id = session_id
+        self.run_id = run_id
+        self.flush_ms = flush_ms
+        self.flush_chars = flush_chars
+        self.message_id: Optional[int] = None
+        self._visible: List[str] = []
+        self._thinking: List[str] = []
+        self._tool_deltas: List[dict] = []
+        self._pending_chars = 0
+        self._last_flush = time.monotonic()
+
+    def add(self, visible: str = "", thinking: str = "", tool_deltas: Optional[List[dict]] = None) -> None:
+        if visible:
+            self._visible.append(visible)
+            self._pending_chars += len(visible)
+        if thinking:
+            self._thinking.append(thinking)
+            self._pending_chars += len(thinking)
+        if tool_deltas:
+            self._tool_deltas.extend(tool_deltas)
+            for tc in tool_deltas:
+                fn = tc.get("function") if isinstance(tc, dict) else None
+                args = fn.get("arguments") if isinstance(fn, dict) else None
+                self._pending_chars += len(args) if isinstance(args, str) else 1
+        if (
+            self.message_id is None
+            or self._pending_chars >= self.flush_chars
+            or (time.monotonic() - self._last_flush) * 1000.0 >= self.flush_ms
+        ):
+            self.flush()
+
+    def _take(self) -> List[Tuple[str, str]]:
+        chunks: List[Tuple[str, str]] = []
+        if self._visible:
+            chunks.append(("visible", "".join(self._visible)))
+        if self._thinking:
+            chunks.append(("thinking", "".join(self._thinking)))
+        if self._tool_deltas:
+            chunks.append(("tool_calls", json.dumps(self._tool_deltas, ensure_ascii=False)))
+        self._visible, self._thinking, self._tool_deltas = [], [], []
+        self._pending_chars = 0
+        return chunks
+
+    def flush(self) -> None:
+        chunks = self._take()
+        self._last_flush = time.monotonic()
+        if self.message_id is None:
+            # First write: the row itself carries everything so far
+            payload: Dict[str, object] = {"visible": ""}
+            _apply_stream_chunks(payload, chunks)
+            self.message_id = _insert_message(
+                self.conn,
+                self.session_id,
+                "assistant",
+                json.dumps(payload, ensure_ascii=False),
+                run_id=self.run_id,
+                visible=str(payload.get("visible") or ""),
+                streaming=True,
+            )
+            self.conn.commit()
+            return
+        if not chunks:
+            return
+        chunk_ids: List[int] = []
+        self.conn.execute("BEGIN")
+        try:
+            for kind, text in chunks:
+                cur = self.conn.execute(
+                    "INSERT INTO agent_message_chunks (message_id, kind, text) VALUES (?, ?, ?)",
+                    (self.message_id, kind, text),
+                )
+                chunk_ids.append(int(cur.lastrowid))
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        # The chunk id doubles as the SSE event id, so Last-Event-ID resumes
+        # exactly where the client left off
+        for chunk_id, (kind, text) in zip(chunk_ids, chunks):
+            run_events.publish(
+                self.run_id,
+                "delta",
+                {"messageId": self.message_id, "kind": kind, "text": text},
+                event_id=chunk_id,
+            )
+
+    def finish(self, content: str, visible: str, tool_args: Optional[str] = None) -> int:
+        """Write the final content (which already covers anything still pending)."""
+        self._take()
+        if self.message_id is None:
+            self.message_id = _insert_message(
+                self.conn,
+                self.session_id,
+                "assistant",
+                content,
+                tool_args=tool_args,
+                run_id=self.run_id,
+                visible=visible,
+            )
+            self.conn.commit()
+            return self.message_id
+        self.conn.execute("BEGIN")
+        try:
+            self.conn.execute(
+                "UPDATE agent_messages SET content = ?, visible = ?, tool_args = ? WHERE id = ?",
+                (content, visible, tool_args, self.message_id),
+            )
+            self.conn.execute(
+                "DELETE FROM agent_message_chunks WHERE message_id = ?", (self.message_id,)
+            )
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        _publish_message(
+            self.run_id,
+            {
+                "id": self.message_id,
+                "run_id": self.run_id,
+                "role": "assistant",
+                "content": content,
+                "tool_name": None,
+                "tool_args": tool_args,
+                "tool_call_id": None,
+                "created_at": None,
+            },
+        )
+        return self.message_id
+
+    def abort(self) -> Optional[int]:
+        """Keep what was received before a failed stream as the final content."""
+        self.flush()
+        if self.message_id is None:
+            return None
+        self.conn.execute("BEGIN")
+        try:
+            content = _fold_stream_chunks(self.conn, self.message_id)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        if content is not None:
+            _publish_message(
+                self.run_id,
+                {
+                    "id": self.message_id,
+                    "run_id": self.run_id,
+                    "role": "assistant",
+                    "content": content,
+                    "tool_name": None,
+                    "tool_args": None,
+                    "tool_call_id": None,
+                    "created_at": None,
+                },
+            )
+        return self.message_id
+
+
 def _call_llm_stream(
     conn,
     session_id: int,
@@ -309,12 +743,8 @@ def _call_llm_stream(
     if not AGENT_API_BASE or not AGENT_MODEL:
         raise RuntimeError("agent LLM 未配置")
 
-    # SiliconFlow /chat/completions 要求 messages 长度�?1-10 之间
-    max_messages = 10
-    trimmed = messages
-    if len(trimmed) > max_messages:
-        # 保留第一个（通常�?system），只截取最后若干条历史，避免超�?
-        trimmed = [trimmed[0]] + trimmed[-(max_messages - 1) :]
+    # 保留 system，按条数上限和 token 预算只截取最近的历史，避免超限
+    trimmed = _trim_messages(messages)
 
     body: Dict[str, object] = {
         "model": AGENT_MODEL,
@@ -328,6 +758,8 @@ def _call_llm_stream(
         
     }
 
+    _apply_prompt_cache(body)
+
     # deepseek-ai/DeepSeek-V3.1 系列在使用 function calling 时需要关闭 thinking
     model_lower = AGENT_MODEL.lower()
     if "deepseek-v3.1" in model_lower:
@@ -339,7 +771,7 @@ def _call_llm_stream(
     role = "assistant"
     full_content: str = ""
     full_thinking: str = ""
-    assistant_msg_id: Optional[int] = None
+    writer = _AssistantStreamWriter(conn, session_id, run_id)
 
     # 累积流式 function calling 的 tool_calls 片段
     tool_calls_acc: List[dict] = []
@@ -356,22 +788,6 @@ def _call_llm_stream(
             # Fallback to the plain text content if JSON encoding fails.
             return full_content
 
-    def _ensure_assistant_row() -> int:
-        nonlocal assistant_msg_id
-        if assistant_msg_id is None:
-            assistant_msg_id = _insert_message(
-                conn,
-                session_id,
-                "assistant",
-                _assistant_content_json(),
-                tool_name=None,
-                tool_args=None,
-                tool_call_id=None,
-                run_id=run_id,
-            )
-            conn.commit()
-        return assistant_msg_id
-
     try:
         resp = requests.post(
             url,
@@ -418,66 +834,16 @@ def _call_llm_stream(
             chunk_text = _extract_delta_text(delta)
             reasoning_part = _flatten_content(delta.get("reasoning_content"))
 
-            delta_tool_calls = delta.get("tool_calls") or []
-            has_tool_delta = bool(delta_tool_calls)
-
+            delta_tool_calls = [tc for tc in (delta.get("tool_calls") or []) if isinstance(tc, dict)]
             if delta_tool_calls:
-                for tc in delta_tool_calls:
-                    if not isinstance(tc, dict):
-                        continue
-                    idx = tc.get("index", 0) or 0
-                    if not isinstance(idx, int) or idx < 0:
-                        idx = 0
-                    while len(tool_calls_acc) <= idx:
-                        tool_calls_acc.append(
-                            {
-                                "id": None,
-                                "type": None,
-                                "function": {"name": None, "arguments": ""},
-                            }
-                        )
-                    acc = tool_calls_acc[idx]
-                    if not isinstance(acc, dict):
-                        continue
-                    tc_id = tc.get("id")
-                    if isinstance(tc_id, str) and tc_id:
-                        acc["id"] = tc_id
-                    tc_type = tc.get("type")
-                    if isinstance(tc_type, str) and tc_type:
-                        acc["type"] = tc_type
-                    fn_delta = tc.get("function") or {}
-                    if isinstance(fn_delta, dict):
-                        fn_name = fn_delta.get("name")
-                        if isinstance(fn_name, str) and fn_name:
-                            acc_fn = acc.get("function") or {}
-                            if not isinstance(acc_fn, dict):
-                                acc_fn = {"name": None, "arguments": ""}
-                            acc_fn["name"] = fn_name
-                            args_part = fn_delta.get("arguments")
-                            if isinstance(args_part, str):
-                                prev = acc_fn.get("arguments") or ""
-                                acc_fn["arguments"] = f"{prev}{args_part}"
-                            elif args_part is not None:
-                                prev = acc_fn.get("arguments") or ""
-                                acc_fn["arguments"] = f"{prev}{json.dumps(args_part, ensure_ascii=False)}"
-                            acc["function"] = acc_fn
-
-            updated = False
+                _merge_tool_call_deltas(tool_calls_acc, delta_tool_calls)
             if chunk_text:
                 full_content += chunk_text
-                updated = True
             if reasoning_part:
                 full_thinking += reasoning_part
-                updated = True
-
-            if updated or has_tool_delta:
-                msg_id = _ensure_assistant_row()
-                cur = conn.cursor()
-                cur.execute(
-                    "UPDATE agent_messages SET content = ? WHERE id = ?",
-                    (_assistant_content_json(), msg_id),
-                )
-                conn.commit()
+
+            if chunk_text or reasoning_part or delta_tool_calls:
+                writer.add(chunk_text, reasoning_part, delta_tool_calls)
 
     except Exception as e:
         err_text = ""
@@ -490,10 +856,14 @@ def _call_llm_stream(
             logger.error("agent LLM stream request failed: %s %s", e, err_text)
         except Exception:
             pass
+        # Keep what was received so far, as the per-delta writes used to,
+        # folded into the row so the next turn's history sees all of it
+        try:
+            writer.abort()
+        except Exception:
+            pass
         raise
 
-    msg_id = _ensure_assistant_row()
-
     tool_calls: List[dict] = []
     for acc in tool_calls_acc:
         if not isinstance(acc, dict):
@@ -524,12 +894,7 @@ def _call_llm_stream(
         except Exception:
             tool_args_json = None
 
-    cur = conn.cursor()
-    cur.execute(
-        "UPDATE agent_messages SET tool_args = ? WHERE id = ?",
-        (tool_args_json, msg_id),
-    )
-    conn.commit()
+    writer.finish(_assistant_content_json(), full_content, tool_args_json)
 
     # 在日志中记录一次思维链长度，便于调试是否拿到了 reasoning_content。
     try:
@@ -605,9 +970,11 @@ def _guess_dsl_from_messages(messages: List[dict]) -> Optional[str]:
 
 def _run_agent_once(conn, session_id: int, run_id: int) -> Dict[str, Optional[str]]:
     cur = conn.cursor()
-    prompt = _load_prompt()
-    history = _history_messages(conn, session_id)
-    messages = [{"role": "system", "content": prompt}] + history
+    prompt = prompt_registry.get()
+    # Requests are trimmed to LLM_MAX_MESSAGES (system prompt included), so
+    # older history would be fetched only to be dropped
+    history = _history_messages(conn, session_id, limit=LLM_MAX_MESSAGES - 1)
+    messages = [{"role": "system", "content": prompt.text}] + _trim_history(history)
 
     result_url: Optional[str] = None
     result_name: Optional[str] = None
@@ -635,6 +1002,7 @@ def _run_agent_once(conn, session_id: int, run_id: int) -> Dict[str, Optional[st
                 tool_name=None,
                 tool_args=json.dumps(tool_calls_for_row, ensure_ascii=False) if tool_calls_for_row else None,
                 run_id=run_id,
+                visible=content_for_row,
             )
 
         tool_calls = msg.get("tool_calls") or []
@@ -654,6 +1022,10 @@ def _run_agent_once(conn, session_id: int, run_id: int) -> Dict[str, Optional[st
         if not tool_calls:
             break
 
+        # Resolve arguments in call order first (the empty-DSL fallback reads
+        # `messages`), then run the calls concurrently and record the results
+        # in the original order.
+        prepared: List[Tuple[str, str, str, Optional[str]]] = []
         for call in tool_calls:
             fn = (call.get("function") or {}).get("name") or ""
             fn_payload = call.get("function") or {}
@@ -669,6 +1041,7 @@ def _run_agent_once(conn, session_id: int, run_id: int) -> Dict[str, Optional[st
             except Exception:
                 pass
 
+            dsl_str: Optional[str] = None
             if fn == "generate_melsave":
                 dsl = args_obj.get("dsl")
                 if isinstance(dsl, str):
@@ -700,15 +1073,17 @@ def _run_agent_once(conn, session_id: int, run_id: int) -> Dict[str, Optional[st
                         except Exception:
                             # 即便序列化失败，也不影响真实的工具执行（直接用 dsl_str）
                             args_raw = dsl_str
-                try:
-                    tool_res = _store_tool_file(dsl_str)
-                    file_info = tool_res.get("file") or {}
-                    result_url = file_info.get("url") or result_url
-                    result_name = file_info.get("filename") or result_name
-                except Exception as e:
-                    tool_res = {"ok": False, "error": f"生成失败: {e}"}
-            else:
-                tool_res = {"ok": False, "error": f"未知工具: {fn}"}
+            prepared.append((fn, args_raw, call_id, dsl_str))
+
+        tool_results = tool_executor.run_all(
+            [lambda fn=fn, dsl_str=dsl_str: _run_tool(fn, dsl_str) for fn, _, _, dsl_str in prepared]
+        )
+
+        for (fn, args_raw, call_id, _), tool_res in zip(prepared, tool_results):
+            if tool_res.get("ok"):
+                file_info = tool_res.get("file") or {}
+                result_url = file_info.get("url") or result_url
+                result_name = file_info.get("filename") or result_name
 
             tool_content = json.dumps(tool_res, ensure_ascii=False)
             _insert_message(
@@ -760,44 +1135,48 @@ def _mark_run_status(conn, run_id: int, status: str, *, session_id: int, result:
         (status, error, session_id),
     )
     conn.commit()
+    _publish_status(run_id, session_id, status, result=result, error=error)
+
+
+def _publish_status(
+    run_id: int,
+    session_id: int,
+    status: str,
+    *,
+    result: Optional[dict] = None,
+    error: Optional[str] = None,
+) -> None:
+    run_events.publish(
+        run_id,
+        "status",
+        {
+            "runId": run_id,
+            "sessionId": session_id,
+            "status": status,
+            "resultUrl": (result or {}).get("url"),
+            "resultName": (result or {}).get("name"),
+            "error": error,
+        },
+    )
 
 
 def _run_agent_once_langchain(conn, session_id: int, run_id: int) -> Dict[str, Optional[str]]:
-    history = _history_messages(conn, session_id)
+    history = _trim_history(_history_messages(conn, session_id))
 
-    assistant_msg_id: Optional[int] = None
+    writer = _AssistantStreamWriter(conn, session_id, run_id)
+    streamed = ""
 
     def _upsert_assistant_visible(visible: str) -> None:
         """在 LangChain 流式回调中增量更新 assistant 消息。
 
-        这里只写入 `visible` 字段，最终完整结果会在 LLM 结束后再补充 thinking / tool_calls。
+        回调给出的是完整的 visible 文本，这里只把新增部分交给 writer；
+        最终完整结果会在 LLM 结束后再补充 thinking / tool_calls。
         """
-        nonlocal assistant_msg_id
-        if not visible:
+        nonlocal streamed
+        if not visible or not visible.startswith(streamed):
             return
-        payload_obj: Dict[str, object] = {"visible": visible}
-        try:
-            content = json.dumps(payload_obj, ensure_ascii=False)
-        except Exception:
-            content = visible
-
-        if assistant_msg_id is None:
-            assistant_msg_id = _insert_message(
-                conn,
-                session_id,
-                "assistant",
-                content,
-                tool_name=None,
-                tool_args=None,
-                run_id=run_id,
-            )
-        else:
-            cur = conn.cursor()
-            cur.execute(
-                "UPDATE agent_messages SET content = ? WHERE id = ?",
-                (content, assistant_msg_id),
-            )
-        conn.commit()
+        writer.add(visible[len(streamed):])
+        streamed = visible
 
     # 使用 LangChain 版本的 Agent，并通过 on_stream_visible 回调实现“伪流式”更新
     result: AgentRunResult = run_agent_with_langchain(history, on_stream_visible=_upsert_assistant_visible)
@@ -814,24 +1193,7 @@ def _run_agent_once_langchain(conn, session_id: int, run_id: int) -> Dict[str, O
     except Exception:
         assistant_content = result.visible or ""
 
-    if assistant_msg_id is None:
-        assistant_msg_id = _insert_message(
-            conn,
-            session_id,
-            "assistant",
-            assistant_content,
-            tool_name=None,
-            tool_args=None,
-            run_id=run_id,
-        )
-        conn.commit()
-    else:
-        cur = conn.cursor()
-        cur.execute(
-            "UPDATE agent_messages SET content = ? WHERE id = ?",
-            (assistant_content, assistant_msg_id),
-        )
-        conn.commit()
+    writer.finish(assistant_content, result.visible or "")
 
     for record in result.tool_messages:
         try:
@@ -868,15 +1230,13 @@ def _process_agent_run(run_id: int):
     session_id = int(run_row["session_id"])
 
     try:
-        cur.execute(
-            "UPDATE agent_runs SET status = 'running', updated_at = datetime('now') WHERE id = ?",
-            (run_id,),
-        )
+        # The scheduler already moved the run to `running` when it claimed it
         cur.execute(
             "UPDATE agent_sessions SET last_status = 'running', last_error = NULL WHERE id = ?",
             (session_id,),
         )
         conn.commit()
+        _publish_status(run_id, session_id, "running")
 
         # 使用直连 SiliconFlow 的流式实现，以获得完整的 reasoning_content，
         # 并在 _call_llm_stream 中把思维链累积到 payload.thinking，前端可折叠查看。
@@ -896,6 +1256,9 @@ def _process_agent_run(run_id: int):
             pass
 
 
+run_scheduler = AgentRunScheduler(_process_agent_run, on_abandoned=_fold_run_chunks)
+
+
 @router.post("/api/agent/sessions")
 def create_session(request: Request, body: dict = Body(default={})):
     uid = _require_user_id(request)
@@ -988,7 +1351,11 @@ def list_session_messages(request: Request, session_id: int, limit: int = Query(
             """,
             (session_id, limit),
         ).fetchall()
-        items = [_serialize_message_row(r) for r in (rows or [])]
+        rows = rows or []
+        chunks = _load_stream_chunks(
+            conn, [int(r["id"]) for r in rows if r["role"] == "assistant"]
+        )
+        items = [_serialize_message_row(r, chunks.get(int(r["id"]))) for r in rows]
         items.reverse()
         return {"items": items}
     finally:
@@ -1001,7 +1368,6 @@ def list_session_messages(request: Request, session_id: int, limit: int = Query(
 @router.post("/api/agent/ask")
 def agent_ask(
     request: Request,
-    background_tasks: BackgroundTasks,
     body: dict = Body(...),
 ):
     uid = _require_user_id(request)
@@ -1016,6 +1382,10 @@ def agent_ask(
     session_id = body.get("sessionId")
     conn = get_connection()
     try:
+        try:
+            run_scheduler.check_capacity(conn)
+        except AgentQueueFull as e:
+            return JSONResponse(status_code=429, content={"error": str(e)})
         cur = conn.cursor()
         created_new = False
         sid: Optional[int]
@@ -1049,7 +1419,7 @@ def agent_ask(
         )
         conn.commit()
 
-        background_tasks.add_task(_process_agent_run, run_id)
+        run_scheduler.notify()
 
         return {"sessionId": sid, "runId": run_id, "created": created_new, "status": "pending"}
     finally:
@@ -1059,6 +1429,188 @@ def agent_ask(
             pass
 
 
+def _run_snapshot(conn, run_id: int, after_id: Optional[int]):
+    """Events that bring a client up to date with a run, from the database.
+
+    Messages are sent with the chunks up to `cutoff` folded in, followed by
+    the chunks after `after_id` as delta events (ids preserved), so a client
+    resuming with Last-Event-ID continues exactly where it stopped. Returns
+    (events, status, cutoff); live deltas with id <= cutoff are duplicates.
+    """
+    run = conn.execute(
+        "SELECT session_id, status, result_path, result_name, error FROM agent_runs WHERE id = ?",
+        (run_id,),
+    ).fetchone()
+    rows = conn.execute(
+        """
+        SELECT id, role, content, tool_name, tool_args, tool_call_id, run_id, created_at
+        FROM agent_messages
+        WHERE run_id = ?
+        ORDER BY id ASC
+        """,
+        (run_id,),
+    ).fetchall() or []
+    chunk_rows: List = []
+    if rows:
+        marks = ",".join("?" * len(rows))
+        chunk_rows = conn.execute(
+            f"SELECT id, message_id, kind, text FROM agent_message_chunks WHERE message_id IN ({marks}) ORDER BY id ASC",
+            [int(r["id"]) for r in rows],
+        ).fetchall() or []
+    max_id = int(chunk_rows[-1]["id"]) if chunk_rows else 0
+    cutoff = max_id if after_id is None else min(after_id, max_id)
+
+    events: List[RunEvent] = []
+    streaming_ids = {int(c["message_id"]) for c in chunk_rows}
+    for r in rows:
+        mid = int(r["id"])
+        folded = [(c["kind"], c["text"]) for c in chunk_rows if int(c["message_id"]) == mid and int(c["id"]) <= cutoff]
+        events.append(
+            RunEvent(
+                "message",
+                _message_event_data(r, folded, chunk_id=cutoff, streaming=mid in streaming_ids),
+            )
+        )
+    for c in chunk_rows:
+        if int(c["id"]) > cutoff:
+            events.append(
+                RunEvent(
+                    "delta",
+                    {"messageId": int(c["message_id"]), "kind": c["kind"], "text": c["text"]},
+                    event_id=int(c["id"]),
+                )
+            )
+    status = run["status"] if run else None
+    if run is not None:
+        events.append(
+            RunEvent(
+                "status",
+                {
+                    "runId": run_id,
+                    "sessionId": int(run["session_id"]),
+                    "status": status,
+                    "resultUrl": run["result_path"],
+                    "resultName": run["result_name"],
+                    "error": run["error"],
+                },
+            )
+        )
+    return events, status, max(cutoff, after_id or 0)
+
+
+def _read_run_snapshot(run_id: int, after_id: Optional[int]):
+    conn = get_connection()
+    try:
+        return _run_snapshot(conn, run_id, after_id)
+    finally:
+        conn.close()
+
+
+def _read_run_owner(run_id: int) -> Optional[int]:
+    conn = get_connection()
+    try:
+        row = conn.execute(
+            """
+            SELECT s.user_id
+            FROM agent_runs r
+            JOIN agent_sessions s ON s.id = r.session_id
+            WHERE r.id = ?
+            """,
+            (run_id,),
+        ).fetchone()
+    finally:
+        conn.close()
+    return int(row["user_id"]) if row else None
+
+
+@router.get("/api/agent/runs/{run_id}/events")
+async def run_events_stream(request: Request, run_id: int, lastEventId: Optional[int] = Query(None)):
+    """Server-sent events for one run: message / delta / status, then done.
+
+    Replaces polling get_run_status + session messages. Resume with the
+    standard Last-Event-ID header (EventSource sends it on reconnect) or the
+    lastEventId query parameter.
+    """
+    uid = _require_user_id(request)
+    if uid is None:
+        return JSONResponse(status_code=401, content={"error": "未登录"})
+    if await asyncio.to_thread(_read_run_owner, run_id) != uid:
+        return JSONResponse(status_code=404, content={"error": "任务不存在"})
+
+    after_id = lastEventId
+    header_id = request.headers.get("last-event-id")
+    if header_id:
+        try:
+            after_id = int(header_id)
+        except ValueError:
+            pass
+
+    async def event_stream():
+        # Subscribe before reading the snapshot so nothing published in between is lost
+        sub = run_events.subscribe(run_id)
+        try:
+            events, status, seen = await asyncio.to_thread(_read_run_snapshot, run_id, after_id)
+            for ev in events:
+                yield ev.encode()
+            if status in TERMINAL_STATUSES or status is None:
+                yield RunEvent("done", {"runId": run_id, "status": status}).encode()
+                return
+            while True:
+                try:
+                    ev = await asyncio.wait_for(sub.queue.get(), timeout=AGENT_SSE_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield ": keepalive\n\n"
+                    # Safety net for a missed terminal event (e.g. run in another process)
+                    events, status, _seen = await asyncio.to_thread(_read_run_snapshot, run_id, seen)
+                    if status in TERMINAL_STATUSES or status is None:
+                        for snap in events:
+                            yield snap.encode()
+                        yield RunEvent("done", {"runId": run_id, "status": status}).encode()
+                        return
+                    continue
+                if ev is None:
+                    # Fell too far behind; the client reconnects with Last-Event-ID
+                    return
+                if ev.event_id is not None:
+                    if ev.event_id <= seen:
+                        continue
+                    seen = ev.event_id
+                yield ev.encode()
+                if ev.event == "status" and ev.data.get("status") in TERMINAL_STATUSES:
+                    yield RunEvent("done", {"runId": run_id, "status": ev.data.get("status")}).encode()
+                    return
+        finally:
+            run_events.unsubscribe(sub)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream; charset=utf-8",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/api/agent/scheduler/stats")
+def agent_scheduler_stats(request: Request):
+    denied = ops_access_denied(request)
+    if denied is not None:
+        return denied
+    return {**run_scheduler.stats(), "tools": tool_executor.stats()}
+
+
+@router.get("/api/agent/prompt/stats")
+def agent_prompt_stats(request: Request):
+    denied = ops_access_denied(request)
+    if denied is not None:
+        return denied
+    return {
+        **prompt_registry.stats(),
+        "historyTokenBudget": AGENT_HISTORY_TOKENS,
+        "promptCache": AGENT_PROMPT_CACHE or None,
+    }
+
+
 @router.get("/api/agent/runs/{run_id}")
 def get_run_status(request: Request, run_id: int):
     uid = _require_user_id(request)
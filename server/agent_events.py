@@ -0,0 +1,116 @@
+import asyncio
+import json
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Set
+
+
+logger = logging.getLogger("msut.agent.events")
+
+# Events buffered per subscriber; a client that falls this far behind is
+# disconnected and resumes from the database with Last-Event-ID
+SUBSCRIBER_QUEUE_SIZE = 1024
+
+TERMINAL_STATUSES = ("succeeded", "failed")
+
+
+@dataclass
+class RunEvent:
+    event: str
+    data: Dict[str, Any]
+    # SSE id; only delta events carry one (the agent_message_chunks row id)
+    event_id: Optional[int] = None
+
+    def encode(self) -> str:
+        lines = []
+        if self.event_id is not None:
+            lines.append(f"id: {self.event_id}")
+        lines.append(f"event: {self.event}")
+        lines.append("data: " + json.dumps(self.data, ensure_ascii=False))
+        return "\n".join(lines) + "\n\n"
+
+
+@dataclass(eq=False)
+class Subscription:
+    run_id: int
+    loop: asyncio.AbstractEventLoop
+    queue: "asyncio.Queue[Optional[RunEvent]]" = field(
+        default_factory=lambda: asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+    )
+    overflowed: bool = False
+
+
+class RunEventBus:
+    """In-process pub/sub of agent run events.
+
+    Publishers are the agent worker threads (_call_llm_stream via the stream
+    writer, _mark_run_status); subscribers are SSE responses on the event
+    loop. Delivery is best effort: the database stays the source of truth and
+    a subscriber that overflows gets None and is expected to resume from it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subs: Dict[int, Set[Subscription]] = {}
+        self._published = 0
+        self._dropped = 0
+
+    def subscribe(self, run_id: int) -> Subscription:
+        sub = Subscription(run_id=run_id, loop=asyncio.get_running_loop())
+        with self._lock:
+            self._subs.setdefault(run_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            subs = self._subs.get(sub.run_id)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subs[sub.run_id]
+
+    def has_subscribers(self, run_id: int) -> bool:
+        return run_id in self._subs
+
+    def _offer(self, sub: Subscription, item: RunEvent) -> None:
+        # Runs on the subscriber's loop
+        if sub.overflowed:
+            return
+        try:
+            sub.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            sub.overflowed = True
+            self._dropped += 1
+            # Discard everything still queued and end the stream. Dropping only
+            # the oldest event would deliver the ones after it across a gap,
+            # moving the client's Last-Event-ID past events it never saw.
+            while not sub.queue.empty():
+                sub.queue.get_nowait()
+            sub.queue.put_nowait(None)
+
+    def publish(self, run_id: int, event: str, data: Dict[str, Any], event_id: Optional[int] = None) -> None:
+        with self._lock:
+            subs = list(self._subs.get(run_id, ()))
+            self._published += 1
+        if not subs:
+            return
+        item = RunEvent(event=event, data=data, event_id=event_id)
+        for sub in subs:
+            try:
+                sub.loop.call_soon_threadsafe(self._offer, sub, item)
+            except RuntimeError:
+                # Loop already closed (shutdown)
+                self.unsubscribe(sub)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "runs": len(self._subs),
+                "subscribers": sum(len(s) for s in self._subs.values()),
+                "published": self._published,
+                "dropped": self._dropped,
+            }
+
+
+bus = RunEventBus()
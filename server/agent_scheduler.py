@@ -0,0 +1,290 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Optional, Set, Tuple
+
+from .db import get_connection
+from .utils import timing_summary
+
+
+logger = logging.getLogger("msut.agent.scheduler")
+
+# Runs executing at once (global cap)
+AGENT_WORKERS = max(1, int(os.getenv("AGENT_WORKERS", "4")))
+# Runs one user may have executing at once; 0 = no per-user limit
+AGENT_MAX_PER_USER = max(0, int(os.getenv("AGENT_MAX_PER_USER", "1")))
+# Pending runs accepted before /api/agent/ask answers 429
+AGENT_MAX_QUEUED = max(1, int(os.getenv("AGENT_MAX_QUEUED", "100")))
+# Seconds between queue scans when nobody calls notify() (picks up runs
+# queued by other processes and recovered rows)
+AGENT_POLL_INTERVAL = float(os.getenv("AGENT_POLL_INTERVAL", "5"))
+# At startup, `running` rows not updated for this many seconds are treated as
+# orphaned by a previous process; 0 = all of them (single-process deployment).
+# Keep it well above AGENT_RUN_HEARTBEAT when several processes share the DB.
+AGENT_RUN_STALE_SECONDS = max(0, int(os.getenv("AGENT_RUN_STALE_SECONDS", "0")))
+# Seconds between updated_at touches of the runs this process is executing,
+# so another process's recover_stale() leaves healthy long runs alone
+AGENT_RUN_HEARTBEAT = max(1.0, float(os.getenv("AGENT_RUN_HEARTBEAT", "30")))
+_RECENT_RUNS = 200
+
+
+class AgentQueueFull(Exception):
+    """Raised when too many agent runs are already pending."""
+
+
+class AgentRunScheduler:
+    """Executes agent_runs rows on a dedicated, bounded thread pool.
+
+    agent_runs is the durable queue: a dispatcher thread claims the oldest
+    `pending` row whose user is under AGENT_MAX_PER_USER (pending -> running in
+    one write transaction) whenever a worker is free, so LLM-heavy runs never
+    occupy the HTTP threadpool and pending runs survive a restart.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[int], None],
+        workers: int = AGENT_WORKERS,
+        max_per_user: int = AGENT_MAX_PER_USER,
+        max_queued: int = AGENT_MAX_QUEUED,
+        on_abandoned: Optional[Callable[[Any, int], Any]] = None,
+    ):
+        self.handler = handler
+        # (conn, run_id) -> None: tidies a stale run marked failed by
+        # recover_stale, inside the same transaction
+        self.on_abandoned = on_abandoned
+        self.workers = workers
+        self.max_per_user = max_per_user
+        self.max_queued = max_queued
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._thread: Optional[threading.Thread] = None
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._active = 0
+        # Ids of the runs executing in this process (heartbeat targets)
+        self._running: Set[int] = set()
+        self._last_heartbeat = 0.0
+        self._claimed = 0
+        self._completed = 0
+        self._crashed = 0
+        self._rejected = 0
+        self._recovered = 0
+        self._recent: Deque[Tuple[float, float]] = deque(maxlen=_RECENT_RUNS)
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        try:
+            self.recover_stale()
+        except Exception:
+            logger.exception("agent scheduler: stale run recovery failed")
+        self._stopping.clear()
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="agent-run")
+        self._thread = threading.Thread(target=self._dispatch_loop, name="agent-dispatch", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self._pool is not None:
+            # Running runs are left as `running` and recovered on next start
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def notify(self) -> None:
+        """A run was queued (or a slot freed): scan the queue now."""
+        self._wake.set()
+
+    def check_capacity(self, conn) -> None:
+        """Raise AgentQueueFull when no more runs should be queued."""
+        pending = conn.execute(
+            "SELECT COUNT(*) FROM agent_runs WHERE status = 'pending'"
+        ).fetchone()[0]
+        if int(pending) >= self.max_queued:
+            self._rejected += 1
+            raise AgentQueueFull("Agent 任务排队过多，请稍后再试")
+
+    def recover_stale(self) -> int:
+        """Requeue or fail `running` rows left behind by a previous process.
+
+        Runs that produced no output yet are simply requeued; the others
+        already wrote partial assistant/tool messages and are marked failed
+        rather than replayed (on_abandoned then folds their stream chunks).
+        """
+        conn = get_connection()
+        try:
+            rows = conn.execute(
+                """
+                SELECT id, session_id FROM agent_runs
+                WHERE status = 'running' AND updated_at <= datetime('now', ?)
+                """,
+                (f"-{AGENT_RUN_STALE_SECONDS} seconds",),
+            ).fetchall() or []
+            for r in rows:
+                has_output = conn.execute(
+                    "SELECT 1 FROM agent_messages WHERE run_id = ? AND role != 'user' LIMIT 1",
+                    (int(r["id"]),),
+                ).fetchone()
+                status, error = ("failed", "服务重启，任务中断") if has_output else ("pending", None)
+                conn.execute("BEGIN")
+                try:
+                    conn.execute(
+                        "UPDATE agent_runs SET status = ?, error = ? WHERE id = ? AND status = 'running'",
+                        (status, error, int(r["id"])),
+                    )
+                    conn.execute(
+                        "UPDATE agent_sessions SET last_status = ?, last_error = ? WHERE id = ?",
+                        (status, error, int(r["session_id"])),
+                    )
+                    if status == "failed" and self.on_abandoned is not None:
+                        self.on_abandoned(conn, int(r["id"]))
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                logger.warning("agent scheduler: recovered stale run_id=%s -> %s", r["id"], status)
+            self._recovered += len(rows)
+            return len(rows)
+        finally:
+            conn.close()
+
+    def _claim(self, conn) -> Optional[Tuple[int, float]]:
+        """Atomically move the next eligible pending run to running."""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                """
+                SELECT r.id, (julianday('now') - julianday(r.created_at)) * 86400000.0 AS wait_ms
+                FROM agent_runs r
+                WHERE r.status = 'pending'
+                  AND (? <= 0 OR (
+                    SELECT COUNT(*) FROM agent_runs x
+                    WHERE x.user_id = r.user_id AND x.status = 'running'
+                  ) < ?)
+                ORDER BY r.id ASC
+                LIMIT 1
+                """,
+                (self.max_per_user, self.max_per_user),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE agent_runs SET status = 'running' WHERE id = ?", (int(row["id"]),)
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        if row is None:
+            return None
+        return int(row["id"]), max(0.0, float(row["wait_ms"] or 0.0))
+
+    def _heartbeat(self, conn) -> None:
+        """Touch updated_at of the runs this process is still executing."""
+        now = time.monotonic()
+        if now - self._last_heartbeat < AGENT_RUN_HEARTBEAT:
+            return
+        self._last_heartbeat = now
+        with self._lock:
+            run_ids = list(self._running)
+        if not run_ids:
+            return
+        marks = ",".join("?" * len(run_ids))
+        conn.execute(
+            f"UPDATE agent_runs SET updated_at = datetime('now') WHERE status = 'running' AND id IN ({marks})",
+            run_ids,
+        )
+
+    def _dispatch_loop(self) -> None:
+        conn = get_connection()
+        try:
+            while not self._stopping.is_set():
+                # Cleared before scanning so a notify() during the scan is not lost
+                self._wake.clear()
+                try:
+                    while self._active < self.workers and not self._stopping.is_set():
+                        claimed = self._claim(conn)
+                        if claimed is None:
+                            break
+                        run_id, wait_ms = claimed
+                        with self._lock:
+                            self._active += 1
+                            self._claimed += 1
+                            self._running.add(run_id)
+                        assert self._pool is not None
+                        self._pool.submit(self._execute, run_id, wait_ms)
+                except Exception:
+                    logger.exception("agent scheduler: dispatch failed")
+                try:
+                    self._heartbeat(conn)
+                except Exception:
+                    logger.exception("agent scheduler: heartbeat failed")
+                self._wake.wait(min(AGENT_POLL_INTERVAL, AGENT_RUN_HEARTBEAT))
+        finally:
+            conn.close()
+
+    def _execute(self, run_id: int, wait_ms: float) -> None:
+        started = time.monotonic()
+        ok = True
+        try:
+            self.handler(run_id)
+        except Exception:
+            ok = False
+            logger.exception("agent scheduler: run_id=%s crashed", run_id)
+        finally:
+            run_ms = (time.monotonic() - started) * 1000.0
+            with self._lock:
+                self._active -= 1
+                self._running.discard(run_id)
+                if ok:
+                    self._completed += 1
+                else:
+                    self._crashed += 1
+                self._recent.append((wait_ms, run_ms))
+            logger.info(
+                "agent run: run_id=%s wait_ms=%.0f run_ms=%.0f active=%s",
+                run_id,
+                wait_ms,
+                run_ms,
+                self._active,
+            )
+            self._wake.set()
+
+    def stats(self) -> Dict:
+        conn = get_connection()
+        try:
+            counts = {
+                r["status"]: int(r["n"])
+                for r in conn.execute(
+                    """
+                    SELECT status, COUNT(*) AS n FROM agent_runs
+                    WHERE status IN ('pending', 'running') GROUP BY status
+                    """
+                ).fetchall()
+            }
+        finally:
+            conn.close()
+        with self._lock:
+            recent = list(self._recent)
+            active = self._active
+        return {
+            "workers": self.workers,
+            "maxPerUser": self.max_per_user,
+            "maxQueued": self.max_queued,
+            "active": active,
+            "pending": counts.get("pending", 0),
+            "running": counts.get("running", 0),
+            "claimed": self._claimed,
+            "completed": self._completed,
+            "crashed": self._crashed,
+            "rejected": self._rejected,
+            "recovered": self._recovered,
+            "waitMs": timing_summary([r[0] for r in recent]),
+            "runMs": timing_summary([r[1] for r in recent]),
+        }
@@ -41,7 +41,9 @@ _load_env_from_file(BASE_DIR / ".env")
 _load_env_from_file(BASE_DIR / "server" / ".env")
 
 
-from .agent_api import router as agent_router
+from .agent_api import router as agent_router, run_scheduler as agent_scheduler
+from .agent.prompts import registry as prompt_registry
+from .agent.tools import executor as agent_tool_executor
 from .auth import router as auth_router, get_current_user, is_https_enabled
 from .db import run_migrations, DB_FILE
 from .files import router as files_router
@@ -50,6 +52,9 @@ from .tutorials import router as tutorials_router
 from .comments import router as comments_router
 from .notifications_api import router as notifications_router
 from .lua_sandbox import router as lua_router
+from .watermark_service import service as wm_service
+from .password_service import service as password_service
+from .refresh_tokens import sweeper as refresh_sweeper
 
 
 app = FastAPI()
@@ -66,6 +71,10 @@ def _startup():
         logging.basicConfig(level=logging.INFO)
     logger = logging.getLogger("msut.app")
     run_migrations()
+    refresh_sweeper.start()
+    agent_scheduler.start()
+    # Load the agent system prompt now instead of on the first run
+    prompt_registry.load()
     try:
         logger.info(
             "startup complete: DATA_DIR=%s DB=%s HTTPS_ENABLED=%s",
@@ -77,6 +86,15 @@ def _startup():
         pass
 
 
+@app.on_event("shutdown")
+def _shutdown():
+    wm_service.shutdown()
+    password_service.shutdown()
+    refresh_sweeper.stop()
+    agent_scheduler.stop()
+    agent_tool_executor.shutdown()
+
+
 # Security headers / HSTS
 @app.middleware("response")
 async def security_headers(request: Request, call_next: Callable):
@@ -91,6 +109,15 @@ async def security_headers(request: Request, call_next: Callable):
     return response
 
 
+# Decode the auth cookie once per API request; handlers read it back through
+# get_current_user (request.state.user) however many times they call it
+@app.middleware("http")
+async def auth_context(request: Request, call_next: Callable):
+    if request.url.path.startswith("/api/"):
+        get_current_user(request)
+    return await call_next(request)
+
+
 # Static files for uploads (legacy local files — kept for backward compat during R2 migration)
 uploads_path = Path(__file__).resolve().parent / "uploads"
 if uploads_path.exists():
@@ -1,19 +1,23 @@
 import os
 import time
+import hmac
+import asyncio
+import sqlite3
 import secrets
 import hashlib
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Optional
 
-import bcrypt
 import jwt
 from fastapi import APIRouter, Body, Request, Response, UploadFile, File
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel, Field
 
 from .db import get_connection
+from .password_service import PasswordBusy, PasswordUnavailable, service as password_service
+from .refresh_tokens import enforce_user_cap, sweeper as refresh_sweeper
 from .schemas import JWTPayload
-from .utils import cookie_kwargs, parse_bool, nanoid, now_ms
+from .utils import TTLCache, cookie_kwargs, parse_bool, nanoid, now_ms
 
 
 router = APIRouter()
@@ -27,22 +31,31 @@ UPLOAD_DIR = Path(__file__).resolve().parent / "uploads"
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 MAX_AVATAR_SIZE = 5 * 1024 * 1024  # 5MB
 
+# token -> decoded payload (never kept past the token's own exp) and
+# uid -> public profile; both are per worker process
+_token_cache = TTLCache(float(os.getenv("AUTH_TOKEN_CACHE_TTL", "60")))
+_user_cache = TTLCache(float(os.getenv("AUTH_USER_CACHE_TTL", "30")))
+_UNSET = object()
+
+# Shared secret for the operational */stats endpoints, sent as
+# "Authorization: Bearer <token>"; unset = those endpoints answer 404
+OPS_STATS_TOKEN = (os.getenv("OPS_STATS_TOKEN") or "").strip()
+
 
 def is_https_enabled() -> bool:
     is_prod = os.getenv("NODE_ENV") == "production"
     return parse_bool(os.getenv("HTTPS_ENABLED"), is_prod)
 
 
-def _hash_password(password: str) -> str:
-    salt = bcrypt.gensalt(rounds=12)
-    return bcrypt.hashpw(password.encode("utf-8"), salt).decode("utf-8")
-
-
-def _verify_password(password: str, hashed: str) -> bool:
-    try:
-        return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
-    except Exception:
-        return False
+def ops_access_denied(request: Request) -> Optional[JSONResponse]:
+    """Error response for a */stats request without the ops token, else None."""
+    if not OPS_STATS_TOKEN:
+        return JSONResponse(status_code=404, content={"error": "接口未启用"})
+    auth = request.headers.get("authorization") or ""
+    scheme, _, token = auth.partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.strip(), OPS_STATS_TOKEN):
+        return JSONResponse(status_code=403, content={"error": "无权访问"})
+    return None
 
 
 def _issue_token(uid: int, username: str, ttl_seconds: int) -> str:
@@ -70,24 +83,57 @@ def _create_refresh_token(conn, uid: int) -> str:
         "INSERT INTO auth_refresh_tokens (user_id, token_hash, expires_at) VALUES (?, ?, ?)",
         (uid, token_hash, expires_at),
     )
+    enforce_user_cap(conn, uid)
     return token
 
 
 def _parse_token(token: Optional[str]) -> Optional[JWTPayload]:
     if not token:
         return None
+    cached = _token_cache.get(token)
+    if cached is not None:
+        return cached
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])  # type: ignore
         if not (payload.get("uid") and payload.get("username")):
             return None
-        return payload  # type: ignore
     except Exception:
         return None
+    _token_cache.set(token, payload, ttl_seconds=int(payload.get("exp", 0)) - time.time())
+    return payload  # type: ignore
 
 
 def get_current_user(request: Request) -> Optional[JWTPayload]:
-    token = request.cookies.get("token")
-    return _parse_token(token)
+    # Memoized per request; auth_context in app.py fills it for /api/ requests
+    payload = getattr(request.state, "user", _UNSET)
+    if payload is _UNSET:
+        payload = _parse_token(request.cookies.get("token"))
+        request.state.user = payload
+    return payload  # type: ignore[return-value]
+
+
+def _load_user_profile(uid: int) -> Optional[Dict]:
+    user = _user_cache.get(uid)
+    if user is None:
+        conn = get_connection()
+        row = conn.execute(
+            "SELECT id, username, avatar_url, signature FROM users WHERE id = ?",
+            (uid,),
+        ).fetchone()
+        if not row:
+            return None
+        user = {
+            "id": int(row["id"]),
+            "username": row["username"],
+            "avatarUrl": row["avatar_url"] or "",
+            "signature": row["signature"] or "",
+        }
+        _user_cache.set(uid, user)
+    return dict(user)
+
+
+def invalidate_user(uid: int) -> None:
+    _user_cache.pop(int(uid))
 
 
 class RegisterBody(BaseModel):
@@ -107,90 +153,132 @@ class ProfilePatchBody(BaseModel):
     signature: Optional[str] = Field(default=None, max_length=200)
 
 
-@router.post("/api/auth/register")
-def register(body: RegisterBody, request: Request, response: Response):
+def _find_user(username: str) -> Optional[sqlite3.Row]:
     conn = get_connection()
-    cur = conn.cursor()
-    exists = cur.execute(
-        "SELECT id FROM users WHERE username = ?", (body.username,)
-    ).fetchone()
-    if exists:
-        return JSONResponse(status_code=409, content={"error": "用户名已注册"})
-    hash_ = _hash_password(body.password)
-    cur.execute(
-        "INSERT INTO users (username, password_hash) VALUES (?, ?)",
-        (body.username, hash_),
-    )
-    conn.commit()
-    last_id = cur.lastrowid
-    if last_id is None:
-        return JSONResponse(status_code=500, content={"error": "注册失败"})
-    uid = int(last_id)
-    remember = bool(body.remember)
-    token_ttl = ACCESS_TOKEN_TTL_SECONDS if remember else ACCESS_TOKEN_TTL_SHORT_SECONDS
-    token = _issue_token(uid, body.username, token_ttl)
-    response.set_cookie("token", token, **cookie_kwargs(max_age_seconds=token_ttl))
-    if remember:
-        refresh_token = _create_refresh_token(conn, uid)
-        response.set_cookie(
-            "refresh_token",
-            refresh_token,
-            **cookie_kwargs(max_age_seconds=REFRESH_TOKEN_TTL_SECONDS),
+    try:
+        return conn.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
+    finally:
+        conn.close()
+
+
+def _insert_user(username: str, password_hash: str) -> Optional[int]:
+    """New user id, or None if the username was taken in the meantime."""
+    conn = get_connection()
+    try:
+        cur = conn.execute(
+            "INSERT INTO users (username, password_hash) VALUES (?, ?)",
+            (username, password_hash),
         )
-    else:
-        refresh_cookie = request.cookies.get("refresh_token")
-        if refresh_cookie:
+        return cur.lastrowid
+    except sqlite3.IntegrityError:
+        return None
+    finally:
+        conn.close()
+
+
+def _open_session(
+    uid: int,
+    remember: bool,
+    old_refresh_token: Optional[str],
+    rehash: Optional[tuple] = None,
+) -> Optional[str]:
+    """Database side of a successful register/login.
+
+    rehash is (new_hash, old_hash) when the stored hash should be upgraded.
+    Returns a new refresh token if remember is set; otherwise revokes
+    old_refresh_token and returns None.
+    """
+    conn = get_connection()
+    try:
+        if rehash is not None:
+            # Cost factor changed (BCRYPT_ROUNDS): upgrade the stored hash,
+            # unless the password was changed concurrently
+            conn.execute(
+                "UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?",
+                (rehash[0], uid, rehash[1]),
+            )
+        if remember:
+            return _create_refresh_token(conn, uid)
+        if old_refresh_token:
             try:
                 conn.execute(
                     "DELETE FROM auth_refresh_tokens WHERE token_hash = ?",
-                    (_hash_refresh_token(refresh_cookie),),
+                    (_hash_refresh_token(old_refresh_token),),
                 )
-                conn.commit()
             except Exception:
                 pass
-        ck = cookie_kwargs(max_age_seconds=0)
-        response.set_cookie("refresh_token", value="", **ck)
-    return {"user": {"id": uid, "username": body.username}}
+        return None
+    finally:
+        conn.close()
 
 
-@router.post("/api/auth/login")
-def login(body: LoginBody, request: Request, response: Response):
-    conn = get_connection()
-    cur = conn.cursor()
-    row = cur.execute(
-        "SELECT * FROM users WHERE username = ?", (body.username,)
-    ).fetchone()
-    if not row:
-        return JSONResponse(status_code=401, content={"error": "用户名或密码错误"})
-    if not _verify_password(body.password, row["password_hash"]):
-        return JSONResponse(status_code=401, content={"error": "用户名或密码错误"})
-    remember = bool(body.remember)
-    token_ttl = ACCESS_TOKEN_TTL_SECONDS if remember else ACCESS_TOKEN_TTL_SHORT_SECONDS
-    token = _issue_token(int(row["id"]), row["username"], token_ttl)
+def _set_session_cookies(response: Response, token: str, token_ttl: int, refresh_token: Optional[str]) -> None:
     response.set_cookie("token", token, **cookie_kwargs(max_age_seconds=token_ttl))
-    if remember:
-        refresh_token = _create_refresh_token(conn, int(row["id"]))
+    if refresh_token:
         response.set_cookie(
             "refresh_token",
             refresh_token,
             **cookie_kwargs(max_age_seconds=REFRESH_TOKEN_TTL_SECONDS),
         )
     else:
-        refresh_cookie = request.cookies.get("refresh_token")
-        if refresh_cookie:
-            try:
-                conn.execute(
-                    "DELETE FROM auth_refresh_tokens WHERE token_hash = ?",
-                    (_hash_refresh_token(refresh_cookie),),
-                )
-                conn.commit()
-            except Exception:
-                pass
         ck = cookie_kwargs(max_age_seconds=0)
         response.set_cookie("refresh_token", value="", **ck)
+
+
+# register/login are async so they can await the bcrypt pool; their SQLite
+# work goes through asyncio.to_thread to stay off the event loop
+
+
+@router.post("/api/auth/register")
+async def register(body: RegisterBody, request: Request, response: Response):
+    if await asyncio.to_thread(_find_user, body.username):
+        return JSONResponse(status_code=409, content={"error": "用户名已注册"})
+    try:
+        hash_ = await password_service.hash(body.password)
+    except PasswordUnavailable as e:
+        return JSONResponse(status_code=503, content={"error": str(e)})
+    except PasswordBusy as e:
+        return JSONResponse(status_code=429, content={"error": str(e)})
+    # The name may have been registered while the hash was computed
+    last_id = await asyncio.to_thread(_insert_user, body.username, hash_)
+    if last_id is None:
+        return JSONResponse(status_code=409, content={"error": "用户名已注册"})
+    uid = int(last_id)
+    remember = bool(body.remember)
+    token_ttl = ACCESS_TOKEN_TTL_SECONDS if remember else ACCESS_TOKEN_TTL_SHORT_SECONDS
+    token = _issue_token(uid, body.username, token_ttl)
+    refresh_token = await asyncio.to_thread(
+        _open_session, uid, remember, request.cookies.get("refresh_token")
+    )
+    _set_session_cookies(response, token, token_ttl, refresh_token)
+    return {"user": {"id": uid, "username": body.username}}
+
+
+@router.post("/api/auth/login")
+async def login(body: LoginBody, request: Request, response: Response):
+    row = await asyncio.to_thread(_find_user, body.username)
+    if not row:
+        return JSONResponse(status_code=401, content={"error": "用户名或密码错误"})
+    try:
+        ok, new_hash = await password_service.verify(body.password, row["password_hash"])
+    except PasswordUnavailable as e:
+        return JSONResponse(status_code=503, content={"error": str(e)})
+    except PasswordBusy as e:
+        return JSONResponse(status_code=429, content={"error": str(e)})
+    if not ok:
+        return JSONResponse(status_code=401, content={"error": "用户名或密码错误"})
+    uid = int(row["id"])
+    remember = bool(body.remember)
+    token_ttl = ACCESS_TOKEN_TTL_SECONDS if remember else ACCESS_TOKEN_TTL_SHORT_SECONDS
+    token = _issue_token(uid, row["username"], token_ttl)
+    rehash = (new_hash, row["password_hash"]) if new_hash is not None else None
+    refresh_token = await asyncio.to_thread(
+        _open_session, uid, remember, request.cookies.get("refresh_token"), rehash
+    )
+    _set_session_cookies(response, token, token_ttl, refresh_token)
     return {
         "user": {
-            "id": int(row["id"]),
+            "id": uid,
             "username": row["username"],
             "avatarUrl": row["avatar_url"] or "",
             "signature": row["signature"] or "",
@@ -200,6 +288,9 @@ def login(body: LoginBody, request: Request, response: Response):
 
 @router.post("/api/auth/logout")
 def logout(request: Request, response: Response):
+    token = request.cookies.get("token")
+    if token:
+        _token_cache.pop(token)
     # Clear cookie by setting max_age=0 with same attributes
     refresh_token = request.cookies.get("refresh_token")
     if refresh_token:
@@ -230,25 +321,23 @@ def me(request: Request):
     uid = payload.get("uid")
     if uid is None:
         return {"user": None}
-    
-    # Fetch latest details from DB
-    conn = get_connection()
-    row = conn.execute(
-        "SELECT id, username, avatar_url, signature FROM users WHERE id = ?",
-        (int(uid),),
-    ).fetchone()
-    
-    if not row:
-        return {"user": None}
+    return {"user": _load_user_profile(int(uid))}
 
-    return {
-        "user": {
-            "id": int(row["id"]),
-            "username": row["username"],
-            "avatarUrl": row["avatar_url"] or "",
-            "signature": row["signature"] or "",
-        }
-    }
+
+@router.get("/api/auth/stats")
+def auth_stats(request: Request):
+    denied = ops_access_denied(request)
+    if denied is not None:
+        return denied
+    return password_service.stats()
+
+
+@router.get("/api/auth/refresh-tokens/stats")
+def refresh_token_stats(request: Request):
+    denied = ops_access_denied(request)
+    if denied is not None:
+        return denied
+    return refresh_sweeper.stats()
 
 
 @router.post("/api/auth/refresh")
@@ -332,22 +421,10 @@ def get_profile(request: Request):
     uid = payload.get("uid")
     if uid is None:
         return JSONResponse(status_code=401, content={"error": "未登录"})
-    conn = get_connection()
-    cur = conn.cursor()
-    row = cur.execute(
-        "SELECT id, username, avatar_url, signature FROM users WHERE id = ?",
-        (int(uid),),
-    ).fetchone()
-    if not row:
+    user = _load_user_profile(int(uid))
+    if user is None:
         return JSONResponse(status_code=404, content={"error": "用户不存在"})
-    return {
-        "user": {
-            "id": int(row["id"]),
-            "username": row["username"],
-            "avatarUrl": row["avatar_url"] or "",
-            "signature": row["signature"] or "",
-        }
-    }
+    return {"user": user}
 
 
 @router.patch("/api/auth/profile")
@@ -379,22 +456,13 @@ def patch_profile(request: Request, body: ProfilePatchBody = Body(default=Profil
         conn.commit()
     except Exception:
         return JSONResponse(status_code=500, content={"error": "更新失败"})
+    finally:
+        invalidate_user(int(uid))
 
-    cur = conn.cursor()
-    row = cur.execute(
-        "SELECT id, username, avatar_url, signature FROM users WHERE id = ?",
-        (int(uid),),
-    ).fetchone()
-    if not row:
+    user = _load_user_profile(int(uid))
+    if user is None:
         return JSONResponse(status_code=404, content={"error": "用户不存在"})
-    return {
-        "user": {
-            "id": int(row["id"]),
-            "username": row["username"],
-            "avatarUrl": row["avatar_url"] or "",
-            "signature": row["signature"] or "",
-        }
-    }
+    return {"user": user}
 
 
 @router.post("/api/auth/avatar/upload")
@@ -467,4 +535,6 @@ async def upload_avatar(request: Request, file: UploadFile = File(...)):
         conn.commit()
     except Exception:
         return JSONResponse(status_code=500, content={"error": "保存失败"})
+    finally:
+        invalidate_user(int(uid))
     return {"avatarUrl": avatar_url}
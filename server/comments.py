@@ -6,7 +6,7 @@ from fastapi.responses import JSONResponse
 
 from .auth import get_current_user
 from .db import get_connection
-from .sensitive_words import filter_sensitive, load_sensitive_words
+from .sensitive_words import filter_sensitive
 from .notifications import create_notification
 
 
@@ -26,15 +26,8 @@ def _require_user_id(request: Request) -> Optional[int]:
         return None
 
 
-def _load_words_cached() -> List[str]:
-    if not hasattr(_load_words_cached, "_cache"):
-        setattr(_load_words_cached, "_cache", load_sensitive_words())
-    return getattr(_load_words_cached, "_cache")
-
-
 def _mask_content(content: str) -> str:
-    words = _load_words_cached()
-    return filter_sensitive(content, words)
+    return filter_sensitive(content)
 
 
 def _build_tree(items: List[Dict]) -> List[Dict]:
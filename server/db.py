@@ -137,6 +137,7 @@ def run_migrations(conn: Optional[sqlite3.Connection] = None) -> None:
             );
 
             CREATE INDEX IF NOT EXISTS idx_auth_refresh_tokens_user ON auth_refresh_tokens(user_id);
+            CREATE INDEX IF NOT EXISTS idx_auth_refresh_tokens_expires ON auth_refresh_tokens(expires_at);
 
             CREATE TABLE IF NOT EXISTS resources (
               id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -174,6 +175,42 @@ def run_migrations(conn: Optional[sqlite3.Connection] = None) -> None:
             );
             CREATE INDEX IF NOT EXISTS idx_file_watermarks_wm ON file_watermarks(watermark_u64);
 
+            -- MinHash signature per watermarked file, for near-duplicate search
+            CREATE TABLE IF NOT EXISTS file_minhash (
+              file_id INTEGER PRIMARY KEY,
+              num_perm INTEGER NOT NULL,
+              seq_len INTEGER NOT NULL,
+              signature BLOB NOT NULL,
+              created_at TEXT NOT NULL DEFAULT (datetime('now')),
+              FOREIGN KEY (file_id) REFERENCES resource_files(id) ON DELETE CASCADE
+            );
+
+            -- LSH bands of file_minhash.signature: same (band, bucket) => candidate pair
+            CREATE TABLE IF NOT EXISTS file_lsh_buckets (
+              band INTEGER NOT NULL,
+              bucket INTEGER NOT NULL,
+              file_id INTEGER NOT NULL,
+              PRIMARY KEY (band, bucket, file_id),
+              FOREIGN KEY (file_id) REFERENCES resource_files(id) ON DELETE CASCADE
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_file_lsh_buckets_file ON file_lsh_buckets(file_id);
+
+            -- Interned object ids shared by all stored sequences
+            CREATE TABLE IF NOT EXISTS wm_tokens (
+              id INTEGER PRIMARY KEY,
+              token TEXT NOT NULL UNIQUE
+            );
+
+            -- Canonical sequence per watermarked file: wm_tokens ids, delta/varint encoded
+            CREATE TABLE IF NOT EXISTS file_sequences (
+              file_id INTEGER PRIMARY KEY,
+              codec INTEGER NOT NULL,
+              seq_len INTEGER NOT NULL,
+              data BLOB NOT NULL,
+              created_at TEXT NOT NULL DEFAULT (datetime('now')),
+              FOREIGN KEY (file_id) REFERENCES resource_files(id) ON DELETE CASCADE
+            );
+
             -- Per-file likes (one like per user per file)
             CREATE TABLE IF NOT EXISTS resource_file_likes (
               id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -386,10 +423,30 @@ def run_migrations(conn: Optional[sqlite3.Connection] = None) -> None:
               FOREIGN KEY (run_id) REFERENCES agent_runs(id) ON DELETE SET NULL
             );
 
+            -- Deltas of an assistant message that is still streaming; folded into
+            -- agent_messages.content and deleted when the message completes.
+            CREATE TABLE IF NOT EXISTS agent_message_chunks (
+              id INTEGER PRIMARY KEY AUTOINCREMENT,
+              message_id INTEGER NOT NULL,
+              kind TEXT NOT NULL,
+              text TEXT NOT NULL,
+              FOREIGN KEY (message_id) REFERENCES agent_messages(id) ON DELETE CASCADE
+            );
+
             CREATE INDEX IF NOT EXISTS idx_agent_messages_session ON agent_messages(session_id, id);
             CREATE INDEX IF NOT EXISTS idx_agent_runs_session ON agent_runs(session_id);
+            CREATE INDEX IF NOT EXISTS idx_agent_runs_status ON agent_runs(status, user_id);
+            CREATE INDEX IF NOT EXISTS idx_agent_message_chunks_message ON agent_message_chunks(message_id, id);
             """
         )
+        # agent_messages: plain visible text of assistant messages, so building
+        # LLM history does not have to JSON-decode the stored payload
+        try:
+            cols = [r["name"] for r in conn.execute("PRAGMA table_info(agent_messages)").fetchall()]
+            if "visible" not in cols:
+                conn.execute("ALTER TABLE agent_messages ADD COLUMN visible TEXT")
+        except Exception:
+            pass
         # resources: tags column for LLM auto-classification
         try:
             cols = [r["name"] for r in conn.execute("PRAGMA table_info(resources)").fetchall()]
@@ -1,23 +1,25 @@
 import os
 import re
+import asyncio
+import hashlib
 import tempfile
 import logging
+from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 from fastapi import APIRouter, File, Form, Query, Request, UploadFile, Body
 from fastapi.responses import FileResponse, JSONResponse, RedirectResponse
 
-from .auth import get_current_user
+from .auth import get_current_user, ops_access_denied
 from .db import get_connection
 from .utils import nanoid, now_ms, slugify_str, parse_bool
 from .llm2 import tags_from_json
-from .label.watermark_indexer import (
-    extract_sequence_from_melsave,
-    canonicalize,
-    fnv1a64,
-)
+from .label import minhash
+from .watermark_service import WatermarkBusy, WatermarkUnavailable, service as wm_service
+from .wm_sequences import load_sequences, store_minhash, store_sequence
 from .notifications import create_notification
+from .sensitive_words import filter_sensitive
 from . import storage as r2
 
 
@@ -34,6 +36,12 @@ TEMP_DIR = Path(tempfile.gettempdir()) / "msut_uploads"
 TEMP_DIR.mkdir(parents=True, exist_ok=True)
 
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
+# Files of one request streamed to R2 at the same time
+UPLOAD_CONCURRENCY = max(1, int(os.getenv("UPLOAD_CONCURRENCY", "4")))
+# Near-duplicate watermark search (MinHash/LSH candidates, LCS verification)
+WM_NEAR_MIN_JACCARD = float(os.getenv("WM_NEAR_MIN_JACCARD", "0.3"))
+WM_NEAR_VERIFY = max(0, int(os.getenv("WM_NEAR_VERIFY", "5")))
+WM_NEAR_TOLERANCE = float(os.getenv("WM_NEAR_TOLERANCE", "0.10"))
 
 
 def _share_url(slug: str) -> str:
@@ -60,6 +68,128 @@ def _u64_to_i64(u: int) -> int:
     return u - (1 << 64) if (u & (1 << 63)) else u
 
 
+def _near_candidates(
+    cur, signature: List[int], exclude: Set[int], limit: int = 200
+) -> List[Tuple[int, float]]:
+    """LSH lookup: files sharing at least one band bucket, ranked by estimated Jaccard."""
+    keys = minhash.band_keys(signature)
+    where = " OR ".join(["(band = ? AND bucket = ?)"] * len(keys))
+    params: List[int] = []
+    for band, key in enumerate(keys):
+        params.extend((band, key))
+    rows = cur.execute(
+        f"""
+        SELECT file_id, COUNT(1) AS hits FROM file_lsh_buckets
+        WHERE {where}
+        GROUP BY file_id ORDER BY hits DESC LIMIT ?
+        """,
+        (*params, limit),
+    ).fetchall()
+    ids = [int(r["file_id"]) for r in rows if int(r["file_id"]) not in exclude]
+    if not ids:
+        return []
+    ph = ",".join(["?"] * len(ids))
+    sigs = cur.execute(
+        f"SELECT file_id, signature FROM file_minhash WHERE file_id IN ({ph})",
+        tuple(ids),
+    ).fetchall()
+    scored = []
+    for r in sigs:
+        est = minhash.jaccard(signature, minhash.unpack(r["signature"]))
+        if est >= WM_NEAR_MIN_JACCARD:
+            scored.append((int(r["file_id"]), est))
+    scored.sort(key=lambda t: t[1], reverse=True)
+    return scored
+
+
+async def _fetch_stored_file(stored_name: str) -> Tuple[Path, bool]:
+    """Local path for a stored file; returns (path, is_temp). R2 objects are downloaded."""
+    if "/" not in stored_name:
+        return UPLOAD_DIR / stored_name, False
+    data = await asyncio.to_thread(r2.download_bytes, stored_name)
+    tmp_path = TEMP_DIR / f"verify-{nanoid()}{Path(stored_name).suffix}"
+    await asyncio.to_thread(tmp_path.write_bytes, data)
+    return tmp_path, True
+
+
+def _load_near_candidates(
+    signature: List[int], exclude: Set[int]
+) -> Tuple[List[Tuple[int, float]], Dict[int, Any], Dict[int, List[str]]]:
+    """Blocking part of _near_duplicates: LSH candidates, their file rows and
+    stored sequences (decoded here, off the event loop)."""
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cands = _near_candidates(cur, signature, exclude)[:WM_NEAR_VERIFY]
+        if not cands:
+            return [], {}, {}
+        ph = ",".join(["?"] * len(cands))
+        rows = cur.execute(
+            f"""
+            SELECT rf.id AS file_id, rf.resource_id, rf.original_name, rf.url_path, rf.stored_name,
+                   r.slug AS resource_slug, r.title AS resource_title
+            FROM resource_files rf
+            LEFT JOIN resources r ON r.id = rf.resource_id
+            WHERE rf.id IN ({ph})
+            """,
+            tuple(fid for fid, _ in cands),
+        ).fetchall()
+        by_id = {int(r["file_id"]): r for r in rows}
+        return cands, by_id, load_sequences(cur, by_id.keys())
+    finally:
+        conn.close()
+
+
+async def _near_duplicates(
+    signature: List[int], seq: List[str], exclude: Set[int]
+) -> List[Dict]:
+    cands, by_id, stored = await asyncio.to_thread(_load_near_candidates, signature, exclude)
+    if not cands:
+        return []
+
+    async def _verify(file_id: int, est: float) -> Optional[Dict]:
+        r = by_id.get(file_id)
+        if r is None:
+            return None
+        other = stored.get(file_id)
+        if other is not None:
+            lcs, other_len = await wm_service.lcs_seq(seq, other)
+        else:
+            # Not backfilled yet (see _backfill_wm.py): re-parse the stored save
+            path, is_temp = await _fetch_stored_file(r["stored_name"])
+            try:
+                lcs, other_len = await wm_service.lcs(seq, str(path))
+            finally:
+                if is_temp:
+                    path.unlink(missing_ok=True)
+        longest = max(len(seq), other_len)
+        similarity = lcs / longest if longest else 0.0
+        return {
+            "fileId": file_id,
+            "resourceId": int(r["resource_id"]) if r["resource_id"] is not None else None,
+            "resourceSlug": r["resource_slug"],
+            "resourceTitle": r["resource_title"],
+            "originalName": r["original_name"],
+            "urlPath": r["url_path"],
+            "jaccard": round(est, 4),
+            "lcs": lcs,
+            "similarity": round(similarity, 4),
+            "probableSame": similarity >= 1.0 - WM_NEAR_TOLERANCE,
+        }
+
+    results = await asyncio.gather(
+        *(_verify(fid, est) for fid, est in cands), return_exceptions=True
+    )
+    out = []
+    for (fid, _est), res in zip(cands, results):
+        if isinstance(res, BaseException):
+            logger.warning("wm-check: verify failed fileId=%s error=%s", fid, res)
+        elif res is not None:
+            out.append(res)
+    out.sort(key=lambda m: (m["similarity"], m["jaccard"]), reverse=True)
+    return out
+
+
 def _is_image_file(mime: Optional[str], name: Optional[str]) -> bool:
     """
     判定一个文件是否为图片文件（用于封面/展示图）：
@@ -130,6 +260,8 @@ async def create_resource(
     uid = _require_user_id(request)
     if uid is None:
         return JSONResponse(status_code=401, content={"error": "未登录"})
+    if isinstance(description, str):
+        description = filter_sensitive(description)
     base = slugify_str(title) or f"res-{nanoid()}"
     slug = base
     conn = get_connection()
@@ -163,68 +295,87 @@ async def create_resource(
     }
 
 
+@dataclass
+class SavedUpload:
+    r2_key: str
+    url_path: str
+    size: int
+    sha256: str
+    # Only set when the caller asked for a local copy (random access, e.g. zip)
+    temp_path: Optional[Path] = None
+
+
+async def _client_gone(request: Request) -> bool:
+    try:
+        return await request.is_disconnected()
+    except Exception:
+        return False
+
+
 async def _save_upload_to_r2(
-    request: Request, file: UploadFile
-) -> Optional[Tuple[str, str, int, Path]]:
-    """Save an uploaded file to a temp path, upload to R2, and return
-    (r2_key, url_path, size, temp_path) on success, or None on failure.
-    The temp file is kept for optional watermark extraction and cleaned up by caller.
+    request: Request, file: UploadFile, keep_temp: bool = False
+) -> Optional[SavedUpload]:
+    """Stream an uploaded file to R2 and return a SavedUpload, or None on failure.
+    Chunks are hashed and handed to a multipart upload as they are read, so the
+    R2 transfer runs off the event loop without staging the whole file on disk.
+    With keep_temp=True a local copy is written on the same pass (needed for zip
+    watermark extraction) and must be cleaned up by the caller.
     Aborts and cleans up if client disconnects or file exceeds MAX_FILE_SIZE.
     """
     ext = Path(file.filename or "").suffix
     stored_name = f"{now_ms()}-{nanoid()}{ext}"
     r2_key = f"uploads/{stored_name}"
-    temp_path = TEMP_DIR / stored_name
+    temp_path = TEMP_DIR / stored_name if keep_temp else None
+    hasher = hashlib.sha256()
     size = 0
+    upload: Optional[r2.StreamingUpload] = None
+    tmp_f = None
     try:
-        with temp_path.open("wb") as f:
-            while True:
-                chunk = await file.read(1024 * 1024)
-                if not chunk:
-                    break
-                f.write(chunk)
-                size += len(chunk)
-                if size > MAX_FILE_SIZE:
-                    try:
-                        f.flush()
-                    except Exception:
-                        pass
-                    try:
-                        f.close()
-                    except Exception:
-                        pass
-                    temp_path.unlink(missing_ok=True)
-                    return None
-                try:
-                    if await request.is_disconnected():
-                        try:
-                            f.flush()
-                        except Exception:
-                            pass
-                        try:
-                            f.close()
-                        except Exception:
-                            pass
-                        temp_path.unlink(missing_ok=True)
-                        return None
-                except Exception:
-                    pass
-        try:
-            if await request.is_disconnected():
+        upload = r2.StreamingUpload(r2_key, file.content_type or "")
+        if temp_path is not None:
+            tmp_f = temp_path.open("wb")
+        while True:
+            chunk = await file.read(1024 * 1024)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > MAX_FILE_SIZE:
+                raise RuntimeError("file_too_large")
+            hasher.update(chunk)
+            if tmp_f is not None:
+                tmp_f.write(chunk)
+            await upload.write(chunk)
+            if await _client_gone(request):
+                raise RuntimeError("client_disconnected")
+        if tmp_f is not None:
+            tmp_f.close()
+            tmp_f = None
+        if await _client_gone(request):
+            raise RuntimeError("client_disconnected")
+        url_path = await upload.complete()
+        return SavedUpload(
+            r2_key=r2_key,
+            url_path=url_path,
+            size=size,
+            sha256=hasher.hexdigest(),
+            temp_path=temp_path,
+        )
+    except (Exception, asyncio.CancelledError) as ex:
+        logger.info("upload aborted: key=%s size=%s reason=%r", r2_key, size, ex)
+        if upload is not None:
+            await upload.abort()
+        if tmp_f is not None:
+            try:
+                tmp_f.close()
+            except Exception:
+                pass
+        if temp_path is not None:
+            try:
                 temp_path.unlink(missing_ok=True)
-                return None
-        except Exception:
-            pass
-        # Upload to R2
-        content_type = file.content_type or ""
-        r2.upload_file(r2_key, temp_path, content_type)
-        url_path = r2.build_public_url(r2_key)
-        return (r2_key, url_path, size, temp_path)
-    except Exception:
-        try:
-            temp_path.unlink(missing_ok=True)
-        except Exception:
-            pass
+            except Exception:
+                pass
+        if isinstance(ex, asyncio.CancelledError):
+            raise
         return None
     finally:
         try:
@@ -270,18 +421,60 @@ async def upload_to_resource(
         return JSONResponse(status_code=400, content={"error": "没有文件"})
     saved = []
     do_wm = parse_bool(saveWatermark, False)
-    # 使用 autocommit，每条语句独立事务，避免长时间持有写锁
     created_r2_keys: List[str] = []
     created_temp_paths: List[Path] = []
-    first_uploaded_image_id: Optional[int] = None
-    try:
-        for uf in files[:10]:
-            result = await _save_upload_to_r2(request, uf)
-            if result is None:
-                raise RuntimeError("upload_failed")
-            r2_key, url_path, file_size, temp_path = result
-            created_r2_keys.append(r2_key)
-            created_temp_paths.append(temp_path)
+    if do_wm and wm_service.saturated() and any(
+        Path(uf.filename or "").suffix.lower() in {".melsave", ".zip"}
+        for uf in files[:10]
+    ):
+        wm_service.record_rejection()
+        return JSONResponse(status_code=429, content={"error": "水印任务繁忙，请稍后再试"})
+    sem = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+
+    async def _process(uf: UploadFile):
+        # Stage 1: stream to R2 (bounded by sem); stage 2: watermark in a worker process
+        suffix = Path(uf.filename or "").suffix.lower()
+        want_wm = do_wm and suffix in {".melsave", ".zip"}
+        async with sem:
+            result = await _save_upload_to_r2(request, uf, keep_temp=want_wm)
+        if result is None:
+            raise RuntimeError("upload_failed")
+        created_r2_keys.append(result.r2_key)
+        wm = None
+        if result.temp_path is not None:
+            created_temp_paths.append(result.temp_path)
+            logger.info(
+                "wm: extracting key=%s name=%s suffix=%s sha256=%s",
+                result.r2_key,
+                uf.filename or result.r2_key,
+                suffix,
+                result.sha256,
+            )
+            try:
+                wm = await wm_service.compute(str(result.temp_path), keep_sequence=True)
+            except WatermarkBusy:
+                # Includes WatermarkUnavailable (timeout / dead pool): fail the
+                # request rather than store the file without its watermark
+                raise
+            except Exception as ex:
+                # Do not fail the whole upload if watermark extraction fails
+                logger.exception(
+                    "wm: extract failed key=%s error=%s", result.r2_key, ex
+                )
+        else:
+            logger.info(
+                "wm: skipped (saveWatermark=%s suffix=%s) key=%s",
+                do_wm,
+                suffix,
+                result.r2_key,
+            )
+        return uf, result, wm
+
+    def _write_rows(results) -> None:
+        first_uploaded_image_id: Optional[int] = None
+        cur.execute("BEGIN")
+        for uf, result, wm in results:
+            r2_key = result.r2_key
             info = cur.execute(
                 """
                 INSERT INTO resource_files (resource_id, original_name, stored_name, mime, size, url_path)
@@ -292,8 +485,8 @@ async def upload_to_resource(
                     uf.filename or r2_key,
                     r2_key,
                     uf.content_type or None,
-                    file_size,
-                    url_path,
+                    result.size,
+                    result.url_path,
                 ),
             )
             file_id = int(info.lastrowid)
@@ -301,61 +494,36 @@ async def upload_to_resource(
             if _is_image_file(uf.content_type, uf.filename):
                 if first_uploaded_image_id is None:
                     first_uploaded_image_id = file_id
-            # Attempt watermark extraction for .melsave/.zip when requested
-            try:
-                suffix = Path(uf.filename or "").suffix.lower()
-                if do_wm and suffix in {".melsave", ".zip"}:
-                    logger.info(
-                        "wm: extracting fileId=%s name=%s suffix=%s",
-                        file_id,
-                        uf.filename or r2_key,
-                        suffix,
-                    )
-                    raw_seq, embedded = extract_sequence_from_melsave(str(temp_path))
-                    seq_canon = canonicalize([str(x) for x in raw_seq])
-                    wm_u64 = int(fnv1a64(seq_canon))
-                    wm_i64 = _u64_to_i64(wm_u64)
-                    emb_i64 = (
-                        _u64_to_i64(int(embedded)) if embedded is not None else None
-                    )
-                    cur.execute(
-                        """
-                        INSERT OR REPLACE INTO file_watermarks (file_id, watermark_u64, seq_len, embedded_watermark)
-                        VALUES (?, ?, ?, ?)
-                        """,
-                        (file_id, wm_i64, int(len(seq_canon)), emb_i64),
-                    )
-                    logger.info(
-                        "wm: saved fileId=%s watermark_u64=%s watermark_i64=%s length=%s embedded=%s embedded_i64=%s",
-                        file_id,
-                        wm_u64,
-                        wm_i64,
-                        int(len(seq_canon)),
-                        embedded if embedded is not None else None,
-                        emb_i64,
-                    )
-                else:
-                    logger.info(
-                        "wm: skipped (saveWatermark=%s suffix=%s) fileId=%s",
-                        do_wm,
-                        suffix,
-                        file_id,
-                    )
-            except Exception as ex:
-                # Do not fail the whole upload if watermark extraction fails
-                try:
-                    logger.exception(
-                        "wm: extract failed fileId=%s error=%s", file_id, ex
-                    )
-                except Exception:
-                    pass
+            if wm is not None:
+                wm_u64, seq_len, embedded = wm.watermark_u64, wm.length, wm.embedded
+                wm_i64 = _u64_to_i64(wm_u64)
+                emb_i64 = _u64_to_i64(int(embedded)) if embedded is not None else None
+                cur.execute(
+                    """
+                    INSERT OR REPLACE INTO file_watermarks (file_id, watermark_u64, seq_len, embedded_watermark)
+                    VALUES (?, ?, ?, ?)
+                    """,
+                    (file_id, wm_i64, int(seq_len), emb_i64),
+                )
+                store_minhash(cur, file_id, wm.signature, seq_len)
+                if wm.sequence is not None:
+                    store_sequence(cur, file_id, wm.sequence)
+                logger.info(
+                    "wm: saved fileId=%s watermark_u64=%s watermark_i64=%s length=%s embedded=%s embedded_i64=%s",
+                    file_id,
+                    wm_u64,
+                    wm_i64,
+                    int(seq_len),
+                    embedded,
+                    emb_i64,
+                )
             saved.append(
                 {
                     "id": file_id,
                     "originalName": uf.filename or r2_key,
-                    "size": file_size,
+                    "size": result.size,
                     "mime": uf.content_type or None,
-                    "urlPath": url_path,
+                    "urlPath": result.url_path,
                 }
             )
         # After all files are uploaded, set the cover if it's the first image and no cover exists
@@ -373,19 +541,32 @@ async def upload_to_resource(
                     resourceId,
                     first_uploaded_image_id,
                 )
-
         conn.commit()
-    except Exception:
-        # Roll back DB and delete any R2 objects uploaded during this request
+
+    tasks = [asyncio.create_task(_process(uf)) for uf in files[:10]]
+    try:
+        results = await asyncio.gather(*tasks)
+        # All objects are in R2: write every row in a single short transaction,
+        # in a thread so interning a long sequence's tokens does not stall the
+        # event loop
+        await asyncio.to_thread(_write_rows, results)
+    except Exception as ex:
+        # Stop in-flight uploads, roll back DB and delete any R2 objects uploaded during this request
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
         try:
             conn.rollback()
         except Exception:
             pass
-        for key in created_r2_keys:
-            try:
-                r2.delete_object(key)
-            except Exception:
-                pass
+        await asyncio.gather(
+            *(asyncio.to_thread(r2.delete_object, key) for key in created_r2_keys),
+            return_exceptions=True,
+        )
+        if isinstance(ex, WatermarkUnavailable):
+            return JSONResponse(status_code=503, content={"error": str(ex)})
+        if isinstance(ex, WatermarkBusy):
+            return JSONResponse(status_code=429, content={"error": str(ex)})
         return JSONResponse(status_code=400, content={"error": "上传失败"})
     finally:
         for p in created_temp_paths:
@@ -425,16 +606,14 @@ async def upload_resource_images(
     cur = conn.cursor()
     saved = []
     created_r2_keys: List[str] = []
-    created_temp_paths: List[Path] = []
     first_uploaded_image_id: Optional[int] = None
     try:
         for uf in files[:10]:
             result = await _save_upload_to_r2(request, uf)
             if result is None:
                 raise RuntimeError("upload_failed")
-            r2_key, url_path, file_size, temp_path = result
+            r2_key, url_path, file_size = result.r2_key, result.url_path, result.size
             created_r2_keys.append(r2_key)
-            created_temp_paths.append(temp_path)
             info = cur.execute(
                 """
                 INSERT INTO resource_files (resource_id, original_name, stored_name, mime, size, url_path)
@@ -490,12 +669,6 @@ async def upload_resource_images(
             except Exception:
                 pass
         return JSONResponse(status_code=400, content={"error": "上传失败"})
-    finally:
-        for p in created_temp_paths:
-            try:
-                p.unlink(missing_ok=True)
-            except Exception:
-                pass
     return {"ok": True, "files": saved}
 
 
@@ -512,14 +685,19 @@ async def check_watermark(file: UploadFile = File(...)):
             return JSONResponse(
                 status_code=400, content={"error": "仅支持 .melsave 或 .zip"}
             )
+        if wm_service.saturated():
+            wm_service.record_rejection()
+            return JSONResponse(
+                status_code=429, content={"error": "水印任务繁忙，请稍后再试"}
+            )
         # Save to a temp file for processing
         with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+            tmp_path = Path(tmp.name)
             while True:
-                chunk = file.file.read(1024 * 1024)
+                chunk = await file.read(1024 * 1024)
                 if not chunk:
                     break
                 tmp.write(chunk)
-            tmp_path = Path(tmp.name)
     except Exception:
         try:
             file.file.close()
@@ -533,12 +711,12 @@ async def check_watermark(file: UploadFile = File(...)):
             pass
 
     try:
-        raw_seq, embedded = extract_sequence_from_melsave(str(tmp_path))
-        seq_canon = canonicalize([str(x) for x in raw_seq])
-        wm_u64 = int(fnv1a64(seq_canon))
+        wm = await wm_service.compute(str(tmp_path), keep_sequence=True)
+        wm_u64 = wm.watermark_u64
+        embedded = wm.embedded
         wm_i64 = _u64_to_i64(wm_u64)
         emb_i64 = _u64_to_i64(int(embedded)) if embedded is not None else None
-        length = int(len(seq_canon))
+        length = wm.length
         try:
             logger.info(
                 "wm-check: computed watermark_u64=%s watermark_i64=%s length=%s embedded=%s embedded_i64=%s",
@@ -550,6 +728,13 @@ async def check_watermark(file: UploadFile = File(...)):
             )
         except Exception:
             pass
+    except WatermarkBusy as e:
+        try:
+            tmp_path.unlink(missing_ok=True)
+        except Exception:
+            pass
+        status = 503 if isinstance(e, WatermarkUnavailable) else 429
+        return JSONResponse(status_code=status, content={"error": str(e)})
     except Exception as e:
         try:
             tmp_path.unlink(missing_ok=True)
@@ -602,14 +787,37 @@ async def check_watermark(file: UploadFile = File(...)):
         except Exception:
             pass
 
+    # Approximate matches: LSH candidates verified by LCS
+    try:
+        near_matches = await _near_duplicates(
+            wm.signature, wm.sequence or [], {m["fileId"] for m in matches}
+        )
+        logger.info(
+            "wm-check: nearMatches=%s fileIds=%s",
+            len(near_matches),
+            [m["fileId"] for m in near_matches],
+        )
+    except Exception as ex:
+        logger.warning("wm-check: near-duplicate search failed: %s", ex)
+        near_matches = []
+
     return {
         "watermark": wm_u64,
         "length": length,
         "embedded": int(embedded) if embedded is not None else None,
         "matches": matches,
+        "nearMatches": near_matches,
     }
 
 
+@router.get("/api/watermark/stats")
+def watermark_stats(request: Request):
+    denied = ops_access_denied(request)
+    if denied is not None:
+        return denied
+    return wm_service.stats()
+
+
 @router.get("/api/my/resources")
 def list_my_resources(request: Request):
     uid = _require_user_id(request)
@@ -762,7 +970,7 @@ async def update_resource(
     params = []
     if isinstance(description, str):
         updates.append("description = ?")
-        params.append(description)
+        params.append(filter_sensitive(description))
     if isinstance(usage, str):
         updates.append("usage = ?")
         params.append(usage)
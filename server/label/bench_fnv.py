@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+fnv1a64 的金标准校验 + 微基准。
+
+  1) 对生成器目录（全自动生成v2.3.11）下所有 .melsave 提取序列，
+     比较 fnv.fnv1a64 / 纯 Python 路径 与 原始逐字节实现 的结果（raw / rev / canon 三种）；
+  2) 额外覆盖空序列、中文、孤立代理字符（errors="ignore" 分支）等边界；
+  3) 用合成序列做微基准，打印三种实现耗时与加速比。
+
+用法：
+  python bench_fnv.py
+  python bench_fnv.py --dir ..\\全自动生成v2.3.11 --tokens 50000 --repeat 5
+任一结果不一致时退出码为 1。
+固定向量与边界用例的断言测试见 server/_test_fnv.py。
+"""
+
+import argparse, os, random, sys, time
+from typing import Callable, List
+
+try:
+    from . import fnv
+    from .watermark_indexer import canonicalize, extract_sequence_from_melsave
+except ImportError:
+    import fnv
+    from watermark_indexer import canonicalize, extract_sequence_from_melsave
+
+_DEFAULT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "全自动生成v2.3.11")
+
+_EDGE_CASES: List[List[str]] = [
+    [],
+    [""],
+    ["a"],
+    ["芯片", "水印", "melon"],
+    ["bad\ud800surrogate", "ok"],
+    [str(i) for i in range(1000)],
+]
+
+
+def _check(seq: List[str], label: str) -> bool:
+    want = fnv.fnv1a64_reference(seq)
+    got = fnv.fnv1a64(seq)
+    got_py = fnv.fnv1a64_bytes_py(fnv.sequence_bytes(seq))
+    if got != want or got_py != want:
+        print(f"[MISMATCH] {label}: reference={want} fast={got} py={got_py}")
+        return False
+    return True
+
+
+def golden(sample_dir: str) -> bool:
+    ok = True
+    files = []
+    if os.path.isdir(sample_dir):
+        files = sorted(
+            os.path.join(sample_dir, fn)
+            for fn in os.listdir(sample_dir)
+            if fn.lower().endswith(".melsave")
+        )
+    if not files:
+        print(f"警告：{sample_dir} 下没有 .melsave，只校验边界用例")
+    for p in files:
+        try:
+            raw, _emb = extract_sequence_from_melsave(p)
+        except Exception as ex:
+            print(f"[SKIP] {os.path.basename(p)}: {ex}")
+            continue
+        raw = [str(x) for x in raw]
+        for label, seq in (("raw", raw), ("rev", list(reversed(raw))), ("canon", canonicalize(raw))):
+            ok &= _check(seq, f"{os.path.basename(p)}:{label}")
+        print(f"[OK] {os.path.basename(p)} length={len(raw)} watermark_u64={fnv.fnv1a64(canonicalize(raw))}")
+    for i, seq in enumerate(_EDGE_CASES):
+        ok &= _check(seq, f"edge#{i}")
+    return ok
+
+
+def _best(fn: Callable[[], int], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def bench(tokens: int, repeat: int) -> None:
+    rnd = random.Random(42)
+    seq = [f"{rnd.randrange(1, 400)}" for _ in range(tokens)]
+    fnv.fnv1a64(seq[:10])  # 触发 numba JIT 编译，不计入耗时
+    nbytes = len(fnv.sequence_bytes(seq))
+    t_ref = _best(lambda: fnv.fnv1a64_reference(seq), repeat)
+    t_py = _best(lambda: fnv.fnv1a64_bytes_py(fnv.sequence_bytes(seq)), repeat)
+    t_fast = _best(lambda: fnv.fnv1a64(seq), repeat)
+    print(f"\n=== 微基准：{tokens} tokens / {nbytes} bytes，best of {repeat} ===")
+    print(f"reference  {t_ref * 1000:9.2f} ms")
+    print(f"python     {t_py * 1000:9.2f} ms  x{t_ref / t_py:.1f}")
+    print(f"fnv1a64    {t_fast * 1000:9.2f} ms  x{t_ref / t_fast:.1f}  (native={'yes' if fnv.HAS_NATIVE else 'no'})")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--dir", default=_DEFAULT_DIR)
+    ap.add_argument("--tokens", type=int, default=50000)
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--no-bench", action="store_true")
+    args = ap.parse_args()
+
+    ok = golden(args.dir)
+    if not args.no_bench:
+        bench(args.tokens, args.repeat)
+    if not ok:
+        sys.exit(1)
+    print("\n全部一致。")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+FNV-1a 64 水印哈希（与 watermark_indexer / lcs_matcher 原实现逐位一致）。
+
+原实现对每个 token 单独 f"{idx}#{tok}".encode() 再逐字节循环；这里先把整条序列
+拼成一个 bytes 缓冲区，再一次性哈希：
+  - 装了 numba 时走 JIT 编译的 uint64 循环（原生速度）；
+  - 否则走纯 Python 的单层循环（省掉每个 token 的格式化/编码开销）。
+FNV-1a 每一步都依赖上一步结果，没法做 SIMD 向量化，所以加速只能靠编译循环。
+"""
+
+from typing import List
+
+FNV_OFFSET = 14695981039346656037
+FNV_PRIME = 1099511628211
+_MASK = 0xFFFFFFFFFFFFFFFF
+
+try:
+    import numpy as _np
+    from numba import njit as _njit
+except ImportError:
+    _np = None
+    _njit = None
+
+if _njit is not None:
+    @_njit(nogil=True)
+    def _fnv1a64_native(buf):  # pragma: no cover - exercised only with numba
+        h = _np.uint64(FNV_OFFSET)
+        prime = _np.uint64(FNV_PRIME)
+        for b in buf:
+            h = (h ^ _np.uint64(b)) * prime
+        return h
+else:
+    _fnv1a64_native = None
+
+HAS_NATIVE = _fnv1a64_native is not None
+
+
+def sequence_bytes(seq: List[str]) -> bytes:
+    """把序列拼成哈希输入：b"0#tok0" + b"1#tok1" + ...（与逐段编码结果相同）。"""
+    return "".join([f"{idx}#{tok}" for idx, tok in enumerate(seq)]).encode(
+        "utf-8", errors="ignore"
+    )
+
+
+def fnv1a64_bytes_py(data: bytes) -> int:
+    h = FNV_OFFSET
+    prime = FNV_PRIME
+    mask = _MASK
+    for b in data:
+        h = ((h ^ b) * prime) & mask
+    return h
+
+
+def fnv1a64_bytes(data: bytes) -> int:
+    if _fnv1a64_native is not None:
+        return int(_fnv1a64_native(_np.frombuffer(data, dtype=_np.uint8)))
+    return fnv1a64_bytes_py(data)
+
+
+def fnv1a64(seq: List[str]) -> int:
+    """对规范化后的序列做 64 位 FNV-1a。"""
+    return fnv1a64_bytes(sequence_bytes(seq))
+
+
+def fnv1a64_reference(seq: List[str]) -> int:
+    """原始逐 token / 逐字节实现，仅用于校验与基准对比。"""
+    h = FNV_OFFSET
+    for idx, tok in enumerate(seq):
+        piece = f"{idx}#{tok}".encode("utf-8", errors="ignore")
+        for b in piece:
+            h ^= b
+            h = (h * FNV_PRIME) & _MASK
+    return h
@@ -9,8 +9,18 @@
   - LCS 时对双方序列都取 canon，彻底消灭"整段倒序"的影响
 """
 
-import argparse, csv, io, json, os, time, zipfile, re
-from typing import Any, List, Optional, Tuple
+import argparse, csv, io, json, math, os, time, zipfile, re
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+
+try:
+    from .fnv import fnv1a64  # 作为 server.label 包导入
+except ImportError:
+    from fnv import fnv1a64  # 作为独立脚本运行
+
+try:
+    from .watermark_indexer import load_registry as load_index_registry
+except ImportError:
+    from watermark_indexer import load_registry as load_index_registry
 
 _INT_RE = re.compile(r'^[+-]?\d+$')
 
@@ -39,17 +49,6 @@ def canonicalize(seq: List[str]) -> List[str]:
     rev = list(reversed(seq))
     return seq if seq <= rev else rev
 
-def fnv1a64(seq: List[str]) -> int:
-    FNV_OFFSET = 14695981039346656037
-    FNV_PRIME = 1099511628211
-    h = FNV_OFFSET
-    for idx, tok in enumerate(seq):
-        piece = f"{idx}#{tok}".encode("utf-8", errors="ignore")
-        for b in piece:
-            h ^= b
-            h = (h * FNV_PRIME) & 0xFFFFFFFFFFFFFFFF
-    return h
-
 # --------- 解析与程序 A 保持一致 ----------
 def _extract_seq_from_containers(obj: dict) -> Optional[List[str]]:
     if not isinstance(obj, dict) or "saveObjectContainers" not in obj:
@@ -178,7 +177,50 @@ def extract_sequence_and_embedded_wm(path: str) -> Tuple[List[str], Optional[int
         raise RuntimeError(f"{path} 的 Data 无法解析")
 
 # -------------------- 算法 --------------------
-def lcs_length(a: List[str], b: List[str]) -> int:
+class Interner:
+    """把 objectId 字符串映射成小整数；同一个 Interner 下的序列才能互相比较。"""
+
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+
+    def __call__(self, seq: List[str]) -> List[int]:
+        ids = self.ids
+        return [ids.setdefault(tok, len(ids)) for tok in seq]
+
+
+def lcs_length(a: Sequence[Hashable], b: Sequence[Hashable], min_length: Optional[int] = None) -> int:
+    """位并行 LCS（Allison–Dix / Hyyrö），结果与 O(N·M) 动态规划逐一相同。
+
+    较长序列编码为大整数位向量，外层只循环较短序列，每步是几次大整数运算。
+    min_length：提前退出模式。一旦确定 LCS 不可能达到 min_length，立即返回当前上界
+    （一定 < min_length）；否则返回精确值。
+    """
+    if not a or not b:
+        return 0
+    if len(a) < len(b):
+        a, b = b, a
+    m, n = len(a), len(b)
+    peq: Dict[Hashable, int] = {}
+    bit = 1
+    for tok in a:
+        peq[tok] = peq.get(tok, 0) | bit
+        bit <<= 1
+    mask = (1 << m) - 1
+    v = mask  # v 中 0 的个数 = 当前 LCS
+    get = peq.get
+    for j, tok in enumerate(b):
+        u = v & get(tok, 0)
+        if u:
+            v = ((v + u) | (v - u)) & mask
+        if min_length is not None and (j & 63) == 63:
+            bound = m - v.bit_count() + (n - j - 1)
+            if bound < min_length:
+                return bound
+    return m - v.bit_count()
+
+
+def _lcs_length_dp(a: Sequence[Hashable], b: Sequence[Hashable]) -> int:
+    """原始 O(N·M) 动态规划，仅用于校验。"""
     if not a or not b:
         return 0
     if len(a) < len(b):
@@ -200,8 +242,8 @@ def lcs_length(a: List[str], b: List[str]) -> int:
 def load_registry(path: str) -> dict:
     if not os.path.exists(path):
         raise FileNotFoundError(f"未找到 registry：{path}")
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    # .json / .jsonl / .sqlite 都由 watermark_indexer 读成同一结构
+    return load_index_registry(path)
 
 def main():
     ap = argparse.ArgumentParser()
@@ -209,6 +251,8 @@ def main():
     ap.add_argument("--registry", required=True)
     ap.add_argument("--tolerance", type=float, default=0.10)
     ap.add_argument("--topk", type=int, default=5)
+    ap.add_argument("--early-exit", action="store_true",
+                    help="达不到阈值的条目提前放弃；此时其 L 只是上界")
     args = ap.parse_args()
 
     # 当前存档：原始序列，三种水印
@@ -243,21 +287,30 @@ def main():
 
     # 2) LCS 匹配：双方都用 canon(seq)
     print(f"\n=== LCS 近似匹配（容忍度 {args.tolerance:.2f} -> 阈值 S≥{1.0 - args.tolerance:.2f}）===")
-    scored = []
+    # registry 只做一次规范化 + 整数化
+    intern = Interner()
+    query = intern(seq_canon)
+    prepared = []
     for e in entries:
         e_seq = e.get("sequence")
         if not isinstance(e_seq, list) or not e_seq:
             continue
-        e_seq_canon = canonicalize([str(x) for x in e_seq])
-        L = lcs_length(seq_canon, e_seq_canon)
-        N, M = len(seq_canon), len(e_seq_canon)
+        prepared.append((e, intern(canonicalize([str(x) for x in e_seq]))))
+    threshold = 1.0 - args.tolerance
+    scored = []
+    for e, e_tok in prepared:
+        N, M = len(query), len(e_tok)
+        need = None
+        if args.early_exit:
+            # sim_long = L / max(N, M) >= threshold
+            need = max(0, math.ceil(threshold * max(N, M) - 1e-9))
+        L = lcs_length(query, e_tok, min_length=need)
         sim_long = L / max(N, M) if max(N, M) else 0.0
         sim_mean = 2 * L / (N + M) if (N + M) else 0.0
         scored.append({"entry": e, "L": L, "N": N, "M": M, "sim_long": sim_long, "sim_mean": sim_mean})
     scored.sort(key=lambda x: (x["sim_long"], x["sim_mean"], x["L"]), reverse=True)
     topk = scored[: max(1, args.topk)]
 
-    threshold = 1.0 - args.tolerance
     any_probable = False
     for s in topk:
         e = s["entry"]
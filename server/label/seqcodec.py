@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+整数序列的紧凑编码：相邻差值 → zigzag → LEB128 varint。
+
+服务端把规范化序列里的 objectId 先映射为字典 id（wm_tokens 表，按首次出现顺序分配），
+同一存档里的 id 大多连续递增，差值通常只占 1 字节。
+"""
+
+from typing import Iterable, List
+
+
+def _zigzag(n: int) -> int:
+    return (n << 1) if n >= 0 else ((-n << 1) - 1)
+
+
+def _unzigzag(z: int) -> int:
+    return (z >> 1) if not (z & 1) else -((z + 1) >> 1)
+
+
+def encode(ids: Iterable[int]) -> bytes:
+    out = bytearray()
+    prev = 0
+    for x in ids:
+        z = _zigzag(int(x) - prev)
+        prev = int(x)
+        while z >= 0x80:
+            out.append((z & 0x7F) | 0x80)
+            z >>= 7
+        out.append(z)
+    return bytes(out)
+
+
+def decode(blob: bytes) -> List[int]:
+    out: List[int] = []
+    prev = 0
+    z = 0
+    shift = 0
+    for b in blob:
+        z |= (b & 0x7F) << shift
+        if b & 0x80:
+            shift += 7
+            continue
+        prev += _unzigzag(z)
+        out.append(prev)
+        z = 0
+        shift = 0
+    if shift:
+        raise ValueError("truncated varint sequence")
+    return out
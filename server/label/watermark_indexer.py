@@ -12,13 +12,34 @@
   python watermark_indexer.py --input .\saves_dir --registry .\test_registry.json
 或
   python watermark_indexer.py --input .\one.melsave --registry .\test_registry.json
+
+批量（上千个存档）：
+  python watermark_indexer.py --input .\saves_dir --registry .\test_registry.jsonl --jobs 8
+  python watermark_indexer.py --input .\saves_dir --registry .\test_registry.sqlite --jobs 8
+  - registry 后端按扩展名选择：.json（原格式，整体重写）/ .jsonl（只追加）/ .sqlite|.db；
+    后两种每处理完一个文件就落盘，中断后重跑即可续上；
+  - 同一水印的 sequence 只存一份（dedupe on watermark）；
+  - 大小 + mtime 未变的文件直接跳过；mtime 变了但 sha256 相同也跳过（只更新 mtime）。
 """
 
-import argparse, csv, io, json, os, time, zipfile, re
-from typing import Any, List, Optional, Tuple
+import argparse, csv, hashlib, io, json, os, sqlite3, time, zipfile, re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+try:
+    from .fnv import fnv1a64  # 作为 server.label 包导入
+except ImportError:
+    from fnv import fnv1a64  # 作为独立脚本运行
+
+try:
+    import ijson  # 可选：流式解析大 Data（C 后端）
+except ImportError:
+    ijson = None
 
 TEST_ENV_BANNER = "TEST_ONLY_DO_NOT_USE_IN_PROD"
 _INT_RE = re.compile(r'^[+-]?\d+$')
+# Data 解压后超过该大小才走流式解析；小文件整体 json.loads 更快
+STREAM_MIN_BYTES = int(os.getenv("WM_STREAM_MIN_BYTES", str(4 * 1024 * 1024)))
 
 def _now_iso() -> str:
     return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
@@ -46,18 +67,6 @@ def canonicalize(seq: List[str]) -> List[str]:
     rev = list(reversed(seq))
     return seq if seq <= rev else rev
 
-def fnv1a64(seq: List[str]) -> int:
-    """对规范化后的序列做 64 位 FNV-1a。"""
-    FNV_OFFSET = 14695981039346656037
-    FNV_PRIME = 1099511628211
-    h = FNV_OFFSET
-    for idx, tok in enumerate(seq):
-        piece = f"{idx}#{tok}".encode("utf-8", errors="ignore")
-        for b in piece:
-            h ^= b
-            h = (h * FNV_PRIME) & 0xFFFFFFFFFFFFFFFF
-    return h
-
 # -------------------- 解析 Data --------------------
 def _extract_seq_from_containers(obj: dict) -> Optional[List[str]]:
     if not isinstance(obj, dict) or "saveObjectContainers" not in obj:
@@ -98,6 +107,149 @@ def _extract_seq_from_containers(obj: dict) -> Optional[List[str]]:
     rows.sort(key=lambda t: (t[0] is None, t[0] if t[0] is not None else 0, t[1]))
     return [oid for (_iid, _idx, oid) in rows]
 
+# -------------------- 流式解析 Data --------------------
+_DESCEND_KEYS = ("items", "children", "saveObjects", "saveObjectChildren")
+_DESCEND_RANK = {k: i for i, k in enumerate(_DESCEND_KEYS)}
+# 节点角色：只有 NODE 里的对象会被 collect；SKIP 的子树直接丢弃事件
+_ROOT, _CONTAINERS, _CONTAINER, _CHILDREN, _CHILD, _NODE, _SKIP = range(7)
+
+
+class _StreamUnsupported(Exception):
+    """流式解析无法保证与 json.loads 版本一致，交回整体解析。"""
+
+
+class _Frame:
+    __slots__ = ("role", "is_map", "path", "key", "n", "oid", "has_oid", "iid", "keys")
+
+    def __init__(self, role: int, is_map: bool, path: tuple):
+        self.role = role
+        self.is_map = is_map
+        self.path = path
+        self.key: Optional[str] = None
+        self.n = 0
+        self.oid: Optional[str] = None
+        self.has_oid = False
+        self.iid: Optional[int] = None
+        self.keys: Optional[set] = set() if role == _NODE and is_map else None
+
+
+def _child_role(parent: _Frame, is_map: bool) -> Tuple[int, tuple]:
+    """新容器（值为 map/array）的角色与排序路径，路径比较等价于 collect 的先序遍历顺序。"""
+    role = parent.role
+    if not parent.is_map:
+        path = parent.path + (parent.n,)
+        parent.n += 1
+        if role == _CONTAINERS:
+            return (_CONTAINER if is_map else _SKIP), path
+        if role == _CHILDREN:
+            return (_CHILD if is_map else _NODE), path
+        return (_NODE if role == _NODE else _SKIP), path
+    key = parent.key
+    if role == _ROOT:
+        if key == "saveObjectContainers":
+            if not is_map:
+                return _CONTAINERS, ()
+            raise _StreamUnsupported()
+        return _SKIP, ()
+    if role == _CONTAINER:
+        if key == "saveObjects":
+            return _NODE, parent.path + (0,)
+        if key == "saveObjectChildren" and not is_map:
+            return _CHILDREN, parent.path + (1,)
+        return _SKIP, ()
+    if role == _CHILD:
+        return (_NODE, parent.path) if key == "saveObjects" else (_SKIP, ())
+    if role == _NODE:
+        if key == "objectId":
+            raise _StreamUnsupported()  # str(dict/list) 无法流式复现
+        if key in _DESCEND_RANK:
+            if key in parent.keys:
+                raise _StreamUnsupported()  # 重复键：json.loads 只保留最后一个
+            parent.keys.add(key)
+            return _NODE, parent.path + (_DESCEND_RANK[key],)
+        if key == "instanceId":
+            parent.iid = None
+    return _SKIP, ()
+
+
+def _stream_seq_from_containers(fp) -> Optional[List[str]]:
+    """事件流解析 Data，只收集 saveObjectContainers 里的 objectId/instanceId。
+
+    与 _extract_seq_from_containers(json.loads(...)) 结果一致，峰值内存只与对象数相关。
+    根不是对象或没有 saveObjectContainers 数组时返回 None，由调用方回退到整体解析。
+    """
+    head = fp.read(3)
+    prefix = b"" if head == b"\xef\xbb\xbf" else head
+
+    class _Chain:
+        def __init__(self):
+            self.pending = prefix
+
+        def read(self, n: int = -1) -> bytes:
+            if self.pending and n != 0:  # ijson 会先 read(0) 探测类型
+                out, self.pending = self.pending, b""
+                return out
+            return fp.read(n)
+
+    rows: List[Tuple[Optional[int], tuple, str]] = []
+    stack: List[_Frame] = []
+    found = False
+    skip = 0  # 正在跳过的 SKIP 子树深度，不建 frame
+    for event, value in ijson.basic_parse(_Chain(), use_float=True):
+        if skip:
+            if event == "start_map" or event == "start_array":
+                skip += 1
+            elif event == "end_map" or event == "end_array":
+                skip -= 1
+            continue
+        top = stack[-1] if stack else None
+        if event == "map_key":
+            top.key = value
+            if top.role == _ROOT and value == "saveObjectContainers":
+                if found:
+                    raise _StreamUnsupported()
+                found = True
+            continue
+        if event == "start_map" or event == "start_array":
+            is_map = event == "start_map"
+            if top is None:
+                if not is_map:
+                    return None
+                stack.append(_Frame(_ROOT, True, ()))
+                continue
+            role, path = _child_role(top, is_map)
+            if role == _SKIP:
+                skip = 1
+            else:
+                stack.append(_Frame(role, is_map, path))
+            continue
+        if event == "end_map" or event == "end_array":
+            fr = stack.pop()
+            if fr.role == _NODE and fr.is_map and fr.has_oid:
+                rows.append((fr.iid, fr.path, fr.oid))
+            continue
+        # 标量
+        if top is None:
+            return None
+        if top.is_map:
+            if top.role == _NODE:
+                if top.key == "objectId":
+                    top.oid = str(value)
+                    top.has_oid = True
+                elif top.key == "instanceId":
+                    top.iid = _norm_iid(value)
+                elif top.key in _DESCEND_RANK:
+                    top.keys.add(top.key)
+            elif top.role == _ROOT and top.key == "saveObjectContainers":
+                raise _StreamUnsupported()
+        else:
+            top.n += 1
+    if not found:
+        return None
+    rows.sort(key=lambda t: (t[0] is None, t[0] if t[0] is not None else 0, t[1]))
+    return [oid for (_iid, _path, oid) in rows]
+
+
 def _coerce_common(obj: Any) -> Optional[List[str]]:
     def coerce_seq(objs: List[Any]) -> List[str]:
         if not objs:
@@ -188,6 +340,15 @@ def extract_sequence_from_melsave(path: str) -> Tuple[List[str], Optional[int]]:
                 return 1
             return 2
         cands.sort(key=weight)
+        if (ijson is not None and weight(cands[0]) == 0
+                and zf.getinfo(cands[0]).file_size >= STREAM_MIN_BYTES):
+            try:
+                with zf.open(cands[0]) as fp:
+                    raw = _stream_seq_from_containers(fp)
+                if raw is not None:
+                    return raw, embedded
+            except Exception:
+                pass  # 非 UTF-8 / 非法 JSON / 结构特殊：回退到整体解析
         text = _read_text_guess_utf8(zf.read(cands[0]))
         for p in (_parse_seq_from_json, _parse_seq_from_csv, _parse_seq_from_text):
             raw = p(text)
@@ -196,11 +357,29 @@ def extract_sequence_from_melsave(path: str) -> Tuple[List[str], Optional[int]]:
         raise RuntimeError(f"{path} 的 Data 无法解析")
 
 # -------------------- registry I/O --------------------
+def _new_registry() -> dict:
+    return {"env": TEST_ENV_BANNER, "version": 1, "created_at": _now_iso(), "entries": []}
+
+def registry_backend(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".jsonl":
+        return "jsonl"
+    if ext in (".sqlite", ".sqlite3", ".db"):
+        return "sqlite"
+    return "json"
+
 def load_registry(path: str) -> dict:
-    if not os.path.exists(path):
-        return {"env": TEST_ENV_BANNER, "version": 1, "created_at": _now_iso(), "entries": []}
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    """任意后端的 registry 都读成原 JSON 结构（entries 里带完整 sequence）。"""
+    if registry_backend(path) == "json":
+        if not os.path.exists(path):
+            return _new_registry()
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    reg = open_registry(path)
+    try:
+        return {**reg.header, "entries": list(reg.entries())}
+    finally:
+        reg.close()
 
 def save_registry(path: str, obj: dict) -> None:
     tmp = path + ".tmp"
@@ -208,20 +387,234 @@ def save_registry(path: str, obj: dict) -> None:
         json.dump(obj, f, ensure_ascii=False, indent=2)
     os.replace(tmp, path)
 
+class JsonRegistry:
+    """原 .json 格式：内存中维护，flush 时整体原子重写（不去重 sequence，保持兼容）。"""
+    flush_interval = 30.0
+
+    def __init__(self, path: str):
+        self.path = path
+        self.data = load_registry(path)
+        self.data.setdefault("entries", [])
+        self.header = {k: v for k, v in self.data.items() if k != "entries"}
+        self._by_path = {e.get("save_path"): i for i, e in enumerate(self.data["entries"])}
+        self._dirty = False
+
+    def get(self, save_path: str) -> Optional[dict]:
+        i = self._by_path.get(save_path)
+        return None if i is None else self.data["entries"][i]
+
+    def put(self, entry: dict) -> None:
+        i = self._by_path.get(entry["save_path"])
+        if i is None:
+            self._by_path[entry["save_path"]] = len(self.data["entries"])
+            self.data["entries"].append(entry)
+        else:
+            self.data["entries"][i] = entry
+        self._dirty = True
+
+    def entries(self) -> Iterator[dict]:
+        return iter(self.data["entries"])
+
+    def __len__(self) -> int:
+        return len(self.data["entries"])
+
+    def flush(self) -> None:
+        if self._dirty:
+            save_registry(self.path, self.data)
+            self._dirty = False
+
+    def close(self) -> None:
+        self.flush()
+
+class JsonlRegistry:
+    """只追加的 JSON Lines：首行是头，之后每行一条 entry，同一 save_path 以最后一行为准。
+    同一水印的 sequence 只在第一次出现时写出，之后的行用 "sequence_ref" 指向该水印。
+    get() 返回的 entry 不带 sequence。"""
+    flush_interval = 0.0
+
+    def __init__(self, path: str):
+        self.path = path
+        self.header: Optional[dict] = None
+        self._latest: Dict[str, dict] = {}
+        self._seqs: Dict[int, List[str]] = {}
+        needs_newline = False
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    needs_newline = not line.endswith("\n")
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue  # 进程被杀时写了一半的行
+                    if "save_path" not in rec:
+                        self.header = self.header or rec
+                        continue
+                    seq = rec.pop("sequence", None)
+                    rec.pop("sequence_ref", None)
+                    if seq is not None:
+                        self._seqs.setdefault(int(rec["watermark_u64"]), seq)
+                    self._latest[rec["save_path"]] = rec
+        self._fp = open(path, "a", encoding="utf-8")
+        if needs_newline:
+            self._fp.write("\n")
+        if self.header is None:
+            self.header = {k: v for k, v in _new_registry().items() if k != "entries"}
+            self._write(self.header)
+
+    def _write(self, rec: dict) -> None:
+        self._fp.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        self._fp.flush()
+
+    def get(self, save_path: str) -> Optional[dict]:
+        rec = self._latest.get(save_path)
+        return dict(rec) if rec is not None else None
+
+    def put(self, entry: dict) -> None:
+        rec = dict(entry)
+        seq = rec.pop("sequence", None)
+        wm = int(rec["watermark_u64"])
+        if wm in self._seqs or seq is None:
+            self._write({**rec, "sequence_ref": wm})
+        else:
+            self._seqs[wm] = seq
+            self._write({**rec, "sequence": seq})
+        self._latest[rec["save_path"]] = rec
+
+    def entries(self) -> Iterator[dict]:
+        for rec in self._latest.values():
+            yield {**rec, "sequence": self._seqs.get(int(rec["watermark_u64"]), [])}
+
+    def __len__(self) -> int:
+        return len(self._latest)
+
+    def flush(self) -> None:
+        self._fp.flush()
+
+    def close(self) -> None:
+        self._fp.close()
+
+class SqliteRegistry:
+    """SQLite：entries 按 save_path 主键 upsert，sequence 按水印只存一份；flush 即 commit。
+    u64 以 TEXT 存，避免超出 SQLite 有符号 INTEGER 范围。get() 返回的 entry 不带 sequence。"""
+    flush_interval = 1.0
+    _COLS = ("save_path", "save_name", "length", "watermark_u64", "embedded_watermark",
+             "file_size", "file_mtime_ns", "file_sha256", "indexed_at")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        try:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+        except sqlite3.DatabaseError:
+            pass
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS sequences (
+              watermark_u64 TEXT PRIMARY KEY,
+              sequence TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS entries (
+              save_path TEXT PRIMARY KEY,
+              save_name TEXT NOT NULL,
+              length INTEGER NOT NULL,
+              watermark_u64 TEXT NOT NULL,
+              embedded_watermark TEXT,
+              file_size INTEGER,
+              file_mtime_ns INTEGER,
+              file_sha256 TEXT,
+              indexed_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_entries_wm ON entries(watermark_u64);
+            """
+        )
+        for k, v in _new_registry().items():
+            if k != "entries":
+                self.conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES (?, ?)", (k, json.dumps(v)))
+        self.conn.commit()
+        self.header = {r["key"]: json.loads(r["value"]) for r in self.conn.execute("SELECT key, value FROM meta")}
+
+    @staticmethod
+    def _row_to_entry(r: sqlite3.Row) -> dict:
+        e = {k: r[k] for k in SqliteRegistry._COLS}
+        e["watermark_u64"] = int(e["watermark_u64"])
+        if e["embedded_watermark"] is not None:
+            e["embedded_watermark"] = int(e["embedded_watermark"])
+        return e
+
+    def get(self, save_path: str) -> Optional[dict]:
+        r = self.conn.execute("SELECT * FROM entries WHERE save_path = ?", (save_path,)).fetchone()
+        return self._row_to_entry(r) if r is not None else None
+
+    def put(self, entry: dict) -> None:
+        wm = str(int(entry["watermark_u64"]))
+        if entry.get("sequence") is not None:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO sequences (watermark_u64, sequence) VALUES (?, ?)",
+                (wm, json.dumps(entry["sequence"], ensure_ascii=False)),
+            )
+        row = dict(entry, watermark_u64=wm)
+        if row.get("embedded_watermark") is not None:
+            row["embedded_watermark"] = str(int(row["embedded_watermark"]))
+        self.conn.execute(
+            f"INSERT OR REPLACE INTO entries ({', '.join(self._COLS)}) VALUES ({', '.join('?' * len(self._COLS))})",
+            tuple(row.get(k) for k in self._COLS),
+        )
+
+    def entries(self) -> Iterator[dict]:
+        for r in self.conn.execute(
+            "SELECT e.*, s.sequence FROM entries e LEFT JOIN sequences s ON s.watermark_u64 = e.watermark_u64"
+        ):
+            e = self._row_to_entry(r)
+            e["sequence"] = json.loads(r["sequence"]) if r["sequence"] else []
+            yield e
+
+    def __len__(self) -> int:
+        return int(self.conn.execute("SELECT COUNT(1) FROM entries").fetchone()[0])
+
+    def flush(self) -> None:
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.commit()
+        self.conn.close()
+
+def open_registry(path: str):
+    return {"json": JsonRegistry, "jsonl": JsonlRegistry, "sqlite": SqliteRegistry}[registry_backend(path)](path)
+
 # -------------------- 主流程 --------------------
-def index_one(melsave_path: str, registry: dict) -> dict:
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def build_entry(melsave_path: str) -> dict:
+    """提取 + 规范化 + 哈希，返回 registry entry（不碰 registry，可直接丢进进程池）。"""
+    st = os.stat(melsave_path)  # 先 stat：解析期间文件被改，下次会按 mtime 重新索引
     raw_seq, embedded_wm = extract_sequence_from_melsave(melsave_path)
     seq = canonicalize([str(x) for x in raw_seq])   # 方向无关
     wm = fnv1a64(seq)
-    entry = {
+    return {
         "save_name": os.path.basename(melsave_path),
         "save_path": os.path.abspath(melsave_path),
         "length": len(seq),
         "watermark_u64": int(wm),
         "sequence": seq,                  # 注意：已是 canon(seq)
         "embedded_watermark": embedded_wm,
+        "file_size": st.st_size,
+        "file_mtime_ns": st.st_mtime_ns,
+        "file_sha256": file_sha256(melsave_path),
         "indexed_at": _now_iso()
     }
+
+def index_one(melsave_path: str, registry: dict) -> dict:
+    entry = build_entry(melsave_path)
     for i, e in enumerate(registry.get("entries", [])):
         if e.get("save_path") == entry["save_path"]:
             registry["entries"][i] = entry
@@ -230,6 +623,19 @@ def index_one(melsave_path: str, registry: dict) -> dict:
         registry["entries"].append(entry)
     return entry
 
+def _index_job(item: Tuple[str, Optional[str]]) -> Dict[str, Any]:
+    """进程池任务：known_sha 非空时先比对 sha256，内容没变就不再解析。"""
+    path, known_sha = item
+    try:
+        if known_sha is not None:
+            st = os.stat(path)
+            if file_sha256(path) == known_sha:
+                return {"status": "same", "path": path,
+                        "file_size": st.st_size, "file_mtime_ns": st.st_mtime_ns}
+        return {"status": "ok", "path": path, "entry": build_entry(path)}
+    except Exception as ex:
+        return {"status": "err", "path": path, "error": str(ex)}
+
 def walk_inputs(input_path: str) -> List[str]:
     if os.path.isdir(input_path):
         out = []
@@ -240,30 +646,81 @@ def walk_inputs(input_path: str) -> List[str]:
         return out
     return [input_path]
 
+def plan_work(paths: List[str], reg) -> Tuple[List[Tuple[str, Optional[str]]], int]:
+    """按大小 + mtime 跳过未变化的文件；大小相同但 mtime 变了的，带上旧 sha256 交给任务比对。"""
+    todo, skipped = [], 0
+    for p in paths:
+        old = reg.get(os.path.abspath(p))
+        if old is None:
+            todo.append((p, None))
+            continue
+        try:
+            st = os.stat(p)
+        except OSError:
+            todo.append((p, None))
+            continue
+        if old.get("file_size") == st.st_size and old.get("file_mtime_ns") == st.st_mtime_ns:
+            skipped += 1
+            continue
+        todo.append((p, old.get("file_sha256") if old.get("file_size") == st.st_size else None))
+    return todo, skipped
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--input", required=True)
-    ap.add_argument("--registry", required=True)
+    ap.add_argument("--registry", required=True,
+                    help="按扩展名选后端：.json / .jsonl / .sqlite|.db")
+    ap.add_argument("--jobs", type=int, default=1, help="并行进程数")
     args = ap.parse_args()
 
-    reg = load_registry(args.registry)
-    if reg.get("env") != TEST_ENV_BANNER:
-        print("警告：registry 非 TEST 标记。继续，但别拿它当生产。")
-
     paths = walk_inputs(args.input)
     if not paths:
         print("没有找到任何 .melsave"); exit(2)
 
-    for p in paths:
-        try:
-            e = index_one(p, reg)
-            print(f"[OK] {p} -> watermark_u64={e['watermark_u64']} length={e['length']}")
-        except Exception as ex:
-            print(f"[ERR] {p}: {ex}")
+    reg = open_registry(args.registry)
+    if reg.header.get("env") != TEST_ENV_BANNER:
+        print("警告：registry 非 TEST 标记。继续，但别拿它当生产。")
+
+    todo, skipped = plan_work(paths, reg)
+    print(f"共 {len(paths)} 个文件：未变化跳过 {skipped}，待处理 {len(todo)}，jobs={args.jobs}")
 
-    save_registry(args.registry, reg)
-    print(f"已写入测试 JSON：{os.path.abspath(args.registry)}，条目数={len(reg.get('entries', []))}")
+    counts = {"ok": 0, "same": 0, "err": 0}
+    nbytes = 0
+    started = last_flush = last_report = time.monotonic()
+    pool = ProcessPoolExecutor(max_workers=args.jobs) if args.jobs > 1 and len(todo) > 1 else None
+    try:
+        results = pool.map(_index_job, todo) if pool else map(_index_job, todo)
+        for i, res in enumerate(results, 1):
+            p = res["path"]
+            counts[res["status"]] += 1
+            if res["status"] == "ok":
+                e = res["entry"]
+                reg.put(e)
+                nbytes += e["file_size"]
+                print(f"[OK] {p} -> watermark_u64={e['watermark_u64']} length={e['length']}")
+            elif res["status"] == "same":
+                e = dict(reg.get(os.path.abspath(p)))
+                e.update(file_size=res["file_size"], file_mtime_ns=res["file_mtime_ns"])
+                reg.put(e)
+                nbytes += res["file_size"]
+                print(f"[SAME] {p}（仅 mtime 变化）")
+            else:
+                print(f"[ERR] {p}: {res['error']}")
+            now = time.monotonic()
+            if now - last_flush >= reg.flush_interval:
+                reg.flush()
+                last_flush = now
+            if now - last_report >= 2.0 or i == len(todo):
+                elapsed = max(now - started, 1e-9)
+                print(f"[{i}/{len(todo)}] ok={counts['ok']} same={counts['same']} err={counts['err']} "
+                      f"{i / elapsed:.1f} files/s {nbytes / elapsed / 1e6:.2f} MB/s")
+                last_report = now
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        n_entries = len(reg)
+        reg.close()
+    print(f"已写入测试 registry：{os.path.abspath(args.registry)}，条目数={n_entries}")
 
 if __name__ == "__main__":
     main()
-
@@ -1,21 +1,39 @@
 import io
+import json
 import os
 import re
 import shutil
 import sys
 import tempfile
+import threading
 import time
+from collections import deque
 from dataclasses import dataclass
 from pathlib import Path
 from types import ModuleType
-from typing import Optional, Tuple
+from typing import Deque, Dict, List, Optional, Tuple
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 from fastapi.responses import JSONResponse, Response
 
+from .auth import ops_access_denied
+from .db import data_dir
+from .utils import timing_summary
+
 
 router = APIRouter()
 
+# Per-stage timing of the generator (see src/profiler.py in the generator).
+# MELSAVE_PROFILE=1 profiles every run; otherwise only requests with "profile": true.
+MELSAVE_PROFILE = os.getenv("MELSAVE_PROFILE", "0") == "1"
+_PROFILE_FILE = "pipeline_profile.json"
+# Upper bounds (ms) of the /api/melsave/timings histogram buckets; the last bucket is open-ended
+_HIST_BOUNDS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+_RECENT_RUNS = 200
+# Generator log level (see src/log.py in the generator). Output is captured and only
+# surfaced on failure, so by default the pipeline runs quiet (warnings and errors only).
+MELSAVE_PIPELINE_LOG_LEVEL = os.getenv("MELSAVE_PIPELINE_LOG_LEVEL", "").strip().upper()
+
 
 @dataclass
 class GenSource:
@@ -27,6 +45,72 @@ class GenSource:
 class MelsaveResult:
     filename: str
     data: bytes
+    # Stage timing report when profiling was enabled for this run
+    profile: Optional[Dict] = None
+
+
+class StageHistogram:
+    """In-process aggregate of generator stage timings for /api/melsave/timings."""
+
+    def __init__(self, bounds_ms: Tuple[int, ...] = _HIST_BOUNDS_MS, recent: int = _RECENT_RUNS):
+        self.bounds_ms = bounds_ms
+        self._lock = threading.Lock()
+        self._runs = 0
+        self._failed = 0
+        self._buckets: Dict[str, List[int]] = {}
+        self._totals: Dict[str, float] = {}
+        self._recent: Dict[str, Deque[float]] = {}
+        self._recent_size = recent
+
+    def _bucket(self, ms: float) -> int:
+        for i, bound in enumerate(self.bounds_ms):
+            if ms <= bound:
+                return i
+        return len(self.bounds_ms)
+
+    def _add(self, name: str, ms: float) -> None:
+        if name not in self._buckets:
+            self._buckets[name] = [0] * (len(self.bounds_ms) + 1)
+            self._totals[name] = 0.0
+            self._recent[name] = deque(maxlen=self._recent_size)
+        self._buckets[name][self._bucket(ms)] += 1
+        self._totals[name] += ms
+        self._recent[name].append(ms)
+
+    def record(self, profile: Dict) -> None:
+        with self._lock:
+            self._runs += 1
+            if not profile.get("ok", True):
+                self._failed += 1
+            for st in profile.get("stages", []):
+                self._add(str(st.get("name")), float(st.get("wall_ms") or 0.0))
+            if "total_wall_ms" in profile:
+                self._add("pipeline", float(profile["total_wall_ms"]))
+            if "subprocess_ms" in profile:
+                self._add("subprocess", float(profile["subprocess_ms"]))
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            stages = {}
+            for name, counts in self._buckets.items():
+                recent = timing_summary(self._recent[name])
+                n = sum(counts)
+                stages[name] = {
+                    "count": n,
+                    # All-time average; the percentiles cover the recent runs only
+                    "avgMs": round(self._totals[name] / n, 2) if n else 0.0,
+                    "p50Ms": recent["p50"],
+                    "p95Ms": recent["p95"],
+                    "maxMs": recent["max"],
+                    "buckets": [
+                        {"leMs": bound, "count": c}
+                        for bound, c in zip(list(self.bounds_ms) + [None], counts)
+                    ],
+                }
+            return {"runs": self._runs, "failed": self._failed, "stages": stages}
+
+
+histogram = StageHistogram()
 
 
 def _find_generator_dir() -> Optional[GenSource]:
@@ -83,13 +167,25 @@ def _copy_tree(src: Path, dst: Path) -> None:
         pass
 
 
-def _run_pipeline(temp_dir: Path) -> Path:
+def _run_pipeline(temp_dir: Path, profile_path: Optional[Path] = None) -> Path:
     # Prefer running in a subprocess to isolate execution of DSL code.
     import subprocess
     start_ts = time.time()
     env = dict(os.environ)
     env["PYTHONIOENCODING"] = "utf-8"
     env["PYTHONUNBUFFERED"] = "1"
+    # The DSL compile cache holds pickled converter snapshots: keep it in the
+    # server's private data directory rather than a shared temp dir
+    env.setdefault("DSL_CACHE_DIR", str(data_dir / "dsl_cache"))
+    if MELSAVE_PIPELINE_LOG_LEVEL:
+        env["PIPELINE_LOG_LEVEL"] = MELSAVE_PIPELINE_LOG_LEVEL
+        env.pop("PIPELINE_QUIET", None)
+    else:
+        env["PIPELINE_QUIET"] = "1"
+    if profile_path is not None:
+        env["PIPELINE_PROFILE"] = str(profile_path)
+    else:
+        env.pop("PIPELINE_PROFILE", None)
     try:
         subprocess.run(
             [sys.executable, "main.py"],
@@ -134,8 +230,36 @@ def _safe_ascii_filename(filename: str) -> str:
     return f"{safe_stem}{ext}" if ext else safe_stem
 
 
-def generate_melsave_bytes(dsl_code: str) -> MelsaveResult:
-    """Run the generator pipeline and return the produced .melsave bytes."""
+def _read_profile(path: Path, subprocess_ms: float) -> Optional[Dict]:
+    try:
+        profile = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    # Includes interpreter start-up and imports, which the in-process stages don't see
+    profile["subprocess_ms"] = round(subprocess_ms, 3)
+    histogram.record(profile)
+    return profile
+
+
+def server_timing_header(profile: Dict) -> str:
+    """Server-Timing value: one metric per stage (wall ms, CPU ms in desc) plus totals."""
+    parts = []
+    for st in profile.get("stages", []):
+        name = re.sub(r"[^A-Za-z0-9_-]", "_", str(st.get("name") or "stage"))
+        parts.append(f'{name};dur={float(st.get("wall_ms") or 0.0):.1f};desc="cpu {float(st.get("cpu_ms") or 0.0):.1f}ms"')
+    if "total_wall_ms" in profile:
+        parts.append(f'pipeline;dur={float(profile["total_wall_ms"]):.1f}')
+    if "subprocess_ms" in profile:
+        parts.append(f'subprocess;dur={float(profile["subprocess_ms"]):.1f}')
+    return ", ".join(parts)
+
+
+def generate_melsave_bytes(dsl_code: str, profile: bool = False) -> MelsaveResult:
+    """Run the generator pipeline and return the produced .melsave bytes.
+
+    With profile=True (or MELSAVE_PROFILE=1) the per-stage timing report is
+    attached as MelsaveResult.profile and added to the timing histogram.
+    """
     if not isinstance(dsl_code, str) or not dsl_code.strip():
         raise ValueError("DSL 内容不能为空")
 
@@ -144,12 +268,19 @@ def generate_melsave_bytes(dsl_code: str) -> MelsaveResult:
         raise RuntimeError("找不到生成器目录")
 
     base_tmp = Path(tempfile.mkdtemp(prefix="melsave_"))
+    profile_path = base_tmp / _PROFILE_FILE if (profile or MELSAVE_PROFILE) else None
     try:
         _copy_tree(src.base_dir, base_tmp)
         (base_tmp / "input.py").write_text(dsl_code, encoding="utf-8")
-        out_path = _run_pipeline(base_tmp)
+        started = time.perf_counter()
+        try:
+            out_path = _run_pipeline(base_tmp, profile_path)
+        finally:
+            report = None
+            if profile_path is not None:
+                report = _read_profile(profile_path, (time.perf_counter() - started) * 1000.0)
         data = out_path.read_bytes()
-        return MelsaveResult(filename=out_path.name, data=data)
+        return MelsaveResult(filename=out_path.name, data=data, profile=report)
     finally:
         try:
             shutil.rmtree(base_tmp, ignore_errors=True)
@@ -161,14 +292,25 @@ def generate_melsave_bytes(dsl_code: str) -> MelsaveResult:
 def generate_melsave(body: dict):
     # Accept body with { dsl: string }
     dsl_code = body.get("dsl") if isinstance(body, dict) else None
+    want_profile = bool(body.get("profile")) if isinstance(body, dict) else False
     try:
-        result = generate_melsave_bytes(dsl_code)
+        result = generate_melsave_bytes(dsl_code, profile=want_profile)
         headers = {
             "Content-Disposition": _encode_filename_header(result.filename),
             "X-Content-Type-Options": "nosniff",
         }
+        if result.profile:
+            headers["Server-Timing"] = server_timing_header(result.profile)
         return Response(content=result.data, media_type="application/octet-stream", headers=headers)
     except ValueError as e:
         return JSONResponse(status_code=400, content={"error": str(e)})
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": f"生成失败: {e}"})
+
+
+@router.get("/api/melsave/timings")
+def melsave_timings(request: Request):
+    denied = ops_access_denied(request)
+    if denied is not None:
+        return denied
+    return histogram.snapshot()
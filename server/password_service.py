@@ -0,0 +1,210 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+import bcrypt
+
+from .utils import timing_summary
+
+
+logger = logging.getLogger("msut.auth")
+
+# bcrypt cost factor for new hashes; existing hashes with a different cost are
+# rehashed transparently on the next successful login
+BCRYPT_ROUNDS = min(31, max(4, int(os.getenv("BCRYPT_ROUNDS", "12"))))
+AUTH_WORKERS = max(1, int(os.getenv("AUTH_WORKERS", "2")))
+# Hash/verify jobs allowed to wait or run at once; beyond this callers get PasswordBusy (HTTP 429)
+AUTH_MAX_PENDING = max(1, int(os.getenv("AUTH_MAX_PENDING", str(AUTH_WORKERS * 8))))
+AUTH_JOB_TIMEOUT = float(os.getenv("AUTH_JOB_TIMEOUT", "10"))
+_RECENT_JOBS = 200
+
+
+class PasswordBusy(Exception):
+    """Raised when the password hashing queue is full."""
+
+
+class PasswordUnavailable(PasswordBusy):
+    """Raised when a job timed out or the worker pool died (HTTP 503)."""
+
+
+def hash_cost(hashed: str) -> Optional[int]:
+    """Cost factor of a bcrypt hash ("$2b$12$..."), None if it is not one."""
+    parts = hashed.split("$")
+    if len(parts) < 4 or not parts[2].isdigit():
+        return None
+    return int(parts[2])
+
+
+def _hash_job(password: str, rounds: int) -> str:
+    salt = bcrypt.gensalt(rounds=rounds)
+    return bcrypt.hashpw(password.encode("utf-8"), salt).decode("utf-8")
+
+
+def _verify_job(password: str, hashed: str, rounds: int) -> Tuple[bool, Optional[str]]:
+    """(matches, new hash if the stored one should be upgraded to `rounds`)."""
+    try:
+        ok = bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+    except Exception:
+        return False, None
+    if not ok or hash_cost(hashed) == rounds:
+        return ok, None
+    # Same worker, same job: the password is only in memory here anyway
+    return True, _hash_job(password, rounds)
+
+
+def _timed(fn: Callable, *args) -> Tuple[Any, float, float]:
+    # Runs in a worker process; time.monotonic() is system-wide, see watermark_service.
+    started = time.monotonic()
+    out = fn(*args)
+    return out, started, (time.monotonic() - started) * 1000.0
+
+
+class PasswordService:
+    """bcrypt hashing/verification on a dedicated process pool.
+
+    A hash costs ~250 ms of CPU at cost 12; running it in the request thread
+    lets a login burst occupy FastAPI's shared threadpool. Jobs here are capped
+    separately and their queue depth and timings are reported by
+    /api/auth/stats.
+    """
+
+    def __init__(
+        self,
+        workers: int = AUTH_WORKERS,
+        max_pending: int = AUTH_MAX_PENDING,
+        rounds: int = BCRYPT_ROUNDS,
+    ):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.rounds = rounds
+        self._pool: Optional[ProcessPoolExecutor] = None
+        # _pending is also decremented from the pool's result thread
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._max_seen = 0
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._timed_out = 0
+        self._rejected = 0
+        self._rehashed = 0
+        self._recent: Deque[Tuple[float, float]] = deque(maxlen=_RECENT_JOBS)
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def _release(self, _fut: Optional[Future] = None) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    def _drop_pool(self, pool: Optional[ProcessPoolExecutor]) -> None:
+        # A worker died (OOM kill, segfault): the executor is unusable, so the
+        # next job starts a fresh one
+        if pool is not None and self._pool is pool:
+            self._pool = None
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    async def _submit(self, label: str, fn: Callable, *args) -> Any:
+        if self._pending >= self.max_pending:
+            self._rejected += 1
+            raise PasswordBusy("登录请求过多，请稍后再试")
+        with self._lock:
+            self._pending += 1
+            self._max_seen = max(self._max_seen, self._pending)
+        self._submitted += 1
+        submitted = time.monotonic()
+        pool = None
+        try:
+            pool = self._get_pool()
+            cfut = pool.submit(_timed, fn, *args)
+        except BrokenProcessPool as ex:
+            self._release()
+            self._failed += 1
+            self._drop_pool(pool)
+            raise PasswordUnavailable("登录服务暂时不可用，请稍后再试") from ex
+        except Exception:
+            self._release()
+            self._failed += 1
+            raise
+        # As in WatermarkService: a timed-out job keeps its worker busy, so its
+        # slot is only freed when the worker is done
+        cfut.add_done_callback(self._release)
+        try:
+            out, started, run_ms = await asyncio.wait_for(
+                asyncio.wrap_future(cfut), timeout=AUTH_JOB_TIMEOUT
+            )
+        except asyncio.TimeoutError as ex:
+            self._failed += 1
+            self._timed_out += 1
+            logger.warning("auth job timed out after %gs: %s", AUTH_JOB_TIMEOUT, label)
+            raise PasswordUnavailable("登录服务繁忙，请稍后再试") from ex
+        except BrokenProcessPool as ex:
+            self._failed += 1
+            self._drop_pool(pool)
+            logger.warning("auth worker pool broken: %s", label)
+            raise PasswordUnavailable("登录服务暂时不可用，请稍后再试") from ex
+        except Exception:
+            self._failed += 1
+            raise
+        queue_ms = max(0.0, (started - submitted) * 1000.0)
+        self._completed += 1
+        self._recent.append((queue_ms, run_ms))
+        logger.debug(
+            "auth job: %s queue_ms=%.1f run_ms=%.1f pending=%s",
+            label,
+            queue_ms,
+            run_ms,
+            self._pending,
+        )
+        return out
+
+    async def hash(self, password: str) -> str:
+        return await self._submit("hash", _hash_job, password, self.rounds)
+
+    async def verify(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        """Check password against hashed.
+
+        Returns (matches, new_hash); new_hash is set when the password matched
+        but hashed was made with a different cost than BCRYPT_ROUNDS, and
+        should replace the stored hash.
+        """
+        ok, new_hash = await self._submit("verify", _verify_job, password, hashed, self.rounds)
+        if new_hash is not None:
+            self._rehashed += 1
+        return ok, new_hash
+
+    def stats(self) -> Dict:
+        recent = list(self._recent)
+        return {
+            "workers": self.workers,
+            "maxPending": self.max_pending,
+            "rounds": self.rounds,
+            "pending": self._pending,
+            # Jobs waiting for a free worker (pending minus those running)
+            "queued": max(0, self._pending - self.workers),
+            "maxPendingSeen": self._max_seen,
+            "submitted": self._submitted,
+            "completed": self._completed,
+            "failed": self._failed,
+            "timedOut": self._timed_out,
+            "rejected": self._rejected,
+            "rehashed": self._rehashed,
+            "queueMs": timing_summary([r[0] for r in recent]),
+            "runMs": timing_summary([r[1] for r in recent]),
+        }
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+service = PasswordService()
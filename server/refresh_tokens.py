@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from typing import Dict, Optional
+
+from .db import get_connection
+
+
+logger = logging.getLogger("msut.refresh_tokens")
+
+# Seconds between sweeps of expired refresh tokens
+REFRESH_SWEEP_INTERVAL = max(1.0, float(os.getenv("REFRESH_SWEEP_INTERVAL", "600")))
+# Rows deleted per statement; each batch is its own short write transaction
+REFRESH_SWEEP_BATCH = max(1, int(os.getenv("REFRESH_SWEEP_BATCH", "500")))
+# Pause between batches so other writers can take the lock
+REFRESH_SWEEP_PAUSE = float(os.getenv("REFRESH_SWEEP_PAUSE", "0.05"))
+# Live refresh tokens kept per user (oldest are revoked first); 0 = unlimited
+REFRESH_TOKENS_PER_USER = max(0, int(os.getenv("REFRESH_TOKENS_PER_USER", "0")))
+
+
+def delete_expired(
+    conn: sqlite3.Connection,
+    now: Optional[int] = None,
+    batch: int = REFRESH_SWEEP_BATCH,
+    pause: float = REFRESH_SWEEP_PAUSE,
+) -> int:
+    """Delete all tokens expired at `now` in batches of `batch` rows."""
+    now = int(time.time()) if now is None else now
+    deleted = 0
+    while True:
+        cur = conn.execute(
+            """
+            DELETE FROM auth_refresh_tokens WHERE id IN (
+              SELECT id FROM auth_refresh_tokens WHERE expires_at <= ? LIMIT ?
+            )
+            """,
+            (now, batch),
+        )
+        deleted += cur.rowcount
+        if cur.rowcount < batch:
+            return deleted
+        if pause > 0:
+            time.sleep(pause)
+
+
+def enforce_user_cap(
+    conn: sqlite3.Connection, uid: int, cap: int = REFRESH_TOKENS_PER_USER
+) -> int:
+    """Keep only the `cap` most recently used live tokens of uid; returns rows removed."""
+    if cap <= 0:
+        return 0
+    now = int(time.time())
+    cur = conn.execute(
+        """
+        DELETE FROM auth_refresh_tokens
+        WHERE user_id = ? AND id NOT IN (
+          SELECT id FROM auth_refresh_tokens
+          WHERE user_id = ? AND expires_at > ?
+          ORDER BY COALESCE(last_used_at, created_at) DESC, id DESC
+          LIMIT ?
+        )
+        """,
+        (uid, uid, now, cap),
+    )
+    return cur.rowcount
+
+
+def token_counts(conn: sqlite3.Connection, now: Optional[int] = None) -> Dict[str, int]:
+    now = int(time.time()) if now is None else now
+    # Both counts are range scans on idx_auth_refresh_tokens_expires
+    live = conn.execute(
+        "SELECT COUNT(*) FROM auth_refresh_tokens WHERE expires_at > ?", (now,)
+    ).fetchone()[0]
+    expired = conn.execute(
+        "SELECT COUNT(*) FROM auth_refresh_tokens WHERE expires_at <= ?", (now,)
+    ).fetchone()[0]
+    return {"live": int(live), "expired": int(expired)}
+
+
+class RefreshTokenSweeper:
+    """Periodically removes expired auth_refresh_tokens rows.
+
+    Without it rows only went away when the exact expired token was presented
+    to /api/auth/refresh. The sweep runs in a worker thread so the event loop
+    is never blocked on the SQLite write lock.
+    """
+
+    def __init__(self, interval: float = REFRESH_SWEEP_INTERVAL):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self._sweeps = 0
+        self._deleted = 0
+        self._last_sweep: Optional[float] = None
+        self._last_ms = 0.0
+        self._last_error: Optional[str] = None
+
+    def sweep_once(self) -> int:
+        started = time.monotonic()
+        conn = get_connection()
+        try:
+            deleted = delete_expired(conn)
+        finally:
+            conn.close()
+        self._sweeps += 1
+        self._deleted += deleted
+        self._last_sweep = time.time()
+        self._last_ms = (time.monotonic() - started) * 1000.0
+        if deleted:
+            logger.info("refresh token sweep: deleted=%s ms=%.1f", deleted, self._last_ms)
+        return deleted
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(self.sweep_once)
+                self._last_error = None
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                self._last_error = str(ex)
+                logger.warning("refresh token sweep failed: %s", ex)
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        """Start the sweep loop; must be called from the running event loop."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> Dict:
+        conn = get_connection()
+        try:
+            counts = token_counts(conn)
+        finally:
+            conn.close()
+        return {
+            **counts,
+            "perUserCap": REFRESH_TOKENS_PER_USER,
+            "intervalSeconds": self.interval,
+            "sweeps": self._sweeps,
+            "deleted": self._deleted,
+            "lastSweepAt": int(self._last_sweep) if self._last_sweep else None,
+            "lastSweepMs": round(self._last_ms, 2),
+            "lastError": self._last_error,
+        }
+
+
+sweeper = RefreshTokenSweeper()
@@ -1,6 +1,8 @@
 import os
+import threading
+from collections import deque
 from pathlib import Path
-from typing import Iterable, List
+from typing import Dict, Iterable, List, Optional, Tuple
 
 
 DEFAULT_WORDS = [
@@ -11,6 +13,8 @@ DEFAULT_WORDS = [
     "诈骗",
 ]
 
+MASK = "***"
+
 
 def _load_words_from_file(path: Path) -> List[str]:
     try:
@@ -37,10 +41,125 @@ def load_sensitive_words() -> List[str]:
     return DEFAULT_WORDS
 
 
-def filter_sensitive(text: str, words: Iterable[str]) -> str:
-    filtered = text
-    for word in words:
-        if not word:
-            continue
-        filtered = filtered.replace(word, "***")
-    return filtered
+class SensitiveWordMatcher:
+    """Aho–Corasick automaton over a word list.
+
+    Finds every occurrence of every word in one pass over the text, so the
+    cost of masking no longer grows with the dictionary size.
+    """
+
+    def __init__(self, words: Iterable[str]):
+        # Node 0 is the root; per node: transitions, failure link, length of
+        # the word ending here (0 = none) and the nearest suffix node that
+        # ends a word (-1 = none)
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._word_len: List[int] = [0]
+        self._out: List[int] = [-1]
+        self.size = 0
+        for word in words:
+            if word:
+                self._add(word)
+        self._link()
+
+    def _add(self, word: str) -> None:
+        node = 0
+        for ch in word:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._word_len.append(0)
+                self._out.append(-1)
+            node = nxt
+        if not self._word_len[node]:
+            self.size += 1
+        self._word_len[node] = len(word)
+
+    def _link(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                target = self._goto[f].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                fail = self._fail[child]
+                self._out[child] = fail if self._word_len[fail] else self._out[fail]
+
+    def _longest_from(self, text: str) -> Dict[int, int]:
+        """Start index -> length of the longest word occurring there."""
+        best: Dict[int, int] = {}
+        goto, fail, word_len, out = self._goto, self._fail, self._word_len, self._out
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            hit = node if word_len[node] else out[node]
+            while hit > 0:
+                n = word_len[hit]
+                start = i - n + 1
+                if n > best.get(start, 0):
+                    best[start] = n
+                hit = out[hit]
+        return best
+
+    def mask(self, text: str, mask: str = MASK) -> str:
+        """Replace matches with `mask`, leftmost first and longest at each position."""
+        if not text or not self.size:
+            return text
+        best = self._longest_from(text)
+        if not best:
+            return text
+        parts: List[str] = []
+        pos = 0
+        for start in sorted(best):
+            if start < pos:
+                # Overlaps a match already masked
+                continue
+            parts.append(text[pos:start])
+            parts.append(mask)
+            pos = start + best[start]
+        parts.append(text[pos:])
+        return "".join(parts)
+
+
+_lock = threading.Lock()
+# (source signature, matcher); rebuilt when SENSITIVE_WORDS_FILE or its mtime changes
+_matcher: Optional[Tuple[Tuple, SensitiveWordMatcher]] = None
+
+
+def _source_signature() -> Tuple:
+    env_path = os.getenv("SENSITIVE_WORDS_FILE")
+    if not env_path:
+        return (None, None, None)
+    try:
+        st = Path(env_path).stat()
+        return (env_path, st.st_mtime_ns, st.st_size)
+    except OSError:
+        return (env_path, None, None)
+
+
+def get_matcher() -> SensitiveWordMatcher:
+    """Shared matcher for the configured word list, rebuilt when the file changes."""
+    global _matcher
+    sig = _source_signature()
+    cached = _matcher
+    if cached is not None and cached[0] == sig:
+        return cached[1]
+    with _lock:
+        if _matcher is None or _matcher[0] != sig:
+            _matcher = (sig, SensitiveWordMatcher(load_sensitive_words()))
+        return _matcher[1]
+
+
+def filter_sensitive(text: str, words: Optional[Iterable[str]] = None) -> str:
+    """Mask sensitive words in text; uses the configured word list unless words is given."""
+    matcher = get_matcher() if words is None else SensitiveWordMatcher(words)
+    return matcher.mask(text)
@@ -1,7 +1,8 @@
+import asyncio
 import logging
 import os
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Optional, Set
 
 try:
     import boto3
@@ -17,6 +18,9 @@ R2_ACCESS_KEY_ID = os.getenv("R2_ACCESS_KEY_ID", "")
 R2_SECRET_ACCESS_KEY = os.getenv("R2_SECRET_ACCESS_KEY", "")
 R2_BUCKET = os.getenv("R2_BUCKET", "msut")
 R2_PUBLIC_URL = os.getenv("R2_PUBLIC_URL", "").rstrip("/")
+# S3 multipart: every part except the last must be >= 5 MiB
+R2_PART_SIZE = max(5 * 1024 * 1024, int(os.getenv("R2_PART_SIZE", str(8 * 1024 * 1024))))
+R2_PART_CONCURRENCY = max(1, int(os.getenv("R2_PART_CONCURRENCY", "4")))
 
 _client = None
 
@@ -66,6 +70,159 @@ def upload_file(key: str, file_path: Path, content_type: str = "") -> str:
     return url
 
 
+class StreamingUpload:
+    """Async streaming upload to R2.
+
+    Data fed through ``write`` is cut into ``R2_PART_SIZE`` parts which are
+    sent as an S3 multipart upload from worker threads, so the event loop is
+    never blocked and parts go out while the caller is still reading input.
+    At most ``concurrency`` parts are buffered/in flight at a time.
+    Objects smaller than one part fall back to a single ``put_object``.
+    """
+
+    def __init__(
+        self,
+        key: str,
+        content_type: str = "",
+        part_size: int = R2_PART_SIZE,
+        concurrency: int = R2_PART_CONCURRENCY,
+    ):
+        self.key = key
+        self.content_type = content_type
+        self.part_size = part_size
+        self.size = 0
+        self._client = _get_client()
+        self._buf = bytearray()
+        self._upload_id: Optional[str] = None
+        self._parts: List[Dict] = []
+        self._next_part = 1
+        self._tasks: Set[asyncio.Task] = set()
+        self._sem = asyncio.Semaphore(concurrency)
+        self._error: Optional[BaseException] = None
+        self._commit: Optional[asyncio.Future] = None
+
+    def _extra(self) -> Dict:
+        return {"ContentType": self.content_type} if self.content_type else {}
+
+    async def write(self, data: bytes) -> None:
+        if self._error is not None:
+            raise self._error
+        self._buf.extend(data)
+        self.size += len(data)
+        while len(self._buf) >= self.part_size:
+            body = bytes(self._buf[: self.part_size])
+            del self._buf[: self.part_size]
+            await self._send_part(body)
+
+    async def _send_part(self, body: bytes) -> None:
+        if self._upload_id is None:
+            resp = await asyncio.to_thread(
+                self._client.create_multipart_upload,
+                Bucket=R2_BUCKET,
+                Key=self.key,
+                **self._extra(),
+            )
+            self._upload_id = resp["UploadId"]
+        part_number = self._next_part
+        self._next_part += 1
+        # Backpressure: wait for a free slot before buffering another part
+        await self._sem.acquire()
+        task = asyncio.create_task(self._upload_part(part_number, body))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _upload_part(self, part_number: int, body: bytes) -> None:
+        try:
+            resp = await asyncio.to_thread(
+                self._client.upload_part,
+                Bucket=R2_BUCKET,
+                Key=self.key,
+                UploadId=self._upload_id,
+                PartNumber=part_number,
+                Body=body,
+            )
+            self._parts.append({"PartNumber": part_number, "ETag": resp["ETag"]})
+        except BaseException as e:
+            self._error = e
+            raise
+        finally:
+            self._sem.release()
+
+    async def complete(self) -> str:
+        if self._upload_id is None:
+            body = bytes(self._buf)
+            self._buf.clear()
+            self._commit = asyncio.ensure_future(
+                asyncio.to_thread(
+                    self._client.put_object,
+                    Bucket=R2_BUCKET,
+                    Key=self.key,
+                    Body=body,
+                    **self._extra(),
+                )
+            )
+        else:
+            if self._buf:
+                await self._send_part(bytes(self._buf))
+                self._buf.clear()
+            await asyncio.gather(*list(self._tasks))
+            if self._error is not None:
+                raise self._error
+            parts = sorted(self._parts, key=lambda p: p["PartNumber"])
+            self._commit = asyncio.ensure_future(
+                asyncio.to_thread(
+                    self._client.complete_multipart_upload,
+                    Bucket=R2_BUCKET,
+                    Key=self.key,
+                    UploadId=self._upload_id,
+                    MultipartUpload={"Parts": parts},
+                )
+            )
+        # The worker thread cannot be interrupted; shield it so abort() can
+        # wait for it and remove whatever it wrote.
+        await asyncio.shield(self._commit)
+        url = build_public_url(self.key)
+        logger.info(
+            "R2 streaming upload: key=%s url=%s size=%s parts=%s",
+            self.key,
+            url,
+            self.size,
+            len(self._parts) or 1,
+        )
+        return url
+
+    async def abort(self) -> None:
+        for t in list(self._tasks):
+            t.cancel()
+        await asyncio.gather(*list(self._tasks), return_exceptions=True)
+        if self._commit is not None:
+            await asyncio.gather(self._commit, return_exceptions=True)
+            try:
+                await asyncio.to_thread(
+                    self._client.delete_object, Bucket=R2_BUCKET, Key=self.key
+                )
+            except Exception:
+                logger.exception("R2 delete after abort failed: key=%s", self.key)
+        if self._upload_id is None:
+            return
+        try:
+            await asyncio.to_thread(
+                self._client.abort_multipart_upload,
+                Bucket=R2_BUCKET,
+                Key=self.key,
+                UploadId=self._upload_id,
+            )
+            logger.info("R2 multipart aborted: key=%s", self.key)
+        except Exception:
+            logger.exception("R2 multipart abort failed: key=%s", self.key)
+
+
+def download_bytes(key: str) -> bytes:
+    client = _get_client()
+    resp = client.get_object(Bucket=R2_BUCKET, Key=key)
+    return resp["Body"].read()
+
+
 def get_presigned_url(key: str, expires: int = 3600) -> str:
     client = _get_client()
     url = client.generate_presigned_url(
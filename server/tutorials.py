@@ -11,6 +11,7 @@ from fastapi.responses import JSONResponse, StreamingResponse
 from .auth import get_current_user
 from .db import get_connection
 from .rag_client import chat_answer, chat_answer_stream, get_embedding, is_rag_configured, name_chunk_title, optimize_chunk_text
+from .sensitive_words import filter_sensitive
 from .utils import nanoid, slugify_str
 
 
@@ -118,6 +119,7 @@ async def create_tutorial(
 ):
     title = (body.get("title") or "").strip() if isinstance(body, dict) else ""
     description = (body.get("description") or "").strip() if isinstance(body, dict) else ""
+    description = filter_sensitive(description)
     content = (body.get("content") or "").strip() if isinstance(body, dict) else ""
     if not title:
         return JSONResponse(status_code=400, content={"error": "标题必填"})
@@ -296,7 +298,7 @@ async def update_tutorial(
     if description is not None:
         if not isinstance(description, str):
             description = ""
-        description = str(description).strip()
+        description = filter_sensitive(str(description).strip())
         updates.append("description = ?")
         params.append(description)
     else:
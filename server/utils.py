@@ -2,8 +2,10 @@ import os
 import re
 import time
 import secrets
+import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
-from typing import Dict, Optional
+from typing import Any, Dict, Hashable, Iterable, Optional
 
 
 ALPHABET = "0123456789abcdefghijklmnopqrstuvwxyz"
@@ -53,3 +55,60 @@ def cookie_kwargs(max_age_seconds: Optional[int] = None) -> Dict:
         max_age=max_age,
         expires=expires,
     )
+
+
+def timing_summary(values: Iterable[float]) -> Dict[str, float]:
+    """avg / p50 / p95 / max of recent timings (ms), as reported by the /stats endpoints."""
+    vs = sorted(values)
+    if not vs:
+        return {"avg": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+    return {
+        "avg": round(sum(vs) / len(vs), 2),
+        "p50": round(vs[len(vs) // 2], 2),
+        "p95": round(vs[min(len(vs) - 1, int(len(vs) * 0.95))], 2),
+        "max": round(vs[-1], 2),
+    }
+
+
+class TTLCache:
+    """Small in-process cache with per-entry expiry.
+
+    Thread-safe (sync handlers run on the threadpool). Past max_size the
+    least recently set entries are dropped. Values are local to the worker
+    process, so the TTL also bounds staleness across uvicorn workers.
+    """
+
+    def __init__(self, ttl_seconds: float, max_size: int = 4096):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires <= time.monotonic():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl_seconds: Optional[float] = None) -> None:
+        ttl = self.ttl_seconds if ttl_seconds is None else min(ttl_seconds, self.ttl_seconds)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, time.monotonic() + ttl)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
@@ -0,0 +1,235 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from .label import minhash
+from .label.lcs_matcher import lcs_length
+from .label.watermark_indexer import (
+    canonicalize,
+    extract_sequence_from_melsave,
+    fnv1a64,
+)
+from .utils import timing_summary
+
+
+logger = logging.getLogger("msut.watermark")
+
+WM_WORKERS = max(1, int(os.getenv("WM_WORKERS", "2")))
+# Jobs allowed to wait or run at once; beyond this callers get WatermarkBusy (HTTP 429)
+WM_MAX_PENDING = max(1, int(os.getenv("WM_MAX_PENDING", str(WM_WORKERS * 4))))
+WM_JOB_TIMEOUT = float(os.getenv("WM_JOB_TIMEOUT", "60"))
+_RECENT_JOBS = 200
+
+
+class WatermarkBusy(Exception):
+    """Raised when the extraction queue is full."""
+
+
+class WatermarkUnavailable(WatermarkBusy):
+    """Raised when a job timed out or the worker pool died (HTTP 503)."""
+
+
+@dataclass
+class WatermarkResult:
+    watermark_u64: int
+    length: int
+    embedded: Optional[int]
+    # MinHash signature of the canonical sequence (see label/minhash.py)
+    signature: List[int]
+    queue_ms: float
+    run_ms: float
+    cpu_ms: float
+    # Canonical sequence, only returned when requested (near-duplicate checks)
+    sequence: Optional[List[str]] = None
+
+
+def _extract_job(path: str, keep_sequence: bool) -> Dict[str, Any]:
+    raw_seq, embedded = extract_sequence_from_melsave(path)
+    seq = canonicalize([str(x) for x in raw_seq])
+    return {
+        "watermark_u64": int(fnv1a64(seq)),
+        "length": len(seq),
+        "embedded": embedded,
+        "signature": minhash.signature(seq),
+        "sequence": seq if keep_sequence else None,
+    }
+
+
+def _lcs_job(query_seq: List[str], path: str) -> Dict[str, Any]:
+    raw_seq, _embedded = extract_sequence_from_melsave(path)
+    seq = canonicalize([str(x) for x in raw_seq])
+    return {"lcs": lcs_length(query_seq, seq), "length": len(seq)}
+
+
+def _lcs_seq_job(query_seq: List[str], seq: List[str]) -> Dict[str, Any]:
+    return {"lcs": lcs_length(query_seq, seq), "length": len(seq)}
+
+
+def _timed(fn: Callable, *args) -> Tuple[Any, float, float, float]:
+    # Runs in a worker process. time.monotonic() is system-wide, so the start
+    # stamp can be compared with the submit stamp taken in the parent.
+    started = time.monotonic()
+    cpu0 = time.process_time()
+    out = fn(*args)
+    run_ms = (time.monotonic() - started) * 1000.0
+    cpu_ms = (time.process_time() - cpu0) * 1000.0
+    return out, started, run_ms, cpu_ms
+
+
+class WatermarkService:
+    """CPU-bound watermark extraction on a dedicated process pool.
+
+    Keeps the zip/JSON parsing and hashing off the event loop, caps the number
+    of queued jobs and records per-job timings for /api/watermark/stats.
+    """
+
+    def __init__(self, workers: int = WM_WORKERS, max_pending: int = WM_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._pool: Optional[ProcessPoolExecutor] = None
+        # _pending is also decremented from the pool's result thread
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._timed_out = 0
+        self._rejected = 0
+        self._recent: Deque[Tuple[float, float, float]] = deque(maxlen=_RECENT_JOBS)
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def saturated(self) -> bool:
+        """True when a new job would be rejected right now."""
+        return self._pending >= self.max_pending
+
+    def record_rejection(self) -> None:
+        """Count a request turned away with 429 before reaching _submit."""
+        self._rejected += 1
+
+    def _release(self, _fut: Optional[Future] = None) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    def _drop_pool(self, pool: Optional[ProcessPoolExecutor]) -> None:
+        # A worker died (OOM on a large save, segfault): the executor is
+        # unusable, so the next job starts a fresh one
+        if pool is not None and self._pool is pool:
+            self._pool = None
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    async def _submit(self, label: str, fn: Callable, *args) -> Tuple[Any, float, float, float]:
+        if self.saturated():
+            self._rejected += 1
+            raise WatermarkBusy("水印任务繁忙，请稍后再试")
+        with self._lock:
+            self._pending += 1
+        self._submitted += 1
+        submitted = time.monotonic()
+        pool = None
+        try:
+            pool = self._get_pool()
+            cfut = pool.submit(_timed, fn, *args)
+        except BrokenProcessPool as ex:
+            self._release()
+            self._failed += 1
+            self._drop_pool(pool)
+            raise WatermarkUnavailable("水印服务暂时不可用，请稍后再试") from ex
+        except Exception:
+            self._release()
+            self._failed += 1
+            raise
+        # The slot is freed when the worker is done, not when the caller stops
+        # waiting: a timed-out job keeps running in its process and must keep
+        # counting against WM_MAX_PENDING.
+        cfut.add_done_callback(self._release)
+        try:
+            out, started, run_ms, cpu_ms = await asyncio.wait_for(
+                asyncio.wrap_future(cfut), timeout=WM_JOB_TIMEOUT
+            )
+        except asyncio.TimeoutError as ex:
+            self._failed += 1
+            self._timed_out += 1
+            logger.warning("wm job timed out after %gs: %s", WM_JOB_TIMEOUT, label)
+            raise WatermarkUnavailable("水印任务超时，请稍后再试") from ex
+        except BrokenProcessPool as ex:
+            self._failed += 1
+            self._drop_pool(pool)
+            logger.warning("wm worker pool broken: %s", label)
+            raise WatermarkUnavailable("水印服务暂时不可用，请稍后再试") from ex
+        except Exception:
+            self._failed += 1
+            raise
+        queue_ms = max(0.0, (started - submitted) * 1000.0)
+        self._completed += 1
+        self._recent.append((queue_ms, run_ms, cpu_ms))
+        logger.info(
+            "wm job: %s queue_ms=%.1f run_ms=%.1f cpu_ms=%.1f pending=%s",
+            label,
+            queue_ms,
+            run_ms,
+            cpu_ms,
+            self._pending,
+        )
+        return out, queue_ms, run_ms, cpu_ms
+
+    async def compute(self, path: str, keep_sequence: bool = False) -> WatermarkResult:
+        out, queue_ms, run_ms, cpu_ms = await self._submit(
+            f"extract path={path}", _extract_job, path, keep_sequence
+        )
+        return WatermarkResult(
+            watermark_u64=out["watermark_u64"],
+            length=out["length"],
+            embedded=out["embedded"],
+            signature=out["signature"],
+            queue_ms=queue_ms,
+            run_ms=run_ms,
+            cpu_ms=cpu_ms,
+            sequence=out["sequence"],
+        )
+
+    async def lcs(self, query_seq: List[str], path: str) -> Tuple[int, int]:
+        """LCS length between query_seq and the canonical sequence of the save at path."""
+        out, _q, _r, _c = await self._submit(f"lcs path={path}", _lcs_job, query_seq, path)
+        return out["lcs"], out["length"]
+
+    async def lcs_seq(self, query_seq: List[str], seq: List[str]) -> Tuple[int, int]:
+        """LCS length between query_seq and an already extracted canonical sequence."""
+        out, _q, _r, _c = await self._submit(
+            f"lcs len={len(seq)}", _lcs_seq_job, query_seq, seq
+        )
+        return out["lcs"], out["length"]
+
+    def stats(self) -> Dict:
+        recent = list(self._recent)
+        return {
+            "workers": self.workers,
+            "maxPending": self.max_pending,
+            "pending": self._pending,
+            "submitted": self._submitted,
+            "completed": self._completed,
+            "failed": self._failed,
+            "timedOut": self._timed_out,
+            "rejected": self._rejected,
+            "queueMs": timing_summary([r[0] for r in recent]),
+            "runMs": timing_summary([r[1] for r in recent]),
+            "cpuMs": timing_summary([r[2] for r in recent]),
+        }
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+service = WatermarkService()
@@ -0,0 +1,87 @@
+"""Compact storage of canonical watermark sequences.
+
+Object ids are interned into ``wm_tokens`` and each file's canonical sequence
+is kept in ``file_sequences`` as a delta/varint BLOB (see label/seqcodec.py),
+so near-duplicate checks can re-match against stored files without fetching
+and re-parsing their .melsave from R2. The MinHash signature and LSH band
+rows used to find those candidates are written here as well.
+"""
+
+from typing import Dict, Iterable, List, Sequence
+
+from .label import minhash, seqcodec
+
+# Current BLOB layout of file_sequences.data
+SEQ_CODEC = 1
+# Stay well below SQLite's host-parameter limit
+_CHUNK = 500
+
+
+def _chunks(items: Sequence, size: int = _CHUNK):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def intern_tokens(cur, tokens: Iterable[str]) -> Dict[str, int]:
+    """Dictionary ids for tokens, inserting unseen ones in first-seen order."""
+    uniq = list(dict.fromkeys(str(t) for t in tokens))
+    # One statement for all tokens instead of an INSERT per unseen one
+    cur.executemany("INSERT OR IGNORE INTO wm_tokens (token) VALUES (?)", [(t,) for t in uniq])
+    ids: Dict[str, int] = {}
+    for part in _chunks(uniq):
+        ph = ",".join(["?"] * len(part))
+        for r in cur.execute(
+            f"SELECT id, token FROM wm_tokens WHERE token IN ({ph})", tuple(part)
+        ).fetchall():
+            ids[r["token"]] = int(r["id"])
+    return ids
+
+
+def store_sequence(cur, file_id: int, seq: Sequence[str]) -> None:
+    ids = intern_tokens(cur, seq)
+    cur.execute(
+        """
+        INSERT OR REPLACE INTO file_sequences (file_id, codec, seq_len, data)
+        VALUES (?, ?, ?, ?)
+        """,
+        (file_id, SEQ_CODEC, len(seq), seqcodec.encode(ids[str(t)] for t in seq)),
+    )
+
+
+def store_minhash(cur, file_id: int, signature: List[int], seq_len: int) -> None:
+    """MinHash signature of a file plus its LSH band rows (see label/minhash.py)."""
+    cur.execute(
+        """
+        INSERT OR REPLACE INTO file_minhash (file_id, num_perm, seq_len, signature)
+        VALUES (?, ?, ?, ?)
+        """,
+        (file_id, len(signature), int(seq_len), minhash.pack(signature)),
+    )
+    cur.execute("DELETE FROM file_lsh_buckets WHERE file_id = ?", (file_id,))
+    cur.executemany(
+        "INSERT OR IGNORE INTO file_lsh_buckets (band, bucket, file_id) VALUES (?, ?, ?)",
+        [(band, key, file_id) for band, key in enumerate(minhash.band_keys(signature))],
+    )
+
+
+def load_sequences(cur, file_ids: Iterable[int]) -> Dict[int, List[str]]:
+    """Canonical sequences of the given files; files without a stored row are omitted."""
+    fids = list(dict.fromkeys(int(f) for f in file_ids))
+    encoded: Dict[int, List[int]] = {}
+    for part in _chunks(fids):
+        ph = ",".join(["?"] * len(part))
+        for r in cur.execute(
+            f"SELECT file_id, codec, data FROM file_sequences WHERE file_id IN ({ph})",
+            tuple(part),
+        ).fetchall():
+            if int(r["codec"]) == SEQ_CODEC:
+                encoded[int(r["file_id"])] = seqcodec.decode(r["data"])
+    wanted = list({i for ids in encoded.values() for i in ids})
+    tokens: Dict[int, str] = {}
+    for part in _chunks(wanted):
+        ph = ",".join(["?"] * len(part))
+        for r in cur.execute(
+            f"SELECT id, token FROM wm_tokens WHERE id IN ({ph})", tuple(part)
+        ).fetchall():
+            tokens[int(r["id"])] = r["token"]
+    return {fid: [tokens[i] for i in ids] for fid, ids in encoded.items()}
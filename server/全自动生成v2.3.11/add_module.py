@@ -4,6 +4,10 @@ import json
 import uuid
 import sys
 
+from src.log import get_logger
+
+log = get_logger(__name__)
+
 # --- 配置 ---
 
 # 【修改】模块类型名 -> 游戏内部数据类型代码的映射
@@ -108,7 +112,7 @@ def create_new_node(module_name, module_info, existing_nodes):
     # 1) OperationType: 旧版为 int，新版为 str（常见为 module 的 nodename）
     module_id = module_info.get("id")
     if module_id is None:
-        print(f"错误: 模块 '{module_name}' 的 'id' 缺失。")
+        log.error("错误: 模块 '%s' 的 'id' 缺失。", module_name)
         return None
 
     if use_string:
@@ -143,7 +147,7 @@ def create_new_node(module_name, module_info, existing_nodes):
 
     # 2. 生成唯一的节点ID
     node_id = f"{module_name} : {uuid.uuid4()}"
-    print(f"为新节点生成ID: {node_id}")
+    log.debug("为新节点生成ID: %s", node_id)
 
     # 3. 【修改】根据新的输入/输出格式创建端口
     inputs = []
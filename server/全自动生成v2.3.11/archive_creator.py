@@ -14,6 +14,9 @@ from pathlib import Path
 from typing import List
 
 from src.config import FINAL_SAVE_PATH, OUTPUT_DIR, ensure_output_dir
+from src.log import get_logger
+
+log = get_logger(__name__)
 
 def generate_random_filename(length: int = 8) -> str:
     """
@@ -50,29 +53,29 @@ def create_melsave_archive(ungraph_path: Path, metadata_path: Path, icon_path: P
     
     for file_path, name in required_files:
         if not file_path.exists():
-            print(f"❌ 错误：未找到必需文件 '{name}' 在路径 '{file_path}'")
+            log.error("❌ 错误：未找到必需文件 '%s' 在路径 '%s'", name, file_path)
             return False
     
     try:
         # 创建压缩文件
         with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
             # 添加 ungraph.json 并重命名为 Data
-            print(f"📦 添加 '{ungraph_path}' 为 'Data'")
+            log.debug("📦 添加 '%s' 为 'Data'", ungraph_path)
             zipf.write(ungraph_path, 'Data')
             
             # 添加 MetaData 文件
-            print(f"📦 添加 '{metadata_path}' 为 'MetaData'")
+            log.debug("📦 添加 '%s' 为 'MetaData'", metadata_path)
             zipf.write(metadata_path, 'MetaData')
             
             # 添加 Icon 文件
-            print(f"📦 添加 '{icon_path}' 为 'Icon'")
+            log.debug("📦 添加 '%s' 为 'Icon'", icon_path)
             zipf.write(icon_path, 'Icon')
         
-        print(f"✅ 成功创建压缩文件: '{output_path}'")
+        log.info("✅ 成功创建压缩文件: '%s'", output_path)
         return True
         
     except Exception as e:
-        print(f"❌ 创建压缩文件时发生错误: {e}")
+        log.error("❌ 创建压缩文件时发生错误: %s", e)
         return False
 
 def run_archive_creation_stage() -> bool:
@@ -82,7 +85,6 @@ def run_archive_creation_stage() -> bool:
     Returns:
         bool: 是否成功完成
     """
-    print("\n--- 阶段 7: 创建 .melsave 归档文件 ---")
 
     # 确保输出目录存在，统一写到 output/ 目录下
     ensure_output_dir()
@@ -96,15 +98,15 @@ def run_archive_creation_stage() -> bool:
     random_name = generate_random_filename()
     output_path = OUTPUT_DIR / f"{random_name}.melsave"
 
-    print(f"📁 生成随机文件名: {output_path.name}")
+    log.debug("📁 生成随机文件名: %s", output_path.name)
     
     # 创建归档
     success = create_melsave_archive(ungraph_path, metadata_path, icon_path, output_path)
     
     if success:
-        print("✅ 归档创建阶段完成！")
+        log.info("✅ 归档创建阶段完成！")
     else:
-        print("❌ 归档创建阶段失败！")
+        log.error("❌ 归档创建阶段失败！")
     
     return success
 
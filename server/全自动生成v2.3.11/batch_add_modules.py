@@ -21,6 +21,10 @@ from pathlib import Path
 from typing import List, Dict, Any, Tuple
 import copy
 
+from src.log import get_logger
+
+log = get_logger(__name__)
+
 # ... (动态导入和复用工具部分保持不变) ...
 try:
     add_module = importlib.import_module("add_module")
@@ -190,7 +194,7 @@ def add_modules(
                 special_node_defs.append(node_def)
                 original_request_order.append(node_def)
             else:
-                print(f" 警告: 跳过无法识别的 dict 指令: {item}")
+                log.warning(" 警告: 跳过无法识别的 dict 指令: %s", item)
         elif isinstance(item, str):
             special = parse_special_notation(item)
             if special:
@@ -200,7 +204,7 @@ def add_modules(
                 internal_module_requests.append(item)
                 original_request_order.append(item)
         else:
-            print(f" 警告: 跳过无法识别的指令: {item}")
+            log.warning(" 警告: 跳过无法识别的指令: %s", item)
 
     # ---------- 2. 定位 chip_graph (无变化) ----------
     chip_graph_meta = None
@@ -259,7 +263,7 @@ def add_modules(
                 processing_queue.append({"type": "internal", "id": internal_id, "info": module_definitions[internal_id]})
                 temp_requests.remove(req)
             else:
-                print(f"️ 未找到与 '{req}' 相近的模块，跳过。")
+                log.warning("️ 未找到与 '%s' 相近的模块，跳过。", req)
         elif isinstance(req, dict):
             processing_queue.append(req)
 
@@ -316,7 +320,7 @@ def add_modules(
                 continue
 
             existing_nodes.append(new_node)
-            print(f" 已添加: {view_model_name}")
+            log.debug(" 已添加: %s", view_model_name)
             created_nodes_info.append({"class_name": view_model_name, "full_id": new_node["Id"]})
         
         # 处理 input/output/constant 的逻辑不变
@@ -326,9 +330,9 @@ def add_modules(
             input_entry, graph_node = create_input_node(name, data_type, use_string_schema=use_string_schema)
             chip_inputs_data.append(input_entry)
             node_id = graph_node["Id"]
-            print(f"为新节点生成ID: RootNodeViewModel : {node_id.split(' : ')[-1]}")
+            log.debug("为新节点生成ID: %s", node_id)
             y_pos_counter = add_node_to_graph(chip_graph_data, graph_node, y_pos_counter)
-            print(f" 已添加: RootNodeViewModel")
+            log.debug(" 已添加: RootNodeViewModel")
             created_nodes_info.append({"class_name": "RootNodeViewModel", "full_id": node_id})
         
         elif node_type == "output":
@@ -337,9 +341,9 @@ def add_modules(
             output_entry, graph_node = create_output_node(name, data_type, use_string_schema=use_string_schema)
             chip_outputs_data.append(output_entry)
             node_id = graph_node["Id"]
-            print(f"为新节点生成ID: ExitNodeViewModel : {node_id.split(' : ')[-1]}")
+            log.debug("为新节点生成ID: %s", node_id)
             y_pos_counter = add_node_to_graph(chip_graph_data, graph_node, y_pos_counter)
-            print(f" 已添加: ExitNodeViewModel")
+            log.debug(" 已添加: ExitNodeViewModel")
             created_nodes_info.append({"class_name": "ExitNodeViewModel", "full_id": node_id})
 
         elif node_type == "constant":
@@ -348,9 +352,9 @@ def add_modules(
             graph_node = create_constant_node(value, data_type, use_string_schema=use_string_schema)
             node_id = graph_node["Id"]
             class_name = node_id.split(" : ")[0]
-            print(f"为新节点生成ID: {node_id}")
+            log.debug("为新节点生成ID: %s", node_id)
             y_pos_counter = add_node_to_graph(chip_graph_data, graph_node, y_pos_counter)
-            print(f" 已添加: {class_name}")
+            log.debug(" 已添加: %s", class_name)
             created_nodes_info.append({"class_name": class_name, "full_id": node_id})
 
         elif node_type == "variable":
@@ -359,7 +363,7 @@ def add_modules(
             init_value = req_item.get("value")
 
             if not isinstance(var_key, str) or not var_key:
-                print(" 警告: 跳过一个变量节点，因为缺少合法的 key。")
+                log.warning(" 警告: 跳过一个变量节点，因为缺少合法的 key。")
                 continue
 
             # 1) chip_variables 中追加 / 更新变量定义
@@ -384,9 +388,9 @@ def add_modules(
             # 2) chip_graph 中生成 Variable 节点
             graph_node = create_variable_node(var_key, gate_type)
             node_id = graph_node["Id"]
-            print(f"为新节点生成ID: {node_id}")
+            log.debug("为新节点生成ID: %s", node_id)
             y_pos_counter = add_node_to_graph(chip_graph_data, graph_node, y_pos_counter)
-            print(" 已添加: VariableNodeViewModel")
+            log.debug(" 已添加: VariableNodeViewModel")
             created_nodes_info.append({"class_name": "VariableNodeViewModel", "full_id": node_id})
 
     # ---------- 5. 写回修改 (无变化) ----------
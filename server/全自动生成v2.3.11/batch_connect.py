@@ -8,10 +8,15 @@
 """
 
 import json
+import logging
 import os
 import re  # <-- 导入正则表达式模块
 import sys
-from typing import Dict, Any
+from typing import Dict, Any, List
+
+from src.log import get_logger
+
+log = get_logger(__name__)
 
 # ------------ 配置区（仅在独立运行时生效）------------
 GRAPH_IN      = "Data_modified.json"
@@ -76,21 +81,19 @@ def read_json(path: str, desc: str) -> Dict[str, Any]:
 
 
 # ======================= 核心逻辑函数 (已修改) =======================
-def apply_connections(input_graph_path: str, connections_path: str, output_graph_path: str) -> bool:
+def apply_connections_to_data(data: Dict[str, Any], connections: List[Dict[str, Any]]) -> int:
     """
-    读取存档文件和连接指令，应用连接，并写回存档。
+    在内存中的存档 dict 上应用连接指令（原地修改 chip_graph），返回成功的连接数。
+    存档中找不到 chip_graph 时抛出 ValueError。
     """
-    data = read_json(input_graph_path, "图数据")
-    connections = read_json(connections_path, "连接指令")
-
     graph_data, graph_meta = find_chip_graph(data)
     if graph_data is None:
-        print(f"错误：未在 '{input_graph_path}' 中找到 chip_graph 字段")
-        return False
+        raise ValueError("存档中未找到 chip_graph 字段")
 
     node_lookup, _ = build_node_lookup(graph_data)
 
     success_count = 0
+    debug = log.isEnabledFor(logging.DEBUG)
     for idx, conn in enumerate(connections, 1):
         # 保存原始ID用于打印日志
         original_f_node_id = conn["from_node_id"]
@@ -116,21 +119,42 @@ def apply_connections(input_graph_path: str, connections_path: str, output_graph
             to_port["connectedOutputIdModel"] = {"Id": from_port["Id"], "NodeId": from_node["Id"]}
             from_port.setdefault("ConnectedInputsIds", []).append({"Id": to_port["Id"], "NodeId": to_node["Id"]})
             
-            # 打印日志时，可以使用更简洁的名称
-            f_name = original_f_node_id.split(':')[0].strip()
-            t_name = original_t_node_id.split(':')[0].strip()
-            print(f"  第 {idx} 条连接成功: {f_name}[{f_port_idx}] → {t_name}[{t_port_idx}]")
+            if debug:
+                # 打印日志时，可以使用更简洁的名称
+                f_name = original_f_node_id.split(':')[0].strip()
+                t_name = original_t_node_id.split(':')[0].strip()
+                log.debug("  第 %d 条连接成功: %s[%s] → %s[%s]", idx, f_name, f_port_idx, t_name, t_port_idx)
             success_count += 1
 
         except (KeyError, IndexError) as e:
             # 错误信息现在会显示原始ID，更易于理解
-            print(f"  第 {idx} 条连接失败: 指令 {conn} -> 错误: {e}")
+            log.warning("  第 %d 条连接失败: 指令 %s -> 错误: %s", idx, conn, e, extra={"conn_index": idx})
 
     graph_meta["stringValue"] = json.dumps(graph_data, ensure_ascii=False)
+    log.info(
+        "批量连接完成, %d/%d 条成功。",
+        success_count, len(connections),
+        extra={"connected": success_count, "total": len(connections)},
+    )
+    return success_count
+
+
+def apply_connections(input_graph_path: str, connections_path: str, output_graph_path: str) -> bool:
+    """
+    读取存档文件和连接指令，应用连接，并写回存档（文件版，供独立运行使用）。
+    """
+    data = read_json(input_graph_path, "图数据")
+    connections = read_json(connections_path, "连接指令")
+
+    try:
+        apply_connections_to_data(data, connections)
+    except ValueError:
+        log.error("错误：未在 '%s' 中找到 chip_graph 字段", input_graph_path)
+        return False
+
     with open(output_graph_path, "w", encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
-
-    print(f"\n批量连接完成, {success_count}/{len(connections)} 条成功。结果已写入 “{output_graph_path}”")
+    log.info("结果已写入 “%s”", output_graph_path)
     return True
 
 
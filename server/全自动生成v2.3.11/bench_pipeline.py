@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_pipeline.py
+=================
+
+DSL -> .melsave 完整流水线的基准测试（离线、进程内）。
+
+按形状与规模生成合成 DSL 程序，在进程内把每个程序完整跑 --runs 次 run_full_pipeline，
+借助 src.profiler 记录每个阶段的耗时；另外单独开启 tracemalloc 跑一次记录各阶段的内存分配峰值
+（tracemalloc 会明显拖慢执行，不参与计时）。
+
+形状：
+  fanout     一个输入被大量节点同时引用（宽扇出）
+  chain      一条很深的运算链
+  variables  大量 VARIABLE 节点及其读取
+  constants  大量字面量 / 向量常量
+  vectors    向量类型运算（Position / NORMALIZE / 向量乘加）
+
+流水线读写固定路径（input.py、output/），所以会先把生成器目录复制到临时目录，在副本里运行，
+不会改动当前目录下的文件。默认关闭 DSL 编译缓存（--dsl-cache 打开），否则重复运行会命中缓存；
+日志与服务端一样使用安静模式（可用 PIPELINE_LOG_LEVEL / PIPELINE_QUIET 覆盖）。
+
+用法：
+  python bench_pipeline.py
+  python bench_pipeline.py --shapes chain,fanout --sizes 100,400 --runs 5
+  python bench_pipeline.py --save-baseline bench_baseline.json
+  python bench_pipeline.py --baseline bench_baseline.json --threshold 0.25
+
+与基线比较时，某个阶段的中位耗时超过基线 (1 + threshold) 倍、且绝对差值超过 --min-delta-ms，
+即视为性能回退，进程以退出码 1 结束。
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+HERE = Path(__file__).resolve().parent
+SHAPES = ("fanout", "chain", "variables", "constants", "vectors")
+
+
+# =========================== 合成 DSL ===========================
+
+def _header() -> List[str]:
+    return [
+        'ent = INPUT(attrs={"name": "Entity", "data_type": 1})',
+        'x0 = INPUT(attrs={"name": "X0", "data_type": 2})',
+        'x1 = INPUT(attrs={"name": "X1", "data_type": 2})',
+    ]
+
+
+def dsl_fanout(n: int, rnd: random.Random) -> str:
+    lines = _header()
+    for i in range(n):
+        op = rnd.choice(("ADD", "MULTIPLY", "SUBTRACT"))
+        lines.append(f"f{i} = {op}(A=x0, B=x1)")
+    for i in range(0, n, max(1, n // 8)):
+        lines.append(f'OUTPUT(INPUT=f{i}, attrs={{"name": "out{i}"}})')
+    return "\n".join(lines) + "\n"
+
+
+def dsl_chain(n: int, rnd: random.Random) -> str:
+    lines = _header()
+    prev = "x0"
+    for i in range(n):
+        op = rnd.choice(("ADD", "MULTIPLY", "SUBTRACT"))
+        lines.append(f"c{i} = {op}(A={prev}, B=x1)")
+        prev = f"c{i}"
+    lines.append(f'OUTPUT(INPUT={prev}, attrs={{"name": "result"}})')
+    return "\n".join(lines) + "\n"
+
+
+def dsl_variables(n: int, rnd: random.Random) -> str:
+    lines = _header()
+    n_vars = max(1, n // 3)
+    for i in range(n_vars):
+        lines.append(f"v{i} = VARIABLE(Value={rnd.randint(0, 99)}.0, Set=0)")
+    for i in range(n - n_vars):
+        a, b = rnd.randrange(n_vars), rnd.randrange(n_vars)
+        lines.append(f"u{i} = ADD(A=v{a}, B=v{b})")
+    lines.append('OUTPUT(INPUT=u0, attrs={"name": "result"})' if n > n_vars else 'OUTPUT(INPUT=v0, attrs={"name": "result"})')
+    return "\n".join(lines) + "\n"
+
+
+def dsl_constants(n: int, rnd: random.Random) -> str:
+    lines = _header()
+    for i in range(n):
+        if i % 3 == 2:
+            lines.append(
+                f'k{i} = {{"x": {rnd.uniform(-9, 9):.3f}, "y": {rnd.uniform(-9, 9):.3f}, "z": {rnd.uniform(-9, 9):.3f}}}'
+            )
+        else:
+            lines.append(f"k{i} = MULTIPLY(A=x0, B={rnd.uniform(0.5, 9.5):.4f})")
+    lines.append('OUTPUT(INPUT=k0, attrs={"name": "result"})')
+    return "\n".join(lines) + "\n"
+
+
+def dsl_vectors(n: int, rnd: random.Random) -> str:
+    lines = _header() + ["p0 = Position(object=ent)"]
+    vecs, nums = ["p0"], ["x0", "x1"]
+    for i in range(n):
+        k = rnd.randrange(4)
+        if k == 0:
+            lines.append(f"n{i} = NORMALIZE(input={rnd.choice(vecs)})")
+            vecs.append(f"n{i}")
+        elif k == 1:
+            lines.append(f"m{i} = SQR_MAGNITUDE(INPUT={rnd.choice(vecs)})")
+            nums.append(f"m{i}")
+        elif k == 2:
+            lines.append(
+                f'w{i} = MULTIPLY(A={rnd.choice(vecs)}, B={rnd.choice(nums)}, attrs={{"datatype": 8}})'
+            )
+            vecs.append(f"w{i}")
+        else:
+            lines.append(
+                f'w{i} = ADD(A={rnd.choice(vecs)}, B={rnd.choice(vecs)}, attrs={{"datatype": 8}})'
+            )
+            vecs.append(f"w{i}")
+    lines.append(f'OUTPUT(INPUT={vecs[-1]}, attrs={{"name": "result", "data_type": 8}})')
+    return "\n".join(lines) + "\n"
+
+
+GENERATORS: Dict[str, Callable[[int, random.Random], str]] = {
+    "fanout": dsl_fanout,
+    "chain": dsl_chain,
+    "variables": dsl_variables,
+    "constants": dsl_constants,
+    "vectors": dsl_vectors,
+}
+
+
+def synth_program(shape: str, size: int, seed: int = 7) -> str:
+    return GENERATORS[shape](size, random.Random(f"{shape}:{size}:{seed}"))
+
+
+# =========================== 运行 ===========================
+
+def _prepare_workspace() -> Path:
+    """复制生成器目录到临时目录（与服务端 melsave._copy_tree 一样跳过缓存和旧产物）。"""
+    def _ignore(_dir: str, names: List[str]) -> set:
+        return {n for n in names if n in {".git", "__pycache__", "output"} or n.endswith(".melsave")}
+
+    work = Path(tempfile.mkdtemp(prefix="bench_pipeline_"))
+    shutil.copytree(HERE, work, ignore=_ignore, dirs_exist_ok=True)
+    if (work / "Data.json").exists() and not (work / "data.json").exists():
+        (work / "Data.json").rename(work / "data.json")
+    return work
+
+
+def _run_once(run_full_pipeline: Callable[[], None], work: Path, report_path: Path) -> Optional[Dict[str, Any]]:
+    report_path.unlink(missing_ok=True)
+    for p in (work / "output").glob("*.melsave"):
+        p.unlink()
+    ok = True
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        try:
+            run_full_pipeline()
+        except SystemExit:
+            # handle_error 打印错误后 sys.exit
+            ok = False
+    if not report_path.exists():
+        return None
+    report = json.loads(report_path.read_text(encoding="utf-8"))
+    report["ok"] = ok and report.get("ok", True)
+    return report
+
+
+def _summarize(reports: List[Dict[str, Any]], mem_report: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    stages: Dict[str, Dict[str, Any]] = {}
+    names = [s["name"] for s in reports[0]["stages"]] + ["total"]
+    for name in names:
+        if name == "total":
+            walls = [r["total_wall_ms"] for r in reports]
+            cpus = [r["total_cpu_ms"] for r in reports]
+            counts: Dict[str, Any] = {}
+        else:
+            recs = [next(s for s in r["stages"] if s["name"] == name) for r in reports]
+            walls = [s["wall_ms"] for s in recs]
+            cpus = [s["cpu_ms"] for s in recs]
+            counts = {"nodes": recs[0].get("nodes"), "edges": recs[0].get("edges")}
+        entry = {
+            "median_ms": round(statistics.median(walls), 3),
+            "min_ms": round(min(walls), 3),
+            "max_ms": round(max(walls), 3),
+            "cpu_median_ms": round(statistics.median(cpus), 3),
+            **counts,
+        }
+        if mem_report is not None and name != "total":
+            rec = next((s for s in mem_report["stages"] if s["name"] == name), None)
+            if rec is not None:
+                entry["py_alloc_peak_kb"] = rec.get("py_alloc_peak_kb")
+        stages[name] = entry
+    return {"runs": len(reports), "stages": stages}
+
+
+def run_suite(shapes: List[str], sizes: List[int], runs: int, seed: int, memory: bool) -> Dict[str, Any]:
+    work = _prepare_workspace()
+    report_path = work / "bench_profile.json"
+    cwd = os.getcwd()
+    os.environ["PIPELINE_PROFILE"] = str(report_path)
+    # 从副本导入，流水线的路径常量才会指向临时目录
+    sys.path.insert(0, str(work))
+    os.chdir(work)
+    results: Dict[str, Any] = {}
+    try:
+        from src.pipeline import run_full_pipeline
+
+        for shape in shapes:
+            for size in sizes:
+                key = f"{shape}-{size}"
+                (work / "input.py").write_text(synth_program(shape, size, seed), encoding="utf-8")
+                reports = []
+                for _ in range(runs):
+                    rep = _run_once(run_full_pipeline, work, report_path)
+                    if rep is None or not rep["ok"]:
+                        break
+                    reports.append(rep)
+                if len(reports) < runs:
+                    print(f"  {key:<16} 失败（流水线报错），跳过")
+                    results[key] = {"error": "pipeline failed"}
+                    continue
+
+                mem_report = None
+                if memory:
+                    tracemalloc.start()
+                    try:
+                        mem_report = _run_once(run_full_pipeline, work, report_path)
+                    finally:
+                        tracemalloc.stop()
+
+                results[key] = _summarize(reports, mem_report)
+                st = results[key]["stages"]
+                top = max((n for n in st if n != "total"), key=lambda n: st[n]["median_ms"])
+                print(
+                    f"  {key:<16} total {st['total']['median_ms']:8.1f} ms  "
+                    f"(最慢阶段 {top} {st[top]['median_ms']:.1f} ms)"
+                )
+    finally:
+        os.chdir(cwd)
+        sys.path.remove(str(work))
+        os.environ.pop("PIPELINE_PROFILE", None)
+        shutil.rmtree(work, ignore_errors=True)
+    return results
+
+
+# =========================== 基线比较 ===========================
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float, min_delta_ms: float) -> List[str]:
+    """返回回退描述列表（为空表示没有回退）。只比较两边都存在的程序和阶段。"""
+    regressions: List[str] = []
+    base_results = baseline.get("results", {})
+    for key, cur in current.items():
+        base = base_results.get(key)
+        if not base or "stages" not in base or "stages" not in cur:
+            continue
+        for stage, cur_st in cur["stages"].items():
+            base_st = base["stages"].get(stage)
+            if not base_st:
+                continue
+            b, c = base_st["median_ms"], cur_st["median_ms"]
+            if c > b * (1.0 + threshold) and c - b > min_delta_ms:
+                regressions.append(f"{key}/{stage}: {b:.1f} ms -> {c:.1f} ms (+{(c / b - 1) * 100 if b else float('inf'):.0f}%)")
+    return regressions
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="DSL 流水线基准测试")
+    ap.add_argument("--shapes", default=",".join(SHAPES), help=f"逗号分隔，可选 {','.join(SHAPES)}")
+    ap.add_argument("--sizes", default="50,200", help="逗号分隔的程序规模（节点数量级）")
+    ap.add_argument("--runs", type=int, default=3)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--no-memory", action="store_true", help="跳过 tracemalloc 内存测量")
+    ap.add_argument("--dsl-cache", action="store_true", help="保留 DSL 编译缓存（默认关闭）")
+    ap.add_argument("--save-baseline", type=Path, help="把本次结果写成基线 JSON")
+    ap.add_argument("--baseline", type=Path, help="与该基线 JSON 比较")
+    ap.add_argument("--threshold", type=float, default=0.2, help="允许的相对变慢比例")
+    ap.add_argument("--min-delta-ms", type=float, default=2.0, help="小于该绝对差值的变化视为噪声")
+    ap.add_argument("--json", type=Path, help="把本次完整结果写到该文件")
+    args = ap.parse_args()
+
+    shapes = [s.strip() for s in args.shapes.split(",") if s.strip()]
+    unknown = [s for s in shapes if s not in GENERATORS]
+    if unknown:
+        ap.error(f"未知形状: {', '.join(unknown)}")
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    if not args.dsl_cache:
+        os.environ["DSL_CACHE"] = "0"
+    if "PIPELINE_LOG_LEVEL" not in os.environ:
+        os.environ.setdefault("PIPELINE_QUIET", "1")
+
+    print(f"shapes={','.join(shapes)} sizes={','.join(map(str, sizes))} runs={args.runs}")
+    started = time.perf_counter()
+    results = run_suite(shapes, sizes, args.runs, args.seed, memory=not args.no_memory)
+    print(f"用时 {time.perf_counter() - started:.1f} s")
+
+    doc = {
+        "version": 1,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "params": {"shapes": shapes, "sizes": sizes, "runs": args.runs, "seed": args.seed},
+        "results": results,
+    }
+    if args.json:
+        args.json.write_text(json.dumps(doc, ensure_ascii=False, indent=2), encoding="utf-8")
+    if args.save_baseline:
+        args.save_baseline.write_text(json.dumps(doc, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"✔ 基线已写入 {args.save_baseline}")
+
+    failed = [k for k, v in results.items() if "error" in v]
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        regressions = compare(results, baseline, args.threshold, args.min_delta_ms)
+        if regressions:
+            print(f"❌ 相对基线 {args.baseline} 出现 {len(regressions)} 处性能回退（阈值 +{args.threshold * 100:.0f}%）：")
+            for line in regressions:
+                print(f"   {line}")
+            sys.exit(1)
+        print(f"✔ 与基线 {args.baseline} 相比无性能回退（阈值 +{args.threshold * 100:.0f}%）")
+    if failed:
+        sys.exit(f"❌ 以下程序运行失败: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_type_inference.py
+=======================
+
+src.type_inference.infer_gate_data_types 的微基准。
+
+生成一个约 --nodes 个节点、不写 data_type 的合成 DSL（数学链 + 向量运算 + 常量 + 输入/输出），
+走 converter -> parse_graph_v2 得到真实的 node_map / chip_index，然后只对类型推断计时。
+
+用法：
+  python bench_type_inference.py
+  python bench_type_inference.py --nodes 5000 --repeat 20
+"""
+
+from __future__ import annotations
+
+import argparse
+import ast
+import random
+import time
+from pathlib import Path
+
+from src.config import MODULE_DEF_PATH, RULES_PATH
+from src.converter.dedup_converter import DedupConverter
+from src.pipeline import build_chip_index_from_moduledef, parse_graph_v2
+from src.type_inference import infer_gate_data_types
+from src.utils import load_json
+
+
+def synth_dsl(n_nodes: int, seed: int = 7) -> str:
+    rnd = random.Random(seed)
+    lines = [
+        'x0 = INPUT(attrs={"name": "a"})',
+        'x1 = INPUT(attrs={"name": "b"})',
+        'v0 = Position(object=x0["OUTPUT"])',
+    ]
+    nums, vecs = ["x0", "x1"], ["v0"]
+    i = 0
+    while len(lines) < n_nodes:
+        i += 1
+        k = rnd.randrange(6)
+        a, b = rnd.choice(nums), rnd.choice(nums)
+        if k == 0:
+            lines.append(f'n{i} = ADD(A={a}["OUTPUT"], B={b}["OUTPUT"])')
+            nums.append(f"n{i}")
+        elif k == 1:
+            lines.append(f'n{i} = MULTIPLY(A={a}["OUTPUT"], B={rnd.randrange(1, 9)})')
+            nums.append(f"n{i}")
+        elif k == 2:
+            lines.append(f'n{i} = SUBTRACT(A={a}["OUTPUT"], B={b}["OUTPUT"])')
+            nums.append(f"n{i}")
+        elif k == 3:
+            lines.append(f'v{i} = NORMALIZE(input={rnd.choice(vecs)}["result"])')
+            vecs.append(f"v{i}")
+        elif k == 4:
+            lines.append(f'r{i} = SQR_MAGNITUDE(INPUT={rnd.choice(vecs)}["result"])')
+            nums.append(f"r{i}")
+        else:
+            lines.append(f'OUTPUT(INPUT={a}["OUTPUT"], attrs={{"name": "o{i}"}})')
+    return "\n".join(lines) + "\n"
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--nodes", type=int, default=2000)
+    ap.add_argument("--repeat", type=int, default=10)
+    args = ap.parse_args()
+
+    cvt = DedupConverter()
+    cvt.visit(ast.parse(synth_dsl(args.nodes)))
+    cvt.resolve_unresolved()
+    cvt.finalize_outputs()
+    graph = cvt.g.to_dict()
+
+    module_defs = load_json(MODULE_DEF_PATH, "模块定义")
+    rules = load_json(RULES_PATH, "数据类型规则") if Path(RULES_PATH).exists() else {}
+    chip_index = build_chip_index_from_moduledef(module_defs)
+    t0 = time.perf_counter()
+    _modules, node_map = parse_graph_v2(graph, chip_index)
+    t_parse = time.perf_counter() - t0
+
+    best = float("inf")
+    inferred = {}
+    for _ in range(args.repeat):
+        t0 = time.perf_counter()
+        inferred = infer_gate_data_types(
+            graph, node_map=node_map, chip_index=chip_index, rules=rules, module_defs=module_defs
+        )
+        best = min(best, time.perf_counter() - t0)
+
+    print(f"nodes={len(graph['nodes'])} edges={len(graph['edges'])} (parse_graph_v2 {t_parse * 1000:.0f} ms，不计入)")
+    print(f"infer_gate_data_types: best of {args.repeat} = {best * 1000:.2f} ms，推断出 {len(inferred)} 个节点类型")
+
+
+if __name__ == "__main__":
+    main()
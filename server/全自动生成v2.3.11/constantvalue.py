@@ -4,6 +4,10 @@ import json
 import math
 from typing import Dict, List, Any, Union, Tuple
 
+from src.log import get_logger
+
+log = get_logger(__name__)
+
 # --- 辅助函数 (无变化) ---
 
 def create_vector_json_string(x: float, y: float, z: float) -> str:
@@ -55,7 +59,7 @@ def _modify_single_node(
 
         chip_graph_meta = next((meta for meta in meta_datas if meta.get('key') == 'chip_graph'), None)
         if not chip_graph_meta:
-            print("未找到 chip_graph")
+            log.warning("未找到 chip_graph")
             return False
 
         graph_data = json.loads(chip_graph_meta['stringValue'])
@@ -63,7 +67,7 @@ def _modify_single_node(
 
         target_node = next((n for n in nodes if node_id in n.get('Id','')), None)
         if not target_node:
-            print(f"找不到节点 {node_id}")
+            log.warning("找不到节点 %s", node_id)
             return False
 
         # ---- 先准备 DataType 的字符串名称 ----
@@ -173,14 +177,14 @@ def _modify_single_node(
         return True
 
     except Exception as e:
-        print("修改常量错误:", e)
+        log.error("修改常量错误: %s", e)
         return False
 
     except (KeyError, IndexError, StopIteration) as e:
-        print(f"处理JSON时发生错误：找不到预期的键或索引。路径可能不正确。错误详情: {e}")
+        log.error("处理JSON时发生错误：找不到预期的键或索引。路径可能不正确。错误详情: %s", e)
         return False
     except json.JSONDecodeError as e:
-        print(f"解析内嵌JSON字符串时出错。文件可能已损坏。错误详情: {e}")
+        log.error("解析内嵌JSON字符串时出错。文件可能已损坏。错误详情: %s", e)
         return False
 
 
@@ -194,7 +198,7 @@ def apply_constant_modifications(game_data: Dict[str, Any], instructions: List[D
     """
     num_success = 0
     for inst in instructions:
-        print(f"  > 正在修改常量节点 {inst['node_id'][:8]}... 类型: {inst['value_type']}, 值: {inst['new_value']}")
+        log.debug("  > 正在修改常量节点 %s... 类型: %s, 值: %s", inst['node_id'][:8], inst['value_type'], inst['new_value'])
         success = _modify_single_node(
             game_data=game_data,
             node_id=inst['node_id'],
@@ -204,5 +208,5 @@ def apply_constant_modifications(game_data: Dict[str, Any], instructions: List[D
         if success:
             num_success += 1
     
-    print(f"常量修改完成: {num_success}/{len(instructions)} 个成功。")
+    log.info("常量修改完成: %d/%d 个成功。", num_success, len(instructions))
     return game_data
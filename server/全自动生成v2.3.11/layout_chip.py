@@ -2,6 +2,10 @@ import json
 from collections import defaultdict
 from typing import List, Dict, Any, Tuple, Set
 
+from src.log import get_logger
+
+log = get_logger(__name__)
+
 # --- 布局配置 ---
 # 您可以根据最终效果微调这些值
 X_SPACING = 800.0  # 节点“列”之间的水平距离
@@ -301,12 +305,12 @@ def find_and_update_chip_graph(data: dict, final_positions: dict) -> bool:
                 
                 if nodes_updated > 0:
                     meta_data['stringValue'] = json.dumps(graph_data, separators=(',', ':'))
-                    print(f"   在'chip_graph'中更新了 {nodes_updated} 个节点的位置。")
+                    log.info("   在'chip_graph'中更新了 %d 个节点的位置。", nodes_updated)
                     return True
-        print("   警告: 在JSON中找到了'chip_graph'，但没有需要更新坐标的匹配节点。")
+        log.warning("   警告: 在JSON中找到了'chip_graph'，但没有需要更新坐标的匹配节点。")
         return False
     except (KeyError, IndexError, TypeError) as e:
-        print(f"错误：导航JSON结构时出错: {e}。请检查存档文件结构是否正确。")
+        log.error("错误：导航JSON结构时出错: %s。请检查存档文件结构是否正确。", e)
         return False
 
 # -------------------------------------------------------------
@@ -502,21 +506,21 @@ def run_layout_engine(chip_nodes: List[Dict[str, Any]]) -> Dict[str, Dict[str, f
     接收节点列表，执行完整的布局算法，并返回最终位置。
     这是被 main.py 调用的核心入口。
     """
-    print("1. 核心步骤: 执行 ALAP 分层...")
+    log.debug("1. 核心步骤: 执行 ALAP 分层...")
     predecessors, successors, node_ids = parse_graph(chip_nodes)
     layers = calculate_alap_layers(node_ids, predecessors, successors)
-    print(f"   完成。图被分为 {len(layers)} 个层级。")
+    log.debug("   完成。图被分为 %d 个层级。", len(layers))
 
-    print("2. 核心步骤: 执行多轮质心迭代...")
+    log.debug("2. 核心步骤: 执行多轮质心迭代...")
     temp_positions = iterative_barycenter_positioning(layers, predecessors, successors)
-    print("   完成。")
+    log.debug("   完成。")
     
-    print("3. 最终整理: 解决重叠并垂直居中...")
+    log.debug("3. 最终整理: 解决重叠并垂直居中...")
     final_positions = resolve_overlaps_and_finalize(layers, temp_positions)
-    print("   完成.")
+    log.debug("   完成.")
     
     # === 新增：鱼群式局部交换阶段（在所有布局逻辑之后） ===
-    print("4. 局部交换优化（鱼群式） …")
+    log.debug("4. 局部交换优化（鱼群式） …")
     # 为了与现有代码兼容，我们构造一些必要的参数
     # 注意：这里的 'undirected' 和 'clusters' 是简化处理的，可能与您的原始意图有细微差别
     # 如果您的布局算法中已经有这些概念，请替换成正确的版本
@@ -532,7 +536,7 @@ def run_layout_engine(chip_nodes: List[Dict[str, Any]]) -> Dict[str, Dict[str, f
     simple_clusters = [all_node_ids] if all_node_ids else []
 
     final_positions = _fishschool_local_swaps(predecessors, successors, undirected_graph, simple_clusters, final_positions, max_pass=3)
-    print("   局部交换优化完成。")
+    log.debug("   局部交换优化完成。")
 
     return final_positions
 
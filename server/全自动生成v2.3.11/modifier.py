@@ -2,6 +2,10 @@ import json
 import argparse
 from typing import Dict, List, Any, Optional
 
+from src.log import get_logger
+
+log = get_logger(__name__)
+
 # --- 数据类型常量 ---
 # 便于理解和维护
 DATA_TYPE_MAP = {
@@ -207,7 +211,7 @@ def apply_data_type_modifications(
         if not meta_datas:
             continue
 
-        print("\n--- 阶段 1: 分析并修改 chip_graph ---")
+        log.info("--- 阶段 1: 分析并修改 chip_graph ---")
         for meta_data in meta_datas:
             if meta_data.get('key') == 'chip_graph':
                 graph_string = meta_data.get('stringValue')
@@ -226,7 +230,7 @@ def apply_data_type_modifications(
                     if not node_found:
                         continue
                     
-                    print(f"  -> 找到节点: {node_id}")
+                    log.debug("  -> 找到节点: %s", node_id)
                     op_type = node_found.get('OperationType')
                     use_string_types = _node_uses_string_schema(node_found)
                     new_gate_value = _coerce_gate_type_value(new_node_type, use_string_types=use_string_types)
@@ -236,20 +240,20 @@ def apply_data_type_modifications(
                     # moduledef.json 中可通过 can_modify_data_type 控制该模块是否允许类型修改
                     mod_def = module_defs.get(op_key, {}) if op_key is not None else {}
                     if isinstance(mod_def, dict) and mod_def.get("can_modify_data_type") is False:
-                        print(f"     skip: module '{module_name}' (OpType: {op_type}) is marked as non-modifiable")
+                        log.debug("     skip: module '%s' (OpType: %s) is marked as non-modifiable", module_name, op_type)
                         continue
 
                     # --- 逻辑修正点 ---
                     # 1. 无论节点类型如何，只要它是外部IO，就必须先记录下来以便同步
                     conn_id = node_found.get('MechanicConnectionId')
                     if conn_id:
-                        print(f"     发现外部连接 '{conn_id}'。将加入同步列表。")
+                        log.debug("     发现外部连接 '%s'。将加入同步列表。", conn_id)
                         connections_to_update[conn_id] = new_node_type
                         modification_made = True # 只要有IO连接要更新，就视为有修改
 
                     # 2. 现在再判断是否要跳过对节点内部的修改
                     if op_type in IGNORED_OPERATION_TYPES:
-                        print(f"     跳过对特殊模块 '{module_name}' (ID: {node_id}) 的内部修改。外部连接已记录。")
+                        log.debug("     跳过对特殊模块 '%s' (ID: %s) 的内部修改。外部连接已记录。", module_name, node_id)
                         # (可选) 对于 Input/Output，可以只更新它们在chip_graph中的主类型，因为这有时是必要的
                         node_found['GateDataType'] = new_gate_value
                         # 简单的IO节点通常只有一个输出/输入，可以安全地也更新一下
@@ -382,7 +386,7 @@ def apply_data_type_modifications(
                             continue
 
                     # --- 原有逻辑 (适用于普通模块) ---
-                    print(f"     模块类型: '{module_name}' (OpType: {op_type}), 准备更新主类型为 {get_friendly_type_name(new_node_type)}")
+                    log.debug("     模块类型: '%s' (OpType: %s), 准备更新主类型为 %s", module_name, op_type, get_friendly_type_name(new_node_type))
 
                     # 更新节点本身的主数据类型和存档数据
                     node_found['GateDataType'] = new_gate_value
@@ -392,7 +396,7 @@ def apply_data_type_modifications(
                     # 根据规则更新端口
                     rule = rules.get(op_key) if op_key is not None else None
                     if rule:
-                        print(f"     应用 '{rule.get('module_name', '未知')}' 规则:")
+                        log.debug("     应用 '%s' 规则:", rule.get('module_name', '未知'))
 
                         def resolve_rule_type(port_rule: Any) -> int | None:
                             if port_rule is None or port_rule == "any":
@@ -414,7 +418,7 @@ def apply_data_type_modifications(
                                     if final_type_int is None:
                                         continue
                                     port['DataType'] = _coerce_gate_type_value(final_type_int, use_string_types=use_string_types)
-                                    print(f"       - 输入端口 {i}: 规则='{port_rule}', 更新为 -> {get_friendly_type_name(final_type_int)}")
+                                    log.debug("       - 输入端口 %d: 规则='%s', 更新为 -> %s", i, port_rule, get_friendly_type_name(final_type_int))
 
                         # 更新输出端口
                         if 'Outputs' in node_found and 'outputs' in rule:
@@ -425,10 +429,10 @@ def apply_data_type_modifications(
                                     if final_type_int is None:
                                         continue
                                     port['DataType'] = _coerce_gate_type_value(final_type_int, use_string_types=use_string_types)
-                                    print(f"       - 输出端口 {i}: 规则='{port_rule}', 更新为 -> {get_friendly_type_name(final_type_int)}")
+                                    log.debug("       - 输出端口 %d: 规则='%s', 更新为 -> %s", i, port_rule, get_friendly_type_name(final_type_int))
                     else:
                         # 如果没有找到规则，执行旧的“全部统一”逻辑
-                        print(f"     警告: 未找到 OpType {op_type} 的特定规则。将所有端口类型统一为 {get_friendly_type_name(new_node_type)}。")
+                        log.warning("     警告: 未找到 OpType %s 的特定规则。将所有端口类型统一为 %s。", op_type, get_friendly_type_name(new_node_type))
                         for port in node_found.get('Inputs', []):
                             port['DataType'] = new_gate_value
                         for port in node_found.get('Outputs', []):
@@ -441,10 +445,10 @@ def apply_data_type_modifications(
                 break 
 
         if not connections_to_update and modification_made:
-            print("\n警告: 进行了内部修改，但未找到需要同步的外部连接。可能修改的是非IO节点。")
+            log.warning("警告: 进行了内部修改，但未找到需要同步的外部连接。可能修改的是非IO节点。")
 
         # ... 后续的 阶段 2 和 阶段 3 无需改动 ...
-        print("\n--- 阶段 2: 同步 chip_inputs / chip_outputs (编辑器UI) ---")
+        log.info("--- 阶段 2: 同步 chip_inputs / chip_outputs (编辑器UI) ---")
         # ... (代码不变)
         for meta_data in meta_datas:
             if meta_data.get('key') in ['chip_inputs', 'chip_outputs']:
@@ -457,7 +461,7 @@ def apply_data_type_modifications(
                 for item in io_list:
                     if item.get('Key') in connections_to_update:
                         new_type = connections_to_update[item.get('Key')]
-                        print(f"  -> 在 {key_name} 中更新 '{item.get('Key')}' 的类型为 {get_friendly_type_name(new_type)}")
+                        log.debug("  -> 在 %s 中更新 '%s' 的类型为 %s", key_name, item.get('Key'), get_friendly_type_name(new_type))
                         if isinstance(item.get("GateDataType"), str):
                             item['GateDataType'] = TYPE_INT_TO_STR.get(new_type, new_type)
                         else:
@@ -468,7 +472,7 @@ def apply_data_type_modifications(
                     # 注意：chip_inputs/outputs最好保持格式化，方便阅读
                     meta_data['stringValue'] = json.dumps(io_list, indent=2)
 
-        print("\n--- 阶段 3: 同步 mechanicSerializedInputs (游戏运行时) ---")
+        log.info("--- 阶段 3: 同步 mechanicSerializedInputs (游戏运行时) ---")
         # ... (代码不变)
         for mechanic_item in mechanic_data_list:
             mech_inputs_str = mechanic_item.get('mechanicSerializedInputs')
@@ -479,7 +483,7 @@ def apply_data_type_modifications(
             for item in mech_inputs:
                 if item.get('Key') in connections_to_update:
                     new_type = connections_to_update[item.get('Key')]
-                    print(f"  -> 在 mechanicSerializedInputs 中更新 '{item.get('Key')}' 的类型为 {get_friendly_type_name(new_type)}")
+                    log.debug("  -> 在 mechanicSerializedInputs 中更新 '%s' 的类型为 %s", item.get('Key'), get_friendly_type_name(new_type))
                     if isinstance(item.get("DataType"), str):
                         item['DataType'] = TYPE_INT_TO_STR.get(new_type, new_type)
                     else:
@@ -492,7 +496,7 @@ def apply_data_type_modifications(
 
 
     if not modification_made:
-        print("警告: 根据指令，没有执行任何修改。请检查节点ID是否正确。")
+        log.warning("警告: 根据指令，没有执行任何修改。请检查节点ID是否正确。")
 
     return main_data
 
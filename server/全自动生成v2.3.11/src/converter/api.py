@@ -5,13 +5,18 @@ import json
 import sys
 from pathlib import Path
 
+from src.converter.compile_cache import CacheStats, compile_graph
 from src.converter.dedup_converter import DedupConverter
 from src.error_handler import DSLError, FileIOError, ASTError, handle_error
+from src.log import get_logger
 
+log = get_logger(__name__)
 
-def convert_dsl_to_graph(dsl_script_path: Path | str, output_path: Path | str) -> None:
+
+def convert_dsl_to_graph(dsl_script_path: Path | str, output_path: Path | str) -> CacheStats:
     """
     使用 AST 转换器将 DSL 转为 graph.json（不需要 module_defs）。
+    未改动的语句前缀从编译缓存复用（见 compile_cache），返回本次的复用统计。
     """
     try:
         # Windows 上常见的 UTF-8 BOM 会导致 ast.parse 报 U+FEFF；用 utf-8-sig 自动剥离 BOM。
@@ -25,10 +30,8 @@ def convert_dsl_to_graph(dsl_script_path: Path | str, output_path: Path | str) -
 
     try:
         tree = ast.parse(code, filename=str(dsl_script_path))
-        cvt = DedupConverter()
-        cvt.visit(tree)
-        cvt.resolve_unresolved()
-        cvt.finalize_outputs()
+        out, stats = compile_graph(tree, DedupConverter)
+        log.info("%s", stats.summary())
     except ASTError:
         # ASTError 已经包含了模块信息，直接抛出
         raise
@@ -61,7 +64,6 @@ def convert_dsl_to_graph(dsl_script_path: Path | str, output_path: Path | str) -
         )
 
     try:
-        out = cvt.g.to_dict()
         Path(output_path).write_text(
             json.dumps(out, ensure_ascii=False, indent=2),
             encoding="utf-8",
@@ -72,6 +74,7 @@ def convert_dsl_to_graph(dsl_script_path: Path | str, output_path: Path | str) -
             file_path=str(output_path),
             original_error=e
         )
+    return stats
 
 
 __all__ = ["convert_dsl_to_graph"]
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DSL -> graph.json 的编译缓存（语句级增量）。
+
+转换器按顶层语句顺序处理，处理完第 i 条语句后的状态只取决于前 i 条语句，所以：
+  - 每条顶层语句取 ast.dump（不含行号），与前一条的 key 链式哈希，得到前缀 key；
+  - 整个程序的 key 命中时，直接复用缓存的 graph（完全命中）；
+  - 否则找到最长的已缓存前缀，从该处的转换器快照继续转换剩余语句（前缀命中）；
+    转换过程中每隔若干条语句落一个快照，供下次修改后复用。
+节点 id、常量去重、前向引用都依赖前面语句的状态，只重放改动语句之后的部分，
+输出与完整转换逐字节一致。
+
+缓存目录：环境变量 DSL_CACHE_DIR，未设置时为 $DATA_DIR/dsl_cache，再退到
+~/.cache/msut_dsl_cache（生成器每次在新的临时目录里运行，缓存必须放在外面才能跨次复用；
+服务端会把 DSL_CACHE_DIR 设为自己数据目录下的 dsl_cache）；DSL_CACHE=0 关闭。
+快照用 pickle 保存，读入即执行，所以目录以 0700 创建，且只在属于当前用户、
+其他用户不可写时才启用缓存；否则本次退回完整转换。
+"""
+
+from __future__ import annotations
+
+import ast
+import hashlib
+import json
+import os
+import pickle
+import stat
+import sys
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+CACHE_ENABLED = os.getenv("DSL_CACHE", "1") != "0"
+
+
+def _default_cache_dir() -> Path:
+    data_dir = os.getenv("DATA_DIR")
+    if data_dir:
+        return Path(data_dir) / "dsl_cache"
+    return Path.home() / ".cache" / "msut_dsl_cache"
+
+
+CACHE_DIR = Path(os.getenv("DSL_CACHE_DIR") or _default_cache_dir())
+# 缓存目录里最多保留的文件数（快照 + graph），超出时按 mtime 淘汰最旧的
+CACHE_MAX_FILES = int(os.getenv("DSL_CACHE_MAX_FILES", "512"))
+# 每个程序最多落这么多个快照；短程序至少每 CKPT_MIN_STRIDE 条语句一个
+CKPT_PER_PROGRAM = 32
+CKPT_MIN_STRIDE = 4
+
+_STATS_FILE = "stats.json"
+_salt: Optional[bytes] = None
+
+
+@dataclass
+class CacheStats:
+    statements: int = 0
+    reused: int = 0       # 从缓存复用的语句数
+    converted: int = 0    # 本次实际转换的语句数
+    hit: str = "miss"     # full | prefix | miss | off
+    elapsed_ms: float = 0.0
+
+    def summary(self) -> str:
+        return (
+            f"编译缓存：{self.hit}，复用 {self.reused}/{self.statements} 条语句，"
+            f"转换 {self.converted} 条，用时 {self.elapsed_ms:.1f} ms"
+        )
+
+
+def _code_salt() -> bytes:
+    """生成器源码（整个 src/，快照里的类和转换逻辑都来自这里）与 Python 版本的哈希：
+    任何一处改动，旧缓存自动失效。"""
+    global _salt
+    if _salt is None:
+        h = hashlib.sha256()
+        # ast.dump 的格式和 pickle 的兼容性都随 Python 版本变化
+        h.update(sys.version.encode("utf-8"))
+        src_root = Path(__file__).resolve().parent.parent
+        for path in sorted(src_root.rglob("*.py")):
+            if "__pycache__" in path.parts:
+                continue
+            h.update(path.relative_to(src_root).as_posix().encode("utf-8"))
+            h.update(path.read_bytes())
+        _salt = h.digest()
+    return _salt
+
+
+def statement_keys(tree: ast.Module) -> List[str]:
+    """keys[i] 是前 i+1 条顶层语句的链式哈希。"""
+    keys: List[str] = []
+    prev = _code_salt()
+    for stmt in tree.body:
+        h = hashlib.sha256(prev)
+        h.update(ast.dump(stmt, include_attributes=False).encode("utf-8"))
+        prev = h.digest()
+        keys.append(h.hexdigest())
+    return keys
+
+
+def _ensure_dir() -> bool:
+    """创建缓存目录；目录不是当前用户私有的（别人能往里放快照）时返回 False。"""
+    try:
+        CACHE_DIR.mkdir(mode=0o700, parents=True, exist_ok=True)
+        st = CACHE_DIR.stat()
+    except OSError:
+        return False
+    if not hasattr(os, "getuid"):
+        return True
+    if st.st_uid != os.getuid():
+        return False
+    if stat.S_IMODE(st.st_mode) & 0o077:
+        try:
+            os.chmod(CACHE_DIR, 0o700)
+        except OSError:
+            return False
+    return True
+
+
+def _path(kind: str, key: str) -> Path:
+    return CACHE_DIR / f"{kind}-{key}"
+
+
+def _read(path: Path, loader: Callable[[bytes], Any]) -> Any:
+    try:
+        data = path.read_bytes()
+        os.utime(path)  # 命中即刷新 mtime，淘汰时按 LRU
+        return loader(data)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        # 写了一半 / 版本不兼容：当作未命中
+        path.unlink(missing_ok=True)
+        return None
+
+
+def _write(path: Path, data: bytes) -> None:
+    # 多个生成进程可能同时写同一个 key：先写临时文件再原子替换
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+    except OSError:
+        tmp.unlink(missing_ok=True)
+
+
+def _evict() -> None:
+    try:
+        files = [p for p in CACHE_DIR.iterdir() if p.name != _STATS_FILE]
+    except OSError:
+        return
+    if len(files) <= CACHE_MAX_FILES:
+        return
+    files.sort(key=lambda p: p.stat().st_mtime if p.exists() else 0.0)
+    for p in files[: len(files) - CACHE_MAX_FILES]:
+        p.unlink(missing_ok=True)
+
+
+def _record(stats: CacheStats) -> None:
+    """累计统计写到 stats.json（尽力而为，并发写时可能丢一次计数）。"""
+    path = CACHE_DIR / _STATS_FILE
+    try:
+        total = json.loads(path.read_text(encoding="utf-8"))
+    except Exception:
+        total = {"runs": 0, "full": 0, "prefix": 0, "miss": 0, "statements": 0, "reused": 0}
+    total["runs"] = total.get("runs", 0) + 1
+    total[stats.hit] = total.get(stats.hit, 0) + 1
+    total["statements"] = total.get("statements", 0) + stats.statements
+    total["reused"] = total.get("reused", 0) + stats.reused
+    total["last"] = asdict(stats)
+    _write(path, json.dumps(total, ensure_ascii=False, indent=2).encode("utf-8"))
+
+
+def compile_graph(tree: ast.Module, new_converter: Callable[[], Any]) -> Tuple[Dict[str, Any], CacheStats]:
+    """
+    把 tree 转成 graph dict。new_converter() 返回一个全新的转换器（DedupConverter）。
+    转换中抛出的异常原样向上传递，出错的程序不会写入 graph 缓存。
+    """
+    started = time.perf_counter()
+    stmts = tree.body
+    stats = CacheStats(statements=len(stmts))
+
+    if not CACHE_ENABLED or not _ensure_dir():
+        cvt = new_converter()
+        cvt.visit(tree)
+        cvt.resolve_unresolved()
+        cvt.finalize_outputs()
+        stats.hit, stats.converted = "off", len(stmts)
+        stats.elapsed_ms = (time.perf_counter() - started) * 1000.0
+        return cvt.g.to_dict(), stats
+
+    keys = statement_keys(tree)
+    full_key = keys[-1] if keys else hashlib.sha256(_code_salt()).hexdigest()
+
+    graph = _read(_path("graph", full_key + ".json"), lambda b: json.loads(b.decode("utf-8")))
+    if graph is not None:
+        stats.hit, stats.reused = "full", len(stmts)
+        stats.elapsed_ms = (time.perf_counter() - started) * 1000.0
+        _record(stats)
+        return graph, stats
+
+    cvt, start = None, 0
+    for i in range(len(keys) - 1, -1, -1):
+        ckpt = _path("ckpt", keys[i] + ".pkl")
+        if ckpt.exists():
+            cvt = _read(ckpt, pickle.loads)
+            if cvt is not None:
+                start = i + 1
+                break
+    if cvt is None:
+        cvt = new_converter()
+    else:
+        stats.hit, stats.reused = "prefix", start
+
+    stride = max(CKPT_MIN_STRIDE, -(-len(stmts) // CKPT_PER_PROGRAM))
+    for j in range(start, len(stmts)):
+        cvt.visit(stmts[j])
+        stats.converted += 1
+        if (j + 1) % stride == 0 and j + 1 < len(stmts):
+            ckpt = _path("ckpt", keys[j] + ".pkl")
+            if not ckpt.exists():
+                _write(ckpt, pickle.dumps(cvt, protocol=pickle.HIGHEST_PROTOCOL))
+
+    # resolve/finalize 会改动状态，放在所有快照之后
+    cvt.resolve_unresolved()
+    cvt.finalize_outputs()
+    graph = cvt.g.to_dict()
+    _write(_path("graph", full_key + ".json"), json.dumps(graph, ensure_ascii=False).encode("utf-8"))
+    _evict()
+    stats.elapsed_ms = (time.perf_counter() - started) * 1000.0
+    _record(stats)
+    return graph, stats
+
+
+__all__ = ["CacheStats", "compile_graph", "statement_keys"]
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+src.log
+=======
+
+流水线统一日志。
+
+各模块通过 get_logger(__name__) 取得 "pipeline.*" 下的 logger：阶段级进度用 info，
+逐节点 / 逐连线的细节用 debug，并且一律使用 %-占位符传参，级别未开启时不做任何字符串格式化。
+
+环境变量：
+- PIPELINE_LOG_LEVEL：DEBUG / INFO / WARNING / ERROR，默认 INFO（命令行运行时的输出与以前一致，
+  只是逐节点细节需要 DEBUG 才显示）
+- PIPELINE_QUIET=1：安静模式，等价于 WARNING，服务端默认使用
+- PIPELINE_LOG_FORMAT=json：每行输出一个 JSON 对象（ts / level / logger / msg 以及 extra 中的字段）
+
+错误信息仍由 src.error_handler.handle_error 直接输出，不受日志级别影响。
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import sys
+from typing import Any, Dict, Optional
+
+ROOT_LOGGER = "pipeline"
+
+# LogRecord 自带的属性，其余的（通过 extra= 传入的）作为结构化字段输出
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        doc: Dict[str, Any] = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and not key.startswith("_"):
+                doc[key] = value
+        if record.exc_info:
+            doc["exc"] = self.formatException(record.exc_info)
+        return json.dumps(doc, ensure_ascii=False, default=str)
+
+
+class _StdoutHandler(logging.StreamHandler):
+    """始终写到当前的 sys.stdout（兼容 contextlib.redirect_stdout 等替换 stdout 的调用方）。"""
+
+    def __init__(self) -> None:
+        super().__init__(sys.stdout)
+
+    @property  # type: ignore[override]
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, _value) -> None:
+        pass
+
+
+def _level_from_env() -> int:
+    if os.getenv("PIPELINE_QUIET", "0") == "1":
+        return logging.WARNING
+    name = os.getenv("PIPELINE_LOG_LEVEL", "INFO").strip().upper()
+    level = logging.getLevelName(name)
+    return level if isinstance(level, int) else logging.INFO
+
+
+def setup_logging(level: Optional[int] = None) -> logging.Logger:
+    """
+    配置 "pipeline" logger（幂等）。level 为 None 时按环境变量决定。
+    文本格式只输出消息本身，保持原先 print 的观感。
+    """
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(_level_from_env() if level is None else level)
+    if not any(isinstance(h, _StdoutHandler) for h in root.handlers):
+        handler = _StdoutHandler()
+        if os.getenv("PIPELINE_LOG_FORMAT", "").strip().lower() == "json":
+            handler.setFormatter(JsonFormatter())
+        else:
+            handler.setFormatter(logging.Formatter("%(message)s"))
+        root.addHandler(handler)
+        root.propagate = False
+    return root
+
+
+def get_logger(name: str = "") -> logging.Logger:
+    """pipeline 子 logger；首次使用时按环境变量完成配置。"""
+    root = logging.getLogger(ROOT_LOGGER)
+    if not root.handlers:
+        setup_logging()
+    if not name or name == "__main__":
+        return root
+    if name.startswith("src."):
+        name = name[4:]
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+__all__ = ["ROOT_LOGGER", "JsonFormatter", "setup_logging", "get_logger"]
@@ -16,17 +16,19 @@ from __future__ import annotations
 import json
 import sys
 from pathlib import Path
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 from converter_v2 import convert_dsl_to_graph
 from constantvalue import apply_constant_modifications
 from batch_add_modules import add_modules
 from modifier import apply_data_type_modifications
 from layout_chip import run_layout_engine, find_and_update_chip_graph
-from batch_connect import apply_connections
+from batch_connect import apply_connections_to_data
 from archive_creator import run_archive_creation_stage
 from src.special_modules import build_special_module, append_unused_variable_definitions
 from src.type_inference import infer_gate_data_types
+from src.profiler import StageProfiler, profiler_from_env
+from src.log import get_logger
 from src.error_handler import (
     PipelineError,
     ModuleAddError,
@@ -44,7 +46,6 @@ from src.config import (
     DATA_PATH,
     CONNECT_OUT_PATH,
     RULES_PATH,
-    MODIFIED_SAVE_PATH,
     FINAL_SAVE_PATH,
     FUZZY_CUTOFF_NODE,
     FUZZY_CUTOFF_PORT,
@@ -52,6 +53,8 @@ from src.config import (
 )
 from src.utils import load_json, normalize, fuzzy_match
 
+log = get_logger(__name__)
+
 
 # =========================== 阶段 0：DSL -> graph.json ===========================
 
@@ -59,9 +62,9 @@ def run_stage0_convert_dsl_to_graph(dsl_path: Path, out_graph_path: Path) -> Non
     """
     使用 converter_v2.convert_dsl_to_graph 将 DSL 脚本转为 graph.json。
     """
-    print("--- 阶段 0: 将 input.py 转换为 graph.json ---")
+    log.info("--- 阶段 0: 将 input.py 转换为 graph.json ---")
     convert_dsl_to_graph(dsl_script_path=dsl_path, output_path=out_graph_path)
-    print(f"✔ 已从 '{dsl_path}' 生成 '{out_graph_path}'")
+    log.info("✔ 已从 '%s' 生成 '%s'", dsl_path, out_graph_path)
 
 
 # =========================== graph.json 解析相关 ===========================
@@ -279,7 +282,7 @@ def run_batch_add(modules_to_add: List[Any], node_map: Dict[str, dict]) -> Dict[
     调用 batch_add_modules.add_modules，将 DSL 中的节点实际添加到存档 data.json 里。
     同时回填 node_map[*]["new_full_id"]。
     """
-    print("📦 正在执行模块添加...")
+    log.info("📦 正在执行模块添加...")
     try:
         game_data = load_json(DATA_PATH, "原始游戏存档")
         module_defs = load_json(MODULE_DEF_PATH, "模块定义")
@@ -310,9 +313,9 @@ def run_batch_add(modules_to_add: List[Any], node_map: Dict[str, dict]) -> Dict[
             original_error=e
         )
 
-    print(f"✔ 模块添加逻辑执行完毕，获得 {len(created_nodes_info)} 个新节点信息")
+    log.info("✔ 模块添加逻辑执行完毕，获得 %s 个新节点信息", len(created_nodes_info))
     if len(created_nodes_info) != len(modules_to_add):
-        print(f"⚠️ 警告：请求添加 {len(modules_to_add)} 个模块，实际成功创建 {len(created_nodes_info)} 个")
+        log.warning("⚠️ 警告：请求添加 %s 个模块，实际成功创建 %s 个", len(modules_to_add), len(created_nodes_info))
 
     # 按顺序回填 new_full_id
     nodes_in_map = sorted(node_map.values(), key=lambda x: x["order_index"])
@@ -324,7 +327,7 @@ def run_batch_add(modules_to_add: List[Any], node_map: Dict[str, dict]) -> Dict[
             )
             node_map[original_id]["new_full_id"] = created_node["full_id"]
         else:
-            print(f"⚠️ 警告: 创建了一个多余的节点 {created_node['full_id']}，无法在 node_map 中找到对应项")
+            log.warning("⚠️ 警告: 创建了一个多余的节点 %s，无法在 node_map 中找到对应项", created_node['full_id'])
 
     unmatched = [meta["friendly_name"] for meta in node_map.values() if meta["new_full_id"] is None]
     if unmatched:
@@ -388,9 +391,7 @@ def generate_modify_instructions(
             )
         else:
             if explicit_dt:
-                print(
-                f"⚠️ 警告：节点 '{original_id}' 定义了 data_type/datatype 但未找到其生成的 ID，将跳过"
-            )
+                log.warning("⚠️ 警告：节点 '%s' 定义了 data_type/datatype 但未找到其生成的 ID，将跳过", original_id)
     return instructions
 
 
@@ -480,63 +481,58 @@ def build_connections(graph: dict, node_map: Dict[str, dict], chip_index: Dict[s
 
 # =========================== 批量连线 & 自动布局 ===========================
 
-def run_batch_connect(input_path: Path) -> None:
-    print("🔗 正在执行批量连线 ...")
-    if not input_path.exists():
-        raise FileIOError(
-            f"在执行连线前，未找到输入存档文件",
-            file_path=str(input_path)
-        )
-
+def run_batch_connect(save_data: Dict[str, Any], connections: List[dict]) -> Dict[str, Any]:
+    """在内存中的存档上执行批量连线（原地修改），返回同一个存档 dict。"""
+    log.info("🔗 正在执行批量连线 ...")
     try:
-        success = apply_connections(
-            input_graph_path=str(input_path),
-            connections_path=str(CONNECT_OUT_PATH),
-            output_graph_path=str(FINAL_SAVE_PATH),
-        )
+        apply_connections_to_data(save_data, connections)
     except Exception as e:
         raise ConnectionError(
             f"批量连线过程中发生错误: {str(e)}",
             original_error=e
         )
-    
-    if not success:
-        raise ConnectionError("批量连线过程中发生错误，流程终止")
-
+    return save_data
 
-def run_auto_layout() -> None:
-    print("🎨 正在对最终存档文件进行自动布局...")
-    if not FINAL_SAVE_PATH.exists():
-        print(f"⚠️ 警告：找不到最终存档文件 '{FINAL_SAVE_PATH}'，跳过自动布局步骤")
-        return
 
-    full_save_data = load_json(FINAL_SAVE_PATH, "最终游戏存档")
+def run_auto_layout(save_data: Dict[str, Any]) -> int:
+    """对内存中的存档做自动布局（原地更新坐标），返回参与布局的节点数（跳过时为 0）。"""
+    log.info("🎨 正在对最终存档进行自动布局...")
     try:
-        save_obj = full_save_data["saveObjectContainers"][0]["saveObjects"]
+        save_obj = save_data["saveObjectContainers"][0]["saveObjects"]
         chip_graph_str = next(
             md["stringValue"] for md in save_obj["saveMetaDatas"] if md.get("key") == "chip_graph"
         )
         chip_nodes = json.loads(chip_graph_str).get("Nodes", [])
     except (KeyError, IndexError, StopIteration, json.JSONDecodeError) as e:
-        print(
-            f"⚠️ 警告：在存档文件 '{FINAL_SAVE_PATH}' 中无法找到或解析 'chip_graph'，跳过布局。错误: {e}"
-        )
-        return
+        log.warning("⚠️ 警告：在存档中无法找到或解析 'chip_graph'，跳过布局。错误: %s", e)
+        return 0
 
     if not chip_nodes:
-        print("ℹ️ 'chip_graph' 中没有节点，无需布局")
-        return
+        log.info("ℹ️ 'chip_graph' 中没有节点，无需布局")
+        return 0
 
-    print(f"   从存档中找到 {len(chip_nodes)} 个节点进行布局")
+    log.info("   从存档中找到 %s 个节点进行布局", len(chip_nodes))
     final_positions = run_layout_engine(chip_nodes)
-    print("   使用新坐标更新存档数据...")
-    updated = find_and_update_chip_graph(full_save_data, final_positions)
-    if updated:
-        with FINAL_SAVE_PATH.open("w", encoding="utf-8") as f:
-            json.dump(full_save_data, f, separators=(",", ":"))
-        print(f"✔ 自动布局完成，已更新存档文件: '{FINAL_SAVE_PATH}'")
+    log.info("   使用新坐标更新存档数据...")
+    if find_and_update_chip_graph(save_data, final_positions):
+        log.info("✔ 自动布局完成")
     else:
-        print("⚠️ 错误：布局计算完成，但在存档中更新坐标失败。文件未被修改")
+        log.error("⚠️ 错误：布局计算完成，但在存档中更新坐标失败。坐标保持不变")
+    return len(chip_nodes)
+
+
+def write_final_save(save_data: Dict[str, Any]) -> None:
+    """把最终存档紧凑地写到 FINAL_SAVE_PATH，供归档阶段打包。"""
+    try:
+        with FINAL_SAVE_PATH.open("w", encoding="utf-8") as f:
+            json.dump(save_data, f, ensure_ascii=False, separators=(",", ":"))
+    except OSError as e:
+        raise FileIOError(
+            "写入最终存档文件失败",
+            file_path=str(FINAL_SAVE_PATH),
+            original_error=e
+        )
+    log.info("✔ 已写入最终存档文件: '%s'", FINAL_SAVE_PATH)
 
 
 # =========================== 常量修改指令生成 ===========================
@@ -555,9 +551,7 @@ def generate_constant_instructions(graph: dict, node_map: Dict[str, dict]) -> Li
         original_id = node["id"]
         node_attrs = node["attrs"]
         if original_id not in node_map or not node_map[original_id]["new_full_id"]:
-            print(
-                f"⚠️ 警告：常量节点 '{original_id}' 定义了 value 但未找到其生成的 ID，将跳过"
-            )
+            log.warning("⚠️ 警告：常量节点 '%s' 定义了 value 但未找到其生成的 ID，将跳过", original_id)
             continue
 
         value = node_attrs["value"]
@@ -627,14 +621,10 @@ def generate_constant_instructions(graph: dict, node_map: Dict[str, dict]) -> Li
                             )
                 new_value = norm_vecs
             else:
-                print(
-                    f"⚠️ 警告：跳过常量 '{original_id}'，因为其列表元素类型混合或不支持: {value}"
-                )
+                log.warning("⚠️ 警告：跳过常量 '%s'，因为其列表元素类型混合或不支持: %s", original_id, value)
                 continue
         else:
-            print(
-                f"⚠️ 警告：跳过常量 '{original_id}'，因为其 value 格式无法识别: {value}"
-            )
+            log.warning("⚠️ 警告：跳过常量 '%s'，因为其 value 格式无法识别: %s", original_id, value)
             continue
 
         instructions.append(
@@ -653,99 +643,118 @@ def generate_constant_instructions(graph: dict, node_map: Dict[str, dict]) -> Li
 def run_full_pipeline() -> None:
     """
     执行从 DSL 到 .melsave 的完整流水线。
+
+    设置了环境变量 PIPELINE_PROFILE 时，各阶段的耗时 / 内存 / 节点数报告写到该路径（见 src.profiler）。
     """
+    prof, profile_path = profiler_from_env()
     try:
         # 确保输出目录存在
         ensure_output_dir()
 
         # --- 阶段 0: DSL -> graph.json ---
-        run_stage0_convert_dsl_to_graph(DSL_INPUT_PATH, GRAPH_PATH)
+        with prof.stage("convert"):
+            run_stage0_convert_dsl_to_graph(DSL_INPUT_PATH, GRAPH_PATH)
 
         # --- 步骤 1: 解析输入文件 ---
-        print("\n--- 步骤 1: 解析输入文件 ---")
-        graph = load_json(GRAPH_PATH, "graph.json")
-        module_definitions = load_json(MODULE_DEF_PATH, "模块定义文件")
-        rules = load_json(RULES_PATH, "数据类型规则文件")
-
-        chip_index = build_chip_index_from_moduledef(module_definitions)
-        modules, node_map = parse_graph_v2(graph, chip_index)
-        print("✔ graph.json 解析完成")
+        log.info("--- 步骤 1: 解析输入文件 ---")
+        with prof.stage("parse") as st:
+            graph = load_json(GRAPH_PATH, "graph.json")
+            module_definitions = load_json(MODULE_DEF_PATH, "模块定义文件")
+            rules = load_json(RULES_PATH, "数据类型规则文件")
+
+            chip_index = build_chip_index_from_moduledef(module_definitions)
+            modules, node_map = parse_graph_v2(graph, chip_index)
+            st.count(nodes=len(graph["nodes"]), edges=len(graph["edges"]))
+        convert_rec = prof.get("convert")
+        if convert_rec is not None:
+            convert_rec.count(nodes=len(graph["nodes"]), edges=len(graph["edges"]))
+        log.info("✔ graph.json 解析完成")
 
         # --- 步骤 2: 批量添加模块 ---
-        print("\n--- 步骤 2: 批量添加模块 ---")
-        current_save_data = run_batch_add(modules, node_map)
-        print("✔ 模块添加完成，并已获取新节点 ID")
+        log.info("--- 步骤 2: 批量添加模块 ---")
+        with prof.stage("batch_add") as st:
+            current_save_data = run_batch_add(modules, node_map)
+            st.count(nodes=len(modules))
+        log.info("✔ 模块添加完成，并已获取新节点 ID")
 
         # --- 步骤 3: 节点修改阶段 ---
-        print("\n--- 步骤 3: 节点修改阶段 ---")
+        log.info("--- 步骤 3: 节点修改阶段 ---")
 
         # 子步骤 3.1: 修改节点数据类型
-        print("\n--- 步骤 3.1: 修改节点数据类型 ---")
-        modify_instructions = generate_modify_instructions(
-            graph,
-            node_map,
-            chip_index=chip_index,
-            module_definitions=module_definitions,
-            rules=rules,
-        )
-        if modify_instructions:
-            print(f"ℹ️  需要进行 {len(modify_instructions)} 项数据类型修改")
-            current_save_data = apply_data_type_modifications(
-                game_data=current_save_data,
-                mod_instructions=modify_instructions,
+        log.info("--- 步骤 3.1: 修改节点数据类型 ---")
+        with prof.stage("modify_types") as st:
+            modify_instructions = generate_modify_instructions(
+                graph,
+                node_map,
+                chip_index=chip_index,
+                module_definitions=module_definitions,
                 rules=rules,
-                module_defs=module_definitions,
             )
-            print("✔ 数据类型修改完成")
-        else:
-            print("ℹ️ 无需修改数据类型，跳过此步骤")
+            st.count(nodes=len(modify_instructions), edges=len(graph["edges"]))
+            if modify_instructions:
+                log.info("ℹ️  需要进行 %s 项数据类型修改", len(modify_instructions))
+                current_save_data = apply_data_type_modifications(
+                    game_data=current_save_data,
+                    mod_instructions=modify_instructions,
+                    rules=rules,
+                    module_defs=module_definitions,
+                )
+                log.info("✔ 数据类型修改完成")
+            else:
+                log.info("ℹ️ 无需修改数据类型，跳过此步骤")
 
         # 子步骤 3.2: 修改常量节点
-        print("\n--- 步骤 3.2: 修改常量节点 ---")
-        constant_instructions = generate_constant_instructions(graph, node_map)
-        if constant_instructions:
-            print(f"ℹ️  需要进行 {len(constant_instructions)} 项常量值修改")
-            current_save_data = apply_constant_modifications(
-                game_data=current_save_data,
-                instructions=constant_instructions,
-            )
-            print("✔ 常量值修改完成")
-        else:
-            print("ℹ️ 无需修改常量值，跳过此步骤")
+        log.info("--- 步骤 3.2: 修改常量节点 ---")
+        with prof.stage("modify_constants") as st:
+            constant_instructions = generate_constant_instructions(graph, node_map)
+            st.count(nodes=len(constant_instructions))
+            if constant_instructions:
+                log.info("ℹ️  需要进行 %s 项常量值修改", len(constant_instructions))
+                current_save_data = apply_constant_modifications(
+                    game_data=current_save_data,
+                    instructions=constant_instructions,
+                )
+                log.info("✔ 常量值修改完成")
+            else:
+                log.info("ℹ️ 无需修改常量值，跳过此步骤")
 
         # --- 步骤 4: 生成连线指令 ---
-        print("\n--- 步骤 4: 生成连线指令 ---")
-        conns = build_connections(graph, node_map, chip_index)
-        CONNECT_OUT_PATH.write_text(
-            json.dumps(conns, ensure_ascii=False, indent=2),
-            encoding="utf-8",
-        )
-        print(f"✔ 已生成连线指令到 {CONNECT_OUT_PATH}")
+        log.info("--- 步骤 4: 生成连线指令 ---")
+        with prof.stage("build_connections") as st:
+            conns = build_connections(graph, node_map, chip_index)
+            CONNECT_OUT_PATH.write_text(
+                json.dumps(conns, ensure_ascii=False, indent=2),
+                encoding="utf-8",
+            )
+            st.count(edges=len(conns))
+        log.info("✔ 已生成连线指令到 %s", CONNECT_OUT_PATH)
 
         # --- 步骤 5: 执行批量连线 ---
-        print("\n--- 步骤 5: 执行批量连线 ---")
-        print(f"ℹ️ 将当前存档状态写入到 '{MODIFIED_SAVE_PATH}' 以进行连线")
-        with MODIFIED_SAVE_PATH.open("w", encoding="utf-8") as f:
-            json.dump(current_save_data, f, ensure_ascii=False, indent=4)
-
-        run_batch_connect(MODIFIED_SAVE_PATH)
+        log.info("--- 步骤 5: 执行批量连线 ---")
+        with prof.stage("batch_connect") as st:
+            current_save_data = run_batch_connect(current_save_data, conns)
+            st.count(edges=len(conns))
 
         # --- 步骤 6: 执行自动布局 ---
-        print("\n--- 步骤 6: 执行自动布局 ---")
-        run_auto_layout()
-
-        if MODIFIED_SAVE_PATH.exists():
-            MODIFIED_SAVE_PATH.unlink()
+        log.info("--- 步骤 6: 执行自动布局 ---")
+        with prof.stage("layout") as st:
+            st.count(nodes=run_auto_layout(current_save_data))
 
         # --- 阶段 7: 创建 .melsave 归档文件 ---
-        print("\n--- 阶段 7: 创建 .melsave 归档文件 ---")
-        run_archive_creation_stage()
-
-        print("\n🎉 全部流程完成！")
+        log.info("--- 阶段 7: 创建 .melsave 归档文件 ---")
+        with prof.stage("archive"):
+            write_final_save(current_save_data)
+            run_archive_creation_stage()
+
+        if prof.enabled:
+            log.info("%s", prof.summary())
+        log.info("🎉 全部流程完成！")
     
     except (PipelineError, ModuleAddError, ConnectionError, FileIOError, TypeInferenceError) as e:
+        _dump_profile(prof, profile_path)
         handle_error(e)
     except Exception as e:
+        _dump_profile(prof, profile_path)
         # 捕获未处理的异常，包装为 PipelineError
         pipeline_error = PipelineError(
             f"流水线执行过程中发生未预期的错误: {str(e)}",
@@ -753,6 +762,18 @@ def run_full_pipeline() -> None:
             original_error=e
         )
         handle_error(pipeline_error)
+    else:
+        _dump_profile(prof, profile_path)
+
+
+def _dump_profile(prof: StageProfiler, path: Optional[Path]) -> None:
+    # 计时报告是附带信息，写失败不能影响流水线本身的结果
+    if path is None:
+        return
+    try:
+        prof.dump(path)
+    except OSError as e:
+        log.warning("⚠️ 警告：写入阶段计时报告失败: %s", e)
 
 
 __all__ = [
@@ -766,4 +787,5 @@ __all__ = [
     "build_connections",
     "run_batch_connect",
     "run_auto_layout",
+    "write_final_save",
 ]
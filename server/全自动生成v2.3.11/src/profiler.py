@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+src.profiler
+============
+
+流水线分阶段计时（可选）。
+
+环境变量 PIPELINE_PROFILE 指向一个 JSON 文件路径时启用：run_full_pipeline 会把每个阶段的
+墙钟时间、CPU 时间、峰值 RSS 增量以及节点 / 边数量写到该文件（流程出错时同样写出已完成的阶段）。
+未设置时 stage() 只是一个空的上下文管理器，不产生额外开销。
+
+峰值 RSS 取自 resource.getrusage（进程生命周期内的最高水位），"增量"表示该阶段把最高水位抬高了多少；
+Windows 上没有 resource 模块，该字段为 None。同一进程内多次运行时（如 bench_pipeline.py）最高水位不会回落，
+此时可开启 tracemalloc，每个阶段额外记录 Python 对象分配的峰值（py_alloc_peak_kb）。
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None  # type: ignore[assignment]
+
+
+PROFILE_ENV = "PIPELINE_PROFILE"
+
+
+def _peak_rss_kb() -> Optional[int]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+@dataclass
+class StageRecord:
+    name: str
+    wall_ms: float = 0.0
+    cpu_ms: float = 0.0
+    peak_rss_delta_kb: Optional[int] = None
+    py_alloc_peak_kb: Optional[int] = None
+    nodes: Optional[int] = None
+    edges: Optional[int] = None
+    ok: bool = True
+
+    def count(self, nodes: Optional[int] = None, edges: Optional[int] = None) -> None:
+        if nodes is not None:
+            self.nodes = nodes
+        if edges is not None:
+            self.edges = edges
+
+
+class StageProfiler:
+    def __init__(self, enabled: bool = True) -> None:
+        self.enabled = enabled
+        self.stages: List[StageRecord] = []
+        self._wall0 = time.perf_counter()
+        self._cpu0 = time.process_time()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[StageRecord]:
+        rec = StageRecord(name=name)
+        if not self.enabled:
+            yield rec
+            return
+        rss0 = _peak_rss_kb()
+        tracing = tracemalloc.is_tracing() and hasattr(tracemalloc, "reset_peak")  # 3.9+
+        if tracing:
+            alloc0 = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        wall0 = time.perf_counter()
+        cpu0 = time.process_time()
+        try:
+            yield rec
+        except BaseException:
+            rec.ok = False
+            raise
+        finally:
+            rec.wall_ms = round((time.perf_counter() - wall0) * 1000.0, 3)
+            rec.cpu_ms = round((time.process_time() - cpu0) * 1000.0, 3)
+            rss1 = _peak_rss_kb()
+            if rss0 is not None and rss1 is not None:
+                rec.peak_rss_delta_kb = rss1 - rss0
+            if tracing:
+                rec.py_alloc_peak_kb = max(0, tracemalloc.get_traced_memory()[1] - alloc0) // 1024
+            self.stages.append(rec)
+
+    def get(self, name: str) -> Optional[StageRecord]:
+        for rec in self.stages:
+            if rec.name == name:
+                return rec
+        return None
+
+    def report(self) -> Dict[str, Any]:
+        rss = _peak_rss_kb()
+        return {
+            "version": 1,
+            "ok": all(s.ok for s in self.stages),
+            "total_wall_ms": round((time.perf_counter() - self._wall0) * 1000.0, 3),
+            "total_cpu_ms": round((time.process_time() - self._cpu0) * 1000.0, 3),
+            "peak_rss_kb": rss,
+            "stages": [asdict(s) for s in self.stages],
+        }
+
+    def summary(self) -> str:
+        parts = [f"{s.name} {s.wall_ms:.0f}ms" for s in self.stages]
+        return "⏱ 阶段耗时：" + "，".join(parts)
+
+    def dump(self, path: Path) -> None:
+        if not self.enabled:
+            return
+        path = Path(path)
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(json.dumps(self.report(), ensure_ascii=False, indent=2), encoding="utf-8")
+        os.replace(tmp, path)
+
+
+def profiler_from_env() -> Tuple[StageProfiler, Optional[Path]]:
+    """(profiler, 报告路径)；未设置 PIPELINE_PROFILE 时返回禁用的 profiler 与 None。"""
+    target = os.getenv(PROFILE_ENV, "").strip()
+    if not target:
+        return StageProfiler(enabled=False), None
+    return StageProfiler(enabled=True), Path(target)
+
+
+__all__ = ["PROFILE_ENV", "StageRecord", "StageProfiler", "profiler_from_env"]
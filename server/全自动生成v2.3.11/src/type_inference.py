@@ -9,13 +9,16 @@ src.type_inference
 目标：
 - AI 忘记写 attrs.data_type 时，仍然能根据连线与常量/变量定义推导出合理类型；
 - 类型系统保持简单：1/2/4/8（Signal/Decimal/String/Vector）。
+
+实现：节点 id 先 intern 成 0..n-1，用数组版并查集（按秩合并 + 完全路径压缩）；
+每个 (节点, 方向) 的端口表只归一化一次，每条边的端口类型表达式只求一次，
+之后的约束传播都在这份预处理好的边表上做。
 """
 
 from __future__ import annotations
 
 from collections import Counter
-from dataclasses import dataclass
-from typing import Any, Dict, Iterable, List, Optional, Tuple
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
 
 from src.utils import fuzzy_match, normalize
 from src.config import FUZZY_CUTOFF_PORT
@@ -100,6 +103,10 @@ def _infer_constant_type(attrs: Dict[str, Any]) -> int | None:
 
 
 def _port_index(port_name: str, port_list: List[str]) -> int | None:
+    return _port_index_normalized(port_name, port_list, [normalize(p) for p in port_list])
+
+
+def _port_index_normalized(port_name: str, port_list: List[str], normalized_ports: List[str]) -> int | None:
     if not port_list:
         return None
     if len(port_list) == 1:
@@ -107,61 +114,77 @@ def _port_index(port_name: str, port_list: List[str]) -> int | None:
     if isinstance(port_name, str) and port_name.isdigit():
         idx = int(port_name)
         return idx if 0 <= idx < len(port_list) else None
-    normalized_ports = [normalize(p) for p in port_list]
     best = fuzzy_match(normalize(str(port_name)), normalized_ports, FUZZY_CUTOFF_PORT)
     return normalized_ports.index(best) if best is not None else None
 
 
-@dataclass(frozen=True)
-class _PortTypeExpr:
-    kind: str  # "fixed" | "var"
-    value: int | str
+class _PortTypeExpr(NamedTuple):
+    kind: str  # "fixed"（value 为类型）| "var"（value 为并查集下标）
+    value: int
 
 
 class _UnionFind:
+    """数组版并查集：按秩合并 + 完全路径压缩；fixed 只在根上有效，0 表示未定。"""
+
     def __init__(self, items: Iterable[str]) -> None:
-        self.parent: Dict[str, str] = {}
-        self.rank: Dict[str, int] = {}
-        self.fixed: Dict[str, int] = {}
-        self.conflicts: List[Tuple[str, int, int]] = []
+        self.index: Dict[str, int] = {}
+        self.parent: List[int] = []
+        self.rank: List[int] = []
+        self.fixed: List[int] = []
+        self.conflicts: List[Tuple[int, int, int]] = []
         for it in items:
-            self.parent[it] = it
-            self.rank[it] = 0
-
-    def find(self, x: str) -> str:
-        p = self.parent.get(x, x)
-        if p != x:
-            self.parent[x] = self.find(p)
-        return self.parent.get(x, x)
-
-    def set_fixed(self, x: str, t: int) -> None:
+            self.add(it)
+
+    def add(self, key: str) -> int:
+        i = self.index.get(key)
+        if i is None:
+            i = len(self.parent)
+            self.index[key] = i
+            self.parent.append(i)
+            self.rank.append(0)
+            self.fixed.append(0)
+        return i
+
+    def find(self, x: int) -> int:
+        parent = self.parent
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    def set_fixed(self, x: int, t: int) -> None:
         if t not in TYPE_DOMAIN:
             return
         r = self.find(x)
-        cur = self.fixed.get(r)
-        if cur is None:
+        cur = self.fixed[r]
+        if not cur:
             self.fixed[r] = t
         elif cur != t:
             self.conflicts.append((r, cur, t))
 
-    def union(self, a: str, b: str) -> None:
+    def union(self, a: int, b: int) -> None:
         ra, rb = self.find(a), self.find(b)
         if ra == rb:
             return
-        if self.rank[ra] < self.rank[rb]:
+        rank = self.rank
+        if rank[ra] < rank[rb]:
             ra, rb = rb, ra
         self.parent[rb] = ra
-        if self.rank[ra] == self.rank[rb]:
-            self.rank[ra] += 1
+        if rank[ra] == rank[rb]:
+            rank[ra] += 1
 
-        ta = self.fixed.get(ra)
-        tb = self.fixed.get(rb)
-        if ta is None and tb is not None:
+        ta, tb = self.fixed[ra], self.fixed[rb]
+        if not ta and tb:
             self.fixed[ra] = tb
-        elif ta is not None and tb is not None and ta != tb:
+        elif ta and tb and ta != tb:
             self.conflicts.append((ra, ta, tb))
 
 
+_ARRAY_ELEMENT_TYPE = {128: 2, 256: 4, 512: 8, 1024: 1}
+
+
 def infer_gate_data_types(
     graph: Dict[str, Any],
     *,
@@ -183,7 +206,7 @@ def infer_gate_data_types(
     uf = _UnionFind(node_ids)
 
     node_default: Dict[str, int | None] = {}
-    vector_hints: Dict[str, int] = {}
+    vector_hints: Dict[int, int] = {}
 
     # 1) 给每个节点一个“默认类型”与“已知类型”（显式/常量/变量）
     for n in nodes:
@@ -196,7 +219,7 @@ def infer_gate_data_types(
 
         explicit = _parse_explicit_data_type(attrs)
         if explicit is not None:
-            uf.set_fixed(nid, explicit)
+            uf.set_fixed(uf.index[nid], explicit)
             node_default[nid] = explicit
             continue
 
@@ -206,7 +229,7 @@ def infer_gate_data_types(
         if friendly == "constant":
             t = _infer_constant_type(attrs)
             if t is not None:
-                uf.set_fixed(nid, t)
+                uf.set_fixed(uf.index[nid], t)
             node_default[nid] = t
             continue
 
@@ -214,7 +237,7 @@ def infer_gate_data_types(
             var_gate = meta.get("var_gate_type")
             t = _type_from_port_type_str(var_gate) if isinstance(var_gate, str) else None
             if t is not None:
-                uf.set_fixed(nid, t)
+                uf.set_fixed(uf.index[nid], t)
             node_default[nid] = t
             continue
 
@@ -227,35 +250,87 @@ def infer_gate_data_types(
                 gate_default = gd
         node_default[nid] = gate_default
 
-    def port_expr(nid: str, *, direction: str, port_name: str) -> _PortTypeExpr | None:
+    # 端口类型表达式只取决于“节点签名”（种类 / chip / op_type / 变量类型 / 常量类型）+ 方向 + 端口名，
+    # 与具体节点无关：按此缓存模板，"var" 模板（类型随节点自身）返回时再绑定到节点的并查集下标。
+    # chip 定义里没有端口表、要退回节点实例端口的，缓存 key 里带上节点 id。
+    _SELF = -1
+    chip_keys: Dict[str, str] = {}
+    sig_cache: Dict[str, Tuple[Any, ...]] = {}
+    chip_tables: Dict[Tuple[str, str], Tuple[List[str], List[str]]] = {}
+    index_cache: Dict[Tuple[str, str, str], int | None] = {}
+    template_cache: Dict[Tuple[Any, ...], _PortTypeExpr | None] = {}
+    var_exprs: Dict[str, _PortTypeExpr] = {}
+
+    def node_signature(nid: str) -> Tuple[Any, ...]:
         meta = node_map.get(nid) or {}
-        friendly = str(meta.get("friendly_name", "")).lower()
-
-        chip_key = normalize(str(meta.get("friendly_name", "")))
-        info = chip_index.get(chip_key) or {}
-        port_list = info.get(direction) or []
-        if not isinstance(port_list, list):
-            port_list = []
+        friendly_raw = str(meta.get("friendly_name", ""))
+        chip_key = chip_keys.get(friendly_raw)
+        if chip_key is None:
+            chip_key = chip_keys[friendly_raw] = normalize(friendly_raw)
+        friendly = friendly_raw.lower()
+        var_gate = meta.get("var_gate_type") if friendly == "variable" else None
+        const_t = node_default.get(nid) if friendly == "constant" else None
+        return (friendly, chip_key, meta.get("op_type"), var_gate, const_t)
+
+    def chip_table(chip_key: str, direction: str) -> Tuple[List[str], List[str]]:
+        key = (chip_key, direction)
+        table = chip_tables.get(key)
+        if table is None:
+            info = chip_index.get(chip_key) or {}
+            port_list = info.get(direction) or []
+            if not isinstance(port_list, list):
+                port_list = []
+            names = [str(p) for p in port_list]
+            table = chip_tables[key] = (names, [normalize(p) for p in names])
+        return table
 
+    def port_expr(nid: str, *, direction: str, port_name: str) -> _PortTypeExpr | None:
+        sig = sig_cache.get(nid)
+        if sig is None:
+            sig = sig_cache[nid] = node_signature(nid)
+        if chip_table(sig[1], direction)[0]:
+            key = (sig, direction, port_name)
+        else:
+            key = (sig, direction, port_name, nid)
+        if key in template_cache:
+            tpl = template_cache[key]
+        else:
+            tpl = template_cache[key] = _port_expr_template(nid, sig, direction, port_name)
+        if tpl is not None and tpl.kind == "var":
+            expr = var_exprs.get(nid)
+            if expr is None:
+                expr = var_exprs[nid] = _PortTypeExpr("var", uf.add(nid))
+            return expr
+        return tpl
+
+    def _port_expr_template(
+        nid: str, sig: Tuple[Any, ...], direction: str, port_name: str
+    ) -> _PortTypeExpr | None:
+        friendly, chip_key, op_type, var_gate, const_t = sig
+        names, normalized = chip_table(chip_key, direction)
         inst_ports = None
-        if not port_list:
+        if names:
+            ck = (chip_key, direction, port_name)
+            if ck in index_cache:
+                idx = index_cache[ck]
+            else:
+                idx = index_cache[ck] = _port_index_normalized(port_name, names, normalized)
+        else:
             inst = nodes_by_id.get(nid) or {}
             inst_ports = inst.get(direction) or []
             if not isinstance(inst_ports, list):
                 inst_ports = []
-            port_list = [p.get("name", "") if isinstance(p, dict) else str(p) for p in inst_ports]
-
-        idx = _port_index(port_name, [str(p) for p in port_list])
+            names = [str(p.get("name", "") if isinstance(p, dict) else str(p)) for p in inst_ports]
+            idx = _port_index(port_name, names)
         if idx is None:
             return None
 
         # 特殊节点：I/O / Variable / Constant 的端口类型规则在此内置
         if friendly == "output":
-            return _PortTypeExpr("var", nid)
+            return _PortTypeExpr("var", _SELF)
         if friendly == "input":
-            return _PortTypeExpr("var", nid)
+            return _PortTypeExpr("var", _SELF)
         if friendly == "variable":
-            var_gate = meta.get("var_gate_type")
             t = _type_from_port_type_str(var_gate) if isinstance(var_gate, str) else None
             if direction == "inputs":
                 # inputs: ["Value", "Set"]
@@ -265,10 +340,8 @@ def infer_gate_data_types(
             # outputs: ["Value"]
             return _PortTypeExpr("fixed", t) if t is not None else None
         if friendly == "constant":
-            t = node_default.get(nid)
-            return _PortTypeExpr("fixed", t) if isinstance(t, int) else None
+            return _PortTypeExpr("fixed", const_t) if isinstance(const_t, int) else None
 
-        op_type = meta.get("op_type")
         op_key = str(op_type) if op_type is not None else None
         rule = rules.get(op_key) if op_key is not None else None
         if isinstance(rule, dict):
@@ -278,7 +351,7 @@ def infer_gate_data_types(
                 if r is None or r == "any":
                     return None
                 if r == "same":
-                    return _PortTypeExpr("var", nid)
+                    return _PortTypeExpr("var", _SELF)
                 if isinstance(r, int) and r in TYPE_DOMAIN:
                     return _PortTypeExpr("fixed", r)
 
@@ -303,7 +376,9 @@ def infer_gate_data_types(
 
         return None
 
-    # 2) 根据每条边做类型约束（端口类型相等）
+    # 2) 单遍扫描边表：求出两端的端口类型表达式并施加约束（端口类型相等）；
+    #    ArraysGet 的 Output[0] 边先记下来，等全部约束完成后再回灌元素类型
+    array_get_edges: List[Tuple[str, _PortTypeExpr]] = []
     for e in edges:
         if not isinstance(e, dict):
             continue
@@ -316,87 +391,52 @@ def infer_gate_data_types(
 
         left = port_expr(f_nid, direction="outputs", port_name=f_port)
         right = port_expr(t_nid, direction="inputs", port_name=t_port)
+
+        if right is not None and right.kind == "var":
+            f_sig = sig_cache[f_nid]
+            if f_sig[0] == "arraysget":
+                names, normalized = chip_table(f_sig[1], "outputs")
+                if _port_index_normalized(f_port, names, normalized) == 0:
+                    array_get_edges.append((f_nid, right))
+
         if left is None or right is None:
             continue
-
         if left.kind == "fixed" and right.kind == "fixed":
-            if left.value != right.value:
-                # 冲突：先记录；最后仍按“显式/默认”兜底
-                pass
+            # 冲突：不处理；最后仍按“显式/默认”兜底
             continue
         if left.kind == "var" and right.kind == "fixed":
             # 兼容规则：Number(Decimal) 可以直接连 Vector。
             # 这里把 Vector 视为“软约束”：不强制回推到上游节点类型，只做一个偏好提示。
-            if int(right.value) == 8:
-                vector_hints[str(left.value)] = vector_hints.get(str(left.value), 0) + 1
+            if right.value == 8:
+                vector_hints[left.value] = vector_hints.get(left.value, 0) + 1
                 continue
-            uf.set_fixed(str(left.value), int(right.value))
+            uf.set_fixed(left.value, right.value)
             continue
         if left.kind == "fixed" and right.kind == "var":
-            if int(left.value) == 8:
-                vector_hints[str(right.value)] = vector_hints.get(str(right.value), 0) + 1
+            if left.value == 8:
+                vector_hints[right.value] = vector_hints.get(right.value, 0) + 1
                 continue
-            uf.set_fixed(str(right.value), int(left.value))
-            continue
-        if left.kind == "var" and right.kind == "var":
-            uf.union(str(left.value), str(right.value))
+            uf.set_fixed(right.value, left.value)
             continue
+        uf.union(left.value, right.value)
 
     # 2.5) ArraysGet 多态：若已能确定其 ArrayXxx 类型，则把 Output[0] 的元素类型回灌给下游节点
-    for e in edges:
-        if not isinstance(e, dict):
-            continue
-        f_nid = e.get("from_node")
-        t_nid = e.get("to_node")
-        f_port = e.get("from_port")
-        t_port = e.get("to_port")
-        if not all(isinstance(x, str) for x in (f_nid, t_nid, f_port, t_port)):
-            continue
-
-        f_meta = node_map.get(f_nid) or {}
-        if str(f_meta.get("friendly_name", "")).lower() != "arraysget":
-            continue
-
-        chip_key = normalize(str(f_meta.get("friendly_name", "")))
-        info = chip_index.get(chip_key) or {}
-        outs = info.get("outputs") or []
-        if not isinstance(outs, list):
-            continue
-        out_idx = _port_index(f_port, [str(p) for p in outs])
-        if out_idx != 0:
-            continue
-
-        arr_t = uf.fixed.get(uf.find(f_nid))
-        if arr_t is None:
-            arr_t = node_default.get(f_nid)
-        if not isinstance(arr_t, int):
-            continue
-        if arr_t == 128:
-            elem_t = 2
-        elif arr_t == 256:
-            elem_t = 4
-        elif arr_t == 512:
-            elem_t = 8
-        elif arr_t == 1024:
-            elem_t = 1
-        else:
-            continue
-
-        right = port_expr(t_nid, direction="inputs", port_name=t_port)
-        if right is None:
-            continue
-        if right.kind == "var":
-            uf.set_fixed(str(right.value), int(elem_t))
+    for f_nid, right in array_get_edges:
+        arr_t = uf.fixed[uf.find(uf.add(f_nid))] or node_default.get(f_nid)
+        elem_t = _ARRAY_ELEMENT_TYPE.get(arr_t) if isinstance(arr_t, int) else None
+        if elem_t is not None:
+            uf.set_fixed(right.value, elem_t)
 
     # 3) 给每个集合选择最终类型：fixed 优先，否则用集合内默认值投票
-    groups: Dict[str, List[str]] = {}
+    index = uf.index
+    groups: Dict[int, List[str]] = {}
     for nid in node_ids:
-        groups.setdefault(uf.find(nid), []).append(nid)
+        groups.setdefault(uf.find(index[nid]), []).append(nid)
 
-    group_type: Dict[str, int] = {}
+    group_type: Dict[int, int] = {}
     for root, members in groups.items():
-        fixed = uf.fixed.get(uf.find(root))
-        if fixed is not None:
+        fixed = uf.fixed[root]
+        if fixed:
             group_type[root] = fixed
             continue
         defaults = [node_default.get(m) for m in members if node_default.get(m) in TYPE_DOMAIN]
@@ -404,7 +444,7 @@ def infer_gate_data_types(
 
         # 把“vector 软约束”作为额外投票，避免 Vector 端口把整条链强制改成 Vector，
         # 但在缺乏更强信息时仍能倾向于 Vector。
-        hint_sum = sum(vector_hints.get(m, 0) for m in members)
+        hint_sum = sum(vector_hints.get(index[m], 0) for m in members)
         if hint_sum:
             c[8] += hint_sum
 
@@ -420,8 +460,7 @@ def infer_gate_data_types(
 
     out: Dict[str, int] = {}
     for nid in node_ids:
-        root = uf.find(nid)
-        t = group_type.get(root)
+        t = group_type.get(uf.find(index[nid]))
         if isinstance(t, int) and t in TYPE_DOMAIN:
             out[nid] = t
     return out